@@ -48,7 +48,13 @@ def create_app(app):
     sso_view = cq_api.Sso.as_view('sso')
     options_view = cq_api.Options.as_view('options')
     queuing_view = cq_api.Queuing.as_view('queuing')
+    stream_view = cq_api.QueueStream.as_view('stream')
+    cracked_view = cq_api.CrackedView.as_view('cracked')
+    status_view = cq_api.JobStatus.as_view('status')
+    speed_view = cq_api.SpeedView.as_view('speed')
     add_view = cq_api.Adder.as_view('adder')
+    upload_view = cq_api.Upload.as_view('upload')
+    hashid_view = cq_api.HashId.as_view('hashid')
     report_view = cq_api.Reports.as_view('reports')
     tasks_view = cq_api.TasksView.as_view('tasks')
     templates_view = cq_api.TemplatesView.as_view('templates')
@@ -71,11 +77,23 @@ def create_app(app):
                      view_func=logout_view, methods=['GET'])
     app.add_url_rule('/api/options',
                      view_func=options_view, methods=['GET'])
+    app.add_url_rule('/api/queuing/stream',
+                     view_func=stream_view, methods=['GET'])
     app.add_url_rule('/api/queuing/<string:job_id>',
                      view_func=queuing_view, methods=['GET', 'DELETE',
                                                       'PUT', 'PATCH'])
+    app.add_url_rule('/api/queuing/<string:job_id>/cracked',
+                     view_func=cracked_view, methods=['GET'])
+    app.add_url_rule('/api/queuing/<string:job_id>/status',
+                     view_func=status_view, methods=['GET'])
+    app.add_url_rule('/api/queuing/<string:job_id>/speed',
+                     view_func=speed_view, methods=['GET'])
     app.add_url_rule('/api/add',
                      view_func=add_view, methods=['POST'])
+    app.add_url_rule('/api/upload',
+                     view_func=upload_view, methods=['POST'])
+    app.add_url_rule('/api/hashid',
+                     view_func=hashid_view, methods=['POST'])
     app.add_url_rule('/api/reports',
                      view_func=report_view, methods=['GET', 'POST'])
     app.add_url_rule('/api/tasks/templates', defaults={'temp_id': None},
@@ -96,6 +114,8 @@ def create_app(app):
         login_manager.init_app(app)
         db.create_all()
         app.session_interface.db.create_all()
+        cq_api.migrate_jobids()
+        wordindex.schedule()
     return app
 
 nltk.download("wordnet")
@@ -109,6 +129,6 @@ def load_user(user_id):
     """Flask load user info from db"""
     return User.query.get(user_id)
 
-from crackq import cq_api, crackqueue, run_hashcat
+from crackq import cq_api, crackqueue, run_hashcat, wordindex
 from crackq.models import User, Templates
 create_app(app)
@@ -0,0 +1,129 @@
+"""Redis pub/sub control channel for running hashcat sessions"""
+import time
+
+from crackq import events
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from redis import Redis
+from redis.exceptions import RedisError
+
+CRACK_CONF = hc_conf()
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+
+
+def channel(session):
+    """Control channel name for a session"""
+    return 'crackq:control:{}'.format(session)
+
+
+def ack_key(session):
+    """Acknowledgement list name for a session"""
+    return 'crackq:control:{}:ack'.format(session)
+
+
+def publish(session, state):
+    """
+    Publish a control message to any listener on the session channel
+
+    Arguments
+    ---------
+    session: str
+        hashcat session/job ID
+    state: str
+        CrackQ State to signal, i.e. Stop, Delete, Pause, Run/Restored
+
+    Returns
+    -------
+    receivers: int
+        number of listeners that received the message
+    """
+    logger.debug('Publishing control message {}: {}'.format(session, state))
+    return redis_con.publish(channel(session), state)
+
+
+def send(job, state):
+    """
+    Set the CrackQ State in the job meta and notify the running session
+
+    The job meta remains the source of truth, so a worker that misses
+    the message will still pick up the state change when it polls.
+
+    Arguments
+    ---------
+    job: object
+        RQ job object
+    state: str
+        CrackQ State to set
+    """
+    job.meta['CrackQ State'] = state
+    job.save_meta()
+    publish(job.id, state)
+    events.publish(job.id, {'CrackQ State': state}, delta=False)
+
+
+def ack(session):
+    """Acknowledge a control message once it has been actioned"""
+    redis_con.rpush(ack_key(session), 1)
+    redis_con.expire(ack_key(session), 60)
+
+
+def wait_ack(session, timeout=22):
+    """
+    Block until the session acknowledges a control message
+
+    Arguments
+    ---------
+    session: str
+        hashcat session/job ID
+    timeout: int
+        seconds to wait before giving up
+
+    Returns
+    -------
+    result: boolean
+        True if acknowledged, False on timeout
+    """
+    result = redis_con.blpop(ack_key(session), timeout=timeout)
+    redis_con.delete(ack_key(session))
+    return result is not None
+
+
+class Listener(object):
+    """
+    Subscriber for a session control channel, used by the worker
+    loops in place of a fixed sleep
+    """
+    def __init__(self, session):
+        self.pubsub = redis_con.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(channel(session))
+
+    def wait(self, timeout=10):
+        """
+        Wait for a control message
+
+        Arguments
+        ---------
+        timeout: int
+            seconds to block before returning
+
+        Returns
+        -------
+        state: str | None
+            CrackQ State received or None on timeout
+        """
+        try:
+            message = self.pubsub.get_message(timeout=timeout)
+        except RedisError as err:
+            logger.warning('Control channel error: {}'.format(err))
+            time.sleep(timeout)
+            message = None
+        if message and message['type'] == 'message':
+            state = message['data'].decode()
+            logger.debug('Control message received: {}'.format(state))
+            return state
+        return None
+
+    def close(self):
+        """Unsubscribe and release the connection"""
+        self.pubsub.close()
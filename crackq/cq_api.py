@@ -13,8 +13,8 @@ import crackq
 from crackq.db import db
 from crackq import db
 from crackq.logger import logger
-from crackq.models import User, Templates, Tasks
-from crackq import crackqueue, hash_modes, auth
+from crackq.models import JobOwner, User, Templates, Tasks
+from crackq import control, cracked, crackqueue, distrib, estimator, events, hash_modes, auth, hashid, hashprep, jobspec, potindex, run_hashcat, snapshot, speedcache, speedhistory, upload, wordindex
 from crackq.validator import FileValidation as valid
 from crackq.conf import hc_conf
 from crackq import app
@@ -25,7 +25,9 @@ from flask import (
     jsonify,
     redirect,
     request,
-    session)
+    Response,
+    session,
+    stream_with_context)
 from flask.views import MethodView
 from flask_bcrypt import Bcrypt
 from flask_seasurf import SeaSurf
@@ -38,14 +40,17 @@ from flask_login import (
 from functools import wraps
 from marshmallow import Schema, fields, validate, ValidationError
 from marshmallow.validate import Length, Range
+from itertools import islice
 from operator import itemgetter
 from pathlib import Path
 from pypal import pypal
 from redis import Redis
 from rq import Queue
 from rq.serializers import JSONSerializer
+from rq.worker import Worker
 from saml2 import BINDING_HTTP_POST
 from saml2 import sigver
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import exc
 
 # set perms
@@ -125,6 +130,10 @@ class job_schema(Schema):
     restore = fields.Int(validate=Range(min=0, max=1000000000000))
     benchmark_all = fields.Bool(allow_none=True)
     timeout = fields.Int(validate=Range(min=1, max=28800000), allow_none=True)
+    slices = fields.Int(validate=Range(min=0, max=1024), allow_none=True)
+    priority = fields.Int(validate=Range(min=0, max=10), allow_none=True)
+    upload_id = fields.Str(allow_none=True, validate=[StringContains(r'[^a-f0-9]'),
+                                                      Length(min=32, max=32)])
 
 
 class parse_json_schema(job_schema):
@@ -201,6 +210,7 @@ def get_jobdetails(job_details):
             'increment_max',
             'disable_brain',
             'brain_check',
+            'slices',
             'restore']
     ###***make this less ugly
     ###***review stripping here for improvement
@@ -253,62 +263,113 @@ def get_jobdetails(job_details):
     return deets_dict
 
 
-def add_jobid(job_id):
-    """Add job_id to job_ids column in user table"""
-    user = User.query.filter_by(username=current_user.username).first()
-    if user.job_ids:
-        logger.debug('Current registered job_ids: {}'.format(user.job_ids))
-        jobs = json.loads(user.job_ids)
-    else:
-        logger.debug('No job_ids registered with current user')
-        jobs = None
+def add_jobid(job_id, task_id=None):
+    """Register job_id to the current user in the job_owner table"""
+    if JobOwner.query.get(job_id):
+        logger.warning('job_id already registered: {}'.format(job_id))
+        return
     logger.debug('Registering new job_id to current user: {}'.format(job_id))
-    if isinstance(jobs, list):
-        if job_id not in jobs:
-            jobs.append(job_id)
-        else:
-            logger.warning('job_id already registered to user: {}'.format(job_id))
-    else:
-        jobs = [job_id]
-    user.job_ids = json.dumps(jobs)
+    db.session.add(JobOwner(job_id=job_id, user_id=current_user.id,
+                            task_id=task_id))
     db.session.commit()
-    logger.debug('user.job_ids: {}'.format(user.job_ids))
 
 
 def del_jobid(job_id):
-    """Delete job_id from job_ids column in user table"""
+    """Delete job_id from the job_owner table"""
     with crackq.app.app_context():
-        for user in User.query.all():
-            if user.job_ids and job_id in user.job_ids:
-                jobs = json.loads(user.job_ids)
-                logger.debug('Registered jobs: {}'.format(jobs))
-                if isinstance(jobs, list):
-                    logger.debug('Unregistering job_id: {}'.format(job_id))
-                    if job_id in jobs:
-                        jobs.remove(job_id)
-                        user.job_ids = json.dumps(jobs)
-                        db.session.commit()
-                        logger.debug('user.job_ids: {}'.format((user.job_ids)))
-                        return True
-                else:
-                    logger.error('Error removing job_id')
-            else:
-                logger.debug('Job ID not registered with user')
-        return False
+        logger.debug('Unregistering job_id: {}'.format(job_id))
+        deleted = JobOwner.query.filter_by(job_id=job_id).delete()
+        db.session.commit()
+        if not deleted:
+            logger.debug('Job ID not registered with user')
+        return bool(deleted)
+
+
+def get_jobids():
+    """Get the set of job_ids owned by the current user in a single query"""
+    owned = db.session.query(JobOwner.job_id).filter_by(
+        user_id=current_user.id)
+    return {row.job_id for row in owned}
+
+
+def check_jobids(job_ids):
+    """
+    Bulk check of which job_ids the current user owns
+
+    Arguments
+    ---------
+    job_ids: list
+        job ID strings to check
+
+    Returns
+    -------
+    owned: set
+        the job IDs from job_ids owned by the user
+    """
+    if not job_ids:
+        return set()
+    owned = db.session.query(JobOwner.job_id).filter(
+        JobOwner.user_id == current_user.id,
+        JobOwner.job_id.in_(list(job_ids)))
+    return {row.job_id for row in owned}
 
 
 def check_jobid(job_id):
     """Check user owns the job_id"""
     logger.debug('Checking job_id: {} belongs to user: {}'.format(
                  job_id, current_user.username))
-    user = User.query.filter_by(username=current_user.username).first()
-    if user.job_ids:
-        if job_id in user.job_ids:
-            return True
-        else:
-            return False
-    else:
-        return False
+    return job_id in check_jobids([job_id])
+
+
+def migrate_jobids():
+    """
+    Copy job ownership from the legacy User.job_ids and Tasks.job_ids
+    JSON columns into the job_owner table
+
+    This only runs when job_owner is empty, for databases created with
+    db.create_all() rather than the alembic migration. It's called as
+    each gunicorn worker starts, so it's run under a Redis lock and a
+    worker losing the race to insert the same rows rolls back.
+    """
+    rconf = CRACK_CONF['redis']
+    redis_con = Redis(rconf['host'], rconf['port'])
+    lock = redis_con.lock('crackq:migrate_jobids', timeout=300)
+    if not lock.acquire(blocking_timeout=300):
+        logger.warning('Job ID migration still running in another worker')
+        return
+    try:
+        if JobOwner.query.first():
+            return
+        insert_jobids()
+    finally:
+        lock.release()
+
+
+def insert_jobids():
+    """Insert the legacy job ownership for migrate_jobids()"""
+    task_map = {}
+    for task in Tasks.query.all():
+        if task.job_ids:
+            for job_id in json.loads(task.job_ids):
+                task_map[job_id] = task.id
+    migrated = set()
+    for user in User.query.all():
+        if not user.job_ids:
+            continue
+        for job_id in set(json.loads(user.job_ids)) - migrated:
+            if JobOwner.query.get(job_id):
+                continue
+            db.session.add(JobOwner(job_id=job_id, user_id=user.id,
+                                    task_id=task_map.get(job_id)))
+            migrated.add(job_id)
+    try:
+        db.session.commit()
+    except IntegrityError as err:
+        db.session.rollback()
+        logger.debug('Job IDs already migrated: {}'.format(err))
+        return
+    if migrated:
+        logger.info('Migrated {} job IDs to job_owner table'.format(len(migrated)))
 
 
 def check_rules(orig_rules):
@@ -380,6 +441,14 @@ def check_mask(orig_masks):
     #mask = mask_file[0] if mask_file else mask
 
 
+def remain_path(hash_file):
+    """
+    Location of the hashes left to crack after the potfile resolve,
+    '<job_id>.remain' alongside the submitted '<job_id>.hashes'
+    """
+    return '{}.remain'.format(os.path.splitext(hash_file)[0])
+
+
 def admin_required(func):
     @wraps(func)
     def wrap(*args, **kwargs):
@@ -437,6 +506,7 @@ def del_user(user_id):
     """
     try:
         user = User.query.filter_by(id=user_id).first()
+        JobOwner.query.filter_by(user_id=user.id).delete()
         db.session.delete(user)
         db.session.commit()
         return True
@@ -472,10 +542,13 @@ def del_job(job):
     Function to delete a job. Used to spawn a thread
     and wait for jobs to cleanup hashcat proc
     """
-    time.sleep(22)
+    if not control.wait_ack(job.id, timeout=22):
+        logger.debug('Thread: no delete acknowledgement from worker')
     logger.debug('Thread: deleting job')
     job.delete()
+    jobspec.delete(job.id)
     del_jobid(job.id)
+    snapshot.invalidate(job.origin)
 
 
 def write_template(template_dict, temp_file):
@@ -725,47 +798,56 @@ class Queuing(MethodView):
         This method will check and remove zombie jobs from
         the started queue.
 
-        RQ has a bug which causes multiple started jobs to exist
-        after a system error has occured (unplanned exeception of some sort).
-        This method will clean this up and requeus the affected job.
+        RQ can leave jobs in the started registry after a system error
+        has occured (unplanned exeception of some sort). Workers may run
+        concurrent sessions, so a started job is only a zombie when no
+        live worker is running it. Worker keys expire with their
+        heartbeat, so a dead worker is missing from Worker.all().
         """
         logger.debug('Checking for zombie jobs')
-        while len(started.get_job_ids()) > 1:
-            logger.debug('Zombie job detected')
-            logger.debug('Started jobs: {}'.format(cur_list))
-            hung_dict = {}
-            for j in cur_list:
-                job = self.q.fetch_job(j)
-                if job is not None:
-                    hung_dict[j] = job.started_at
-            latest = max(hung_dict, key=hung_dict.get)
-            for j in cur_list:
-                if j != latest:
-                    job = self.q.fetch_job(j)
-                    if job:
-                        job.set_status('failed')
-                        failed.add(job)
-                        logger.debug('Cleaning state job: {}'.format(j))
-                        started.remove(job)
-                        try:
-                            if job.meta['Requeue Count'] <= int(self.req_max):
-                                ###***disable requeuing failed jobs until issue #1486 is fixed in rq
-                                # failed.requeue(j)
-                                job.meta['Requeue Count'] += 1
-                                job.save_meta()
-                        except KeyError:
-                            job.meta['Requeue Count'] = 0
-
-    def get_comp_dict(self, comp_list, session=False):
+        if not cur_list:
+            return
+        workers = Worker.all(queue=self.q)
+        running = {worker.get_current_job_id() for worker in workers}
+        cleaned = False
+        for j in cur_list:
+            if j in running:
+                continue
+            job = self.q.fetch_job(j)
+            if job is None:
+                continue
+            # allow for a job that was just started and whose worker
+            # hasn't been listed yet
+            if job.started_at and (datetime.utcnow() - job.started_at).total_seconds() < 60:
+                continue
+            logger.debug('Zombie job detected: {}'.format(j))
+            job.set_status('failed')
+            failed.add(job)
+            logger.debug('Cleaning state job: {}'.format(j))
+            started.remove(job)
+            cleaned = True
+            try:
+                if job.meta['Requeue Count'] <= int(self.req_max):
+                    ###***disable requeuing failed jobs until issue #1486 is fixed in rq
+                    # failed.requeue(j)
+                    job.meta['Requeue Count'] += 1
+                    job.save_meta()
+            except KeyError:
+                job.meta['Requeue Count'] = 0
+        if cleaned:
+            snapshot.invalidate(self.q.name)
+
+    def get_comp_dict(self, snap, owned=None):
         """
         Function to get complete queue information
 
         Arguments
         ---------
-        comp_list: list
-            list of job IDs in complete queue
-        session: string
-            session ID to reduce returned dictionary to jobs owned by user.
+        snap: dict
+            queue snapshot, from QueueSnapshot.build()
+        owned: set
+            job IDs owned by the user to reduce the returned dictionary,
+            None returns all jobs
 
         Returns
         -------
@@ -773,50 +855,55 @@ class Queuing(MethodView):
             dict containing high-level info for jobs in complete queue
         """
         comp_dict = {}
-        for job_id in comp_list:
-            if session:
-                if check_jobid(job_id):
-                    job = self.q.fetch_job(job_id)
-                else:
-                    job = None
-            ###***remove below?
-            else:
-                job = self.q.fetch_job(job_id)
-            if job:
-                comp_dict[job_id] = {}
-                job_deets = get_jobdetails(job.description)
-                try:
-                    if isinstance(job.meta['HC State'], dict):
-                        cracked = str(job.meta['HC State']['Cracked Hashes'])
-                        total = str(job.meta['HC State']['Total Hashes'])
-                        comp_dict[job_id]['Cracked'] = '{}/{}'.format(cracked, total)
-                        comp_dict[job_id]['Running Time'] = job.meta['HC State']['Running Time']
-                        try:
-                            comp_dict[job_id]['Name'] = get_jobdetails(job.description)['name']
-                        except KeyError:
-                            comp_dict[job_id]['Name'] = 'No name'
-                        except AttributeError:
-                            comp_dict[job_id]['Name'] = 'No name'
-                except KeyError:
-                    logger.debug('No HC state, checking state file')
-                    job_file = valid.val_filepath(path_string=self.log_dir,
-                                                  file_string='{}.json'.format(job_id))
-                    try:
-                        with open(job_file, 'r') as jobfile_fh:
-                            job_deets = json.loads(jobfile_fh.read().strip())
-                            comp_dict[job_id]['Name'] = job_deets['name']
-                            cracked = job_deets['Cracked Hashes']
-                            total = job_deets['Total Hashes']
-                            comp_dict[job_id]['Cracked'] = '{}/{}'.format(cracked, total)
-                            comp_dict[job_id]['Running Time'] = '0'
-                    except FileNotFoundError as err:
-                        logger.debug('Failed to open job file: {}'.format(err))
-                except Exception as err:
-                    logger.debug('Failed to open job file: {}'.format(err))
-            else:
-                logger.error('Job is missing: {}'.format(job_id))
+        for job_id in snap['finished']:
+            if owned is not None and job_id not in owned:
+                continue
+            job_state = snap['jobs'][job_id]
+            comp_dict[job_id] = {}
+            try:
+                hc_state = job_state['State']['HC State']
+                cracked = str(hc_state['Cracked Hashes'])
+                total = str(hc_state['Total Hashes'])
+                comp_dict[job_id]['Cracked'] = '{}/{}'.format(cracked, total)
+                comp_dict[job_id]['Running Time'] = hc_state.get('Running Time', '0')
+                comp_dict[job_id]['Name'] = job_state['Job Details'].get('name', 'No name')
+            except (KeyError, TypeError) as err:
+                logger.debug('No HC state for job {}: {}'.format(job_id, err))
         return comp_dict
 
+    def queue_dict(self, snap):
+        """
+        Build the queue status dictionary, as per Queuer.q_monitor, from a
+        queue snapshot
+
+        Arguments
+        ---------
+        snap: dict
+            queue snapshot, from QueueSnapshot.build()
+
+        Returns
+        -------
+        q_dict: dictionary
+            queue size, queued jobs and current jobs, with projected
+            start/finish times
+        """
+        cur_job_dict = {}
+        for job_id in snap['started']:
+            job_state = dict(snap['jobs'][job_id])
+            if not isinstance(job_state['State'].get('HC State'), dict):
+                job_state.pop('Job Details')
+            job_state['State'] = dict(job_state['State'])
+            job_state['State']['Speed Array'] = speedhistory.recent(job_id)
+            cur_job_dict[job_id] = job_state
+        q_dict = {
+            'Queue Size': len(snap['queued']),
+            'Queued Jobs': {job_id: snap['jobs'][job_id] for job_id
+                            in snap['queued']},
+            'Current Job': cur_job_dict,
+            }
+        slots = max(snap.get('workers', 0), len(cur_job_dict), 1)
+        return estimator.project(q_dict, slots=slots)
+
     @login_required
     def get(self, job_id):
         """
@@ -840,86 +927,52 @@ class Queuing(MethodView):
         cur_list = started.get_job_ids()
         ###**update all connections to user get_current_connection()??
         self.zombie_check(started, failed, cur_list)
-        q_dict = self.crack_q.q_monitor(self.q)
+        snap = snapshot.cached(self.q)
+        owned = get_jobids()
+        q_dict = self.queue_dict(snap)
+        cur_list = snap['started']
         logger.debug('Current jobs: {}'.format(cur_list))
-        failed_dict = self.crack_q.check_failed(self.q)
-        comp_list = self.crack_q.check_complete(self.q)
-        last_comp = []
-        end_times = {}
-        if len(comp_list) > 0:
-            ###***make this a function/method
-            for j in comp_list:
-                if check_jobid(j):
-                    job = self.q.fetch_job(j)
-                    if job:
-                        ended = job.ended_at
-                        if ended:
-                            end_times[j] = ended
+        end_times = {j: snap['jobs'][j]['Time finished'] for j in snap['finished']
+                     if j in owned and snap['jobs'][j]['Time finished'] != 'None'}
+        if len(snap['finished']) > 0:
             if len(end_times) > 0:
                 latest = max(end_times, key=end_times.get)
-            else:
-                latest = None
-            if latest:
-                job = self.q.fetch_job(latest)
-            else:
-                job = None
-            if job:
-                try:
-                    job_name = get_jobdetails(job.description)['name']
-                except KeyError:
-                    job_name = 'No name'
-                except AttributeError:
-                    job_name = 'No name'
+                job_name = snap['jobs'][latest]['Job Details'].get('name', 'No name')
                 # just a single job for now
                 last_comp = [{'job_name': job_name,
                               'job_id': latest}]
+            else:
+                last_comp = []
         else:
             last_comp = [{'job_name': 'None'}]
         q_dict['Last Complete'] = last_comp
-        logger.debug('Completed jobs: {}'.format(comp_list))
+        logger.debug('Completed jobs: {}'.format(snap['finished']))
         logger.debug('q_dict: {}'.format(q_dict))
         if not job_id.isalnum():
             return jsonify(ERR_INVAL_JID), 500
         if job_id == 'all':
-            ###***definitely make these a function
-            if len(cur_list) > 0:
-                job = self.q.fetch_job(cur_list[0])
-                if current_user.job_ids and job:
-                    if cur_list[0] in json.loads(current_user.job_ids):
+            for cur_id in cur_list:
+                if cur_id in owned and snap['jobs'][cur_id]['State'].get('email_count'):
+                    job = self.q.fetch_job(cur_id)
+                    if job:
                         job.meta['email_count'] = 0
-                        job.save()
-                if job:
-                    if 'HC State' in job.meta:
-                        ###***remove this?
-                        if isinstance(job.meta['HC State'], dict):
-                            job_details = get_jobdetails(job.description)
-                            try:
-                                q_dict['Current Job'][cur_list[0]]['Job Details'] = job_details
-                            except KeyError:
-                                logger.error('No job to update - does not exist')
-                else:
-                    logger.error('No Queue')
-            if len(q_dict) > 0:
-                for qjob_id in q_dict['Queued Jobs']:
-                    job = self.q.fetch_job(qjob_id)
-                    job_details = get_jobdetails(job.description)
-                    q_dict['Queued Jobs'][qjob_id]['Job Details'] = job_details
+                        job.save_meta()
             return jsonify(q_dict), 200
         elif job_id == 'failed':
+            failed_dict = {j: {'Error': snap['jobs'][j]['Error'],
+                               'Name': snap['jobs'][j]['Job Details'].get('name', 'No name')}
+                           for j in snap['failed']}
             return jsonify(failed_dict), 200
         elif job_id == 'failedless':
-            failess_dict = {}
-            for job_id in failed_dict:
-                if check_jobid(job_id):
-                    failess_dict[job_id] = failed_dict[job_id]
+            failess_dict = {j: {'Error': snap['jobs'][j]['Error'],
+                                'Name': snap['jobs'][j]['Job Details'].get('name', 'No name')}
+                            for j in snap['failed'] if j in owned}
             return jsonify(failess_dict), 200
         elif job_id == 'complete':
-            comp_dict = {}
-            comp_dict = self.get_comp_dict(comp_list, session=False)
+            comp_dict = self.get_comp_dict(snap)
             return jsonify(comp_dict), 200
         elif job_id == 'completeless':
-            comp_dict = {}
-            comp_dict = self.get_comp_dict(comp_list, session=True)
+            comp_dict = self.get_comp_dict(snap, owned=owned)
             return jsonify(comp_dict), 200
         else:
             try:
@@ -931,8 +984,7 @@ class Queuing(MethodView):
             if check_jobid(job_id):
                 job = self.q.fetch_job(job_id)
                 if job:
-                    cracked_file = '{}{}.cracked'.format(self.log_dir, job_id)
-                    job_details = get_jobdetails(job.description)
+                    job_details = jobspec.details(job)
                     if job_id in q_dict['Queued Jobs']:
                         job_dict = {
                             'Status': 'Queued',
@@ -951,9 +1003,18 @@ class Queuing(MethodView):
                             'Result': job.result,
                             'HC State': job.meta,
                             }
+                        job.meta['Speed Array'] = speedhistory.recent(job_id)
+                    for section in ['Queued Jobs', 'Current Job']:
+                        if job_id in q_dict[section]:
+                            for key in ['Projected Start', 'Projected Finish']:
+                                job_dict[key] = q_dict[section][job_id][key]
+                    # only the first page is inlined, the rest is
+                    # available from CrackedView
                     try:
-                        with open(cracked_file, 'r') as cracked_fh:
-                            job_dict['Cracked'] = [crack.strip() for crack in cracked_fh]
+                        crack_list, total = cracked.read(job_id, limit=cracked.MAX_PAGE)
+                        if total:
+                            job_dict['Cracked'] = crack_list
+                            job_dict['Cracked Total'] = total
                     except IOError as err:
                         logger.debug('Cracked file does not exist: {}'.format(err))
                     return jsonify(job_dict), 200
@@ -967,8 +1028,8 @@ class Queuing(MethodView):
         """
         Method to reorder the queue
 
-        This will clear the queued jobs and re-add them in
-        the order specified with a JSON batch add
+        This will rewrite the queue list atomically in the order
+        specified with a JSON batch add
 
         jobord_dict: dict
             Dictionary containing batch job add details as:
@@ -984,7 +1045,6 @@ class Queuing(MethodView):
         except ValidationError as errors:
             logger.debug('Validation error: {}'.format(errors))
             return jsonify({'msg': errors.messages}), 500
-        comp = rq.registry.FinishedJobRegistry(queue=self.q)
         ###***change this to match reports, validate job_id correctly
         if job_id == "reorder":
             logger.debug('Reorder queue command received')
@@ -994,26 +1054,16 @@ class Queuing(MethodView):
                 if len(marsh_schema['batch_job']) < 1:
                     logger.error('Reorder failed: Invalid request')
                     return {'msg': 'Reorder failed - Invalid request'}, 500
-                for job in marsh_schema['batch_job']:
-                    started = rq.registry.StartedJobRegistry(queue=self.q)
-                    cur_list = started.get_job_ids()
-                    if job_id in cur_list:
-                        logger.error('Job is already running')
-                        return {'msg': 'Job is already running'}, 500
+                started = rq.registry.StartedJobRegistry(queue=self.q)
+                cur_list = started.get_job_ids()
                 marsh_schema['batch_job'].sort(key=itemgetter('place'))
-                for job in self.q.jobs:
-                    job.set_status('finished')
-                    job.save()
-                    comp.add(job, -1)
-                    job.cleanup(-1)
-                for job in marsh_schema['batch_job']:
-                    Queue.dequeue_any(self.q, None, connection=self.redis_con,
-                                      serializer=JSONSerializer)
-                    j = self.q.fetch_job(job['job_id'].hex)
-                    ###***check this covers case when job is in requeued state
-                    self.q.enqueue_job(j)
-                    j.meta['CrackQ State'] = 'Run/Restored'
-                    j.save_meta()
+                job_ids = [job['job_id'].hex for job in marsh_schema['batch_job']]
+                if any(job in cur_list for job in job_ids):
+                    logger.error('Job is already running')
+                    return {'msg': 'Job is already running'}, 500
+                order = self.crack_q.q_reorder(self.q, job_ids)
+                logger.debug('New queue order: {}'.format(order))
+                snapshot.invalidate(self.q.name)
                 return {'msg': 'Queue order updated'}, 200
             except Exception as err:
                 ###***fix to specific exception types
@@ -1049,8 +1099,8 @@ class Queuing(MethodView):
             cur_list = started.get_job_ids()
             comp = rq.registry.FinishedJobRegistry(queue=self.q)
             if job_id in cur_list:
-                job.meta['CrackQ State'] = 'Stop'
-                job.save_meta()
+                control.send(job, 'Stop')
+                snapshot.invalidate(self.q.name)
                 return 'Stopping Job: Sending signal to Hashcat', 204
             else:
                 job.set_status('finished')
@@ -1059,6 +1109,7 @@ class Queuing(MethodView):
                 job.cleanup(-1)
                 Queue.dequeue_any(self.q, None, connection=self.redis_con,
                                   serializer=JSONSerializer)
+                snapshot.invalidate(self.q.name)
                 return 'Stopped Job', 200
         except AttributeError as err:
             logger.debug('Failed to stop job: {}'.format(err))
@@ -1101,20 +1152,178 @@ class Queuing(MethodView):
                 if speed_job.get_status() != 'started':
                     speed_job.delete()
             if job_id in cur_list:
-                job.meta['CrackQ State'] = 'Delete'
-                job.save_meta()
+                control.send(job, 'Delete')
                 del_thread = threading.Thread(target=del_job, args=(job,))
                 del_thread.start()
                 return {'msg': 'Deleted Job'}, 204
             del_jobid(job_id)
             job.delete()
+            speedhistory.delete(job_id)
+            jobspec.delete(job_id)
             started.cleanup()
+            snapshot.invalidate(self.q.name)
             return jsonify({'msg': 'Deleted Job'}), 200
         except AttributeError as err:
             logger.error('Failed to delete job: {}'.format(err))
             return jsonify(ERR_INVAL_JID), 404
 
 
+class SpeedView(MethodView):
+    """
+    Job speed history, for charting speed over the whole run
+
+    """
+    @login_required
+    def get(self, job_id):
+        """
+        Method to get a job's speed history
+
+        Returns
+        ------
+        history_dict: dictionary
+            'Fine' [timestamp, speed] points for the last hour and
+            'Coarse' downsampled points for the whole run
+        """
+        try:
+            marsh_schema = parse_json_schema().load({'job_id': job_id})
+            job_id = marsh_schema['job_id'].hex
+        except ValidationError as errors:
+            logger.debug('Validation error: {}'.format(errors))
+            return errors.messages, 500
+        if not check_jobid(job_id):
+            return abort(401)
+        return jsonify(speedhistory.history(job_id)), 200
+
+
+class QueueStream(MethodView):
+    """
+    Server-Sent Events stream of job progress and state changes, as
+    published by the workers, to replace polling of Queuing.get
+    """
+    def __init__(self):
+        self.crack_q = crackqueue.Queuer()
+        self.q = self.crack_q.q_connect()
+
+    @login_required
+    def get(self):
+        """
+        Method to stream job updates
+
+        Returns
+        ------
+        Response: text/event-stream
+            'snapshot' event with the current state of queued and running
+            jobs, followed by 'job' events containing changed values
+        """
+        snap = snapshot.cached(self.q)
+        initial = {}
+        for job_id in snap['started'] + snap['queued']:
+            job_state = snap['jobs'][job_id]['State']
+            update = job_state.get('HC State')
+            update = dict(update) if isinstance(update, dict) else {}
+            update['CrackQ State'] = job_state.get('CrackQ State')
+            initial[job_id] = {key: val for key, val in update.items()
+                               if key in events.FIELDS}
+        resp = Response(stream_with_context(events.stream(initial=initial)),
+                        mimetype='text/event-stream')
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.headers['X-Accel-Buffering'] = 'no'
+        return resp
+
+
+class CrackedView(MethodView):
+    """
+    Paginated cracked results for a job, read using the cracked index
+    rather than loading the whole cracked file
+
+    """
+    @login_required
+    def get(self, job_id):
+        """
+        Method to get a page of cracked results
+
+        Query parameters 'offset' (or 'since', the 'Next' value from a
+        previous page) and 'limit', up to cracked.MAX_PAGE
+
+        Returns
+        ------
+        page_dict: dictionary
+            'Cracked' list, the 'Offset' of the first result, 'Next'
+            offset to request and the 'Total' cracked so far
+        """
+        try:
+            marsh_schema = parse_json_schema().load({'job_id': job_id})
+            job_id = marsh_schema['job_id'].hex
+        except ValidationError as errors:
+            logger.debug('Validation error: {}'.format(errors))
+            return errors.messages, 500
+        if not check_jobid(job_id):
+            return abort(401)
+        try:
+            offset = int(request.args.get('since', request.args.get('offset', 0)))
+            limit = int(request.args.get('limit', cracked.MAX_PAGE))
+        except ValueError:
+            return jsonify({'msg': 'Invalid offset or limit'}), 500
+        if offset < 0 or limit < 1:
+            return jsonify({'msg': 'Invalid offset or limit'}), 500
+        try:
+            crack_list, total = cracked.read(job_id, offset=offset,
+                                             limit=min(limit, cracked.MAX_PAGE))
+        except IOError as err:
+            logger.debug('Cracked file read failed: {}'.format(err))
+            crack_list, total = [], 0
+        page_dict = {
+            'Cracked': crack_list,
+            'Offset': offset,
+            'Next': offset + len(crack_list),
+            'Total': total,
+            }
+        return jsonify(page_dict), 200
+
+
+class JobStatus(MethodView):
+    """
+    Lightweight job status, without the job details or cracked results
+    returned by Queuing.get
+
+    """
+    def __init__(self):
+        self.crack_q = crackqueue.Queuer()
+        self.q = self.crack_q.q_connect()
+
+    @login_required
+    def get(self, job_id):
+        """
+        Method to get a job's current status
+
+        Returns
+        ------
+        status_dict: dictionary
+            'Status', start and finish times, 'HC State' and the
+            number of results, 'Cracked Total'
+        """
+        try:
+            marsh_schema = parse_json_schema().load({'job_id': job_id})
+            job_id = marsh_schema['job_id'].hex
+        except ValidationError as errors:
+            logger.debug('Validation error: {}'.format(errors))
+            return errors.messages, 500
+        if not check_jobid(job_id):
+            return abort(401)
+        job = self.q.fetch_job(job_id)
+        if not job:
+            return abort(404)
+        status_dict = {
+            'Status': job.get_status(),
+            'Time started': str(job.started_at) if job.started_at else None,
+            'Time finished': str(job.ended_at) if job.ended_at else None,
+            'HC State': job.meta.get('HC State'),
+            'CrackQ State': job.meta.get('CrackQ State'),
+            'Cracked Total': cracked.update(job_id),
+            }
+        return jsonify(status_dict), 200
+
+
 class Options(MethodView):
     """
     Class for pulling option information, such as a list of available
@@ -1136,7 +1345,8 @@ class Options(MethodView):
         Returns
         ------
         hc_dict: dictionary
-            crackq config options for rules/wordlists
+            crackq config options for rules/wordlists, with the
+            wordlist metadata from the wordlist index
 
 
         """
@@ -1161,14 +1371,91 @@ class Options(MethodView):
         hc_dict = {
             'Rules': hc_rules,
             'Wordlists': hc_words,
+            'Wordlist Info': wordindex.summary(),
             'Mask Files': hc_maskfiles,
             'Hash Modes': hc_modes,
             'Attack Modes': hc_att_modes,
             'timeout': timeout_info,
             }
+        if None in hc_dict['Wordlist Info'].values():
+            wordindex.schedule()
         return hc_dict, 200
 
 
+class HashId(MethodView):
+    """
+    Hash mode identification for a hash list
+
+    """
+    @login_required
+    def post(self):
+        """
+        Method to propose hash modes for a sample of a hash list
+
+        Supply the following in the body: {"hash_list": [...],
+        "username": false}
+
+        Returns
+        ------
+        id_dict: dictionary
+            'Modes' proposed, as per hashid.classify(), and the number of
+            hashes 'Sampled'
+        """
+        try:
+            args = parse_json_schema().load(request.json)
+        except ValidationError as errors:
+            logger.debug('Validation error: {}'.format(errors))
+            return jsonify({'msg': errors.messages}), 500
+        if not args.get('hash_list'):
+            return jsonify({'msg': 'No hashes provided'}), 500
+        sample = args['hash_list'][:hashid.SAMPLE]
+        id_dict = {
+            'Modes': hashid.classify(sample, username=args.get('username', False)),
+            'Sampled': len(sample),
+            }
+        return jsonify(id_dict), 200
+
+
+class Upload(MethodView):
+    """
+    Streaming hash file upload, for hash lists too large to submit in
+    the JSON hash_list
+
+    """
+    @login_required
+    def post(self):
+        """
+        Method to upload a hash file, either as the 'hash_file' field of
+        a multipart form or the raw request body. Gzip compressed input
+        is detected and decompressed.
+
+        Returns
+        ------
+        count_dict: dictionary
+            'upload_id' to submit with the job in place of hash_list,
+            plus the 'Hashes' accepted and 'Rejected' counts
+        """
+        if request.mimetype == 'multipart/form-data':
+            hash_file = request.files.get('hash_file')
+            if not hash_file:
+                return jsonify({'msg': 'No hash file provided'}), 500
+            stream = hash_file.stream
+        else:
+            stream = request.stream
+        try:
+            count_dict = upload.receive(stream, str(current_user.id))
+        except ValueError as err:
+            logger.debug('Upload error: {}'.format(err))
+            return jsonify({'msg': 'Invalid hash file upload'}), 500
+        except IOError as err:
+            logger.error('Unable to write upload: {}'.format(err))
+            return jsonify({'msg': 'System error'}), 500
+        if 'upload_id' not in count_dict:
+            count_dict['msg'] = 'No valid hashes provided'
+            return jsonify(count_dict), 500
+        return jsonify(count_dict), 201
+
+
 class Adder(MethodView):
     """
     Separate class for adding jobs
@@ -1322,6 +1609,7 @@ class Adder(MethodView):
             speed_args['session'] = q_args['kwargs']['session']
             speed_args['wordlist'] = q_args['kwargs']['wordlist']
             speed_args['wordlist2'] = q_args['kwargs']['wordlist2']
+            speed_args['rules'] = q_args['kwargs']['rules']
             speed_args['hash_mode'] = q_args['kwargs']['hash_mode']
             speed_args['username'] = q_args['kwargs']['username']
             speed_args['name'] = q_args['kwargs']['name']
@@ -1336,11 +1624,119 @@ class Adder(MethodView):
             return True
         return False
 
+    def brain_estimate(self, hc_args):
+        """
+        Estimate the job runtime and decide whether to use the brain
+        without running a speed check, from a cached speed check result
+        for the same job shape or a confident offline estimate
+
+        Arguments
+        ---------
+        hc_args: dict
+            hc_worker arguments for the job
+
+        Returns
+        -------
+        brain: boolean | None
+            brain_check result or None if a speed check is needed
+        estimate: dict | None
+            offline estimate, from estimator.estimate()
+        """
+        try:
+            with open(hc_args['hash_file'], 'rb') as hash_fh:
+                hash_count = sum(1 for line in hash_fh)
+        except IOError as err:
+            logger.debug('Unable to read hash file: {}'.format(err))
+            return None, None
+        estimate = estimator.estimate(hash_count=hash_count, **hc_args)
+        if not hc_args['brain']:
+            return None, estimate
+        cached = speedcache.lookup(hc_args['hash_mode'], hc_args['attack_mode'],
+                                   hc_args['rules'], hash_count)
+        if cached:
+            return run_hashcat.brain_check(cached['speed'], cached['salts']), estimate
+        if estimate and estimate['Confident']:
+            return estimate['Brain'], estimate
+        return None, estimate
+
+    def pot_resolve(self, hash_file, outfile, pot_path, username, hash_mode):
+        """
+        Resolve hashes already in the potfile using the potfile index,
+        writing them to the job's cracked file and the remaining hashes
+        to a separate '.remain' file for hashcat. The submitted hash
+        file is left intact for reports
+
+        The hash file is processed in chunks, so large uploads aren't
+        loaded into memory. The index is opened and updated once per job.
+
+        Arguments
+        ---------
+        hash_file: str
+            job hash file location, with the hashes as submitted
+        outfile: str
+            job cracked file location
+        pot_path: str
+            potfile location
+        username: boolean
+            hashes are prefixed with a username
+        hash_mode: int
+            submitted hash mode, potfile matches are confirmed against it
+
+        Returns
+        -------
+        pot_cracked: int
+            number of hashes found in the potfile
+        remain_count: int
+            number of hashes left to crack. When this is 0 no remain file
+            is kept, as hashcat fails with an empty hash file, and the job
+            is completed without running hashcat
+        remain_file: str
+            hash file for hashcat to run on, the remain file if some
+            hashes were resolved, otherwise the submitted hash file
+        """
+        pot_index = potindex.open_index(pot_path=pot_path)
+        if pot_index is None:
+            return 0, None, hash_file
+        remain_file = remain_path(hash_file)
+        pot_cracked = 0
+        remain_count = 0
+        fh_outfile = None
+        try:
+            with open(hash_file, 'r') as hash_fh, \
+                    open(remain_file, 'w') as remain_fh:
+                for chunk in iter(lambda: list(islice(hash_fh, 100000)), []):
+                    found, remainder = potindex.resolve(chunk, pot_index,
+                                                        hash_mode,
+                                                        username=username)
+                    if found and not fh_outfile:
+                        fh_outfile = open(outfile, 'w')
+                    for hash_l, plain in found.items():
+                        fh_outfile.write('{}:{}\n'.format(hash_l, plain))
+                    for hash_l in remainder:
+                        remain_fh.write(hash_l + '\n')
+                    pot_cracked += len(found)
+                    remain_count += len(remainder)
+            if not (pot_cracked and remain_count):
+                os.remove(remain_file)
+                remain_file = hash_file
+        except (IOError, OSError) as err:
+            logger.error('Unable to write potfile results: {}'.format(err))
+            return 0, None, hash_file
+        finally:
+            pot_index.close()
+            if fh_outfile:
+                fh_outfile.close()
+        logger.debug('Hashes found in potfile index: {}'.format(pot_cracked))
+        return pot_cracked, remain_count, remain_file
+
     def queue_job(self, args, job_id=None):
         """
         Method to check sanity of job arguments and add
         job to redis queue
         """
+        pot_cracked = 0
+        pot_complete = False
+        hash_stats = None
         # Check for existing session info
         if job_id:
             if job_id.isalnum():
@@ -1359,6 +1755,9 @@ class Adder(MethodView):
                                                      file_string='{}.cracked'.format(job_id)))
                     hash_file = str(valid.val_filepath(path_string=self.log_dir,
                                                        file_string='{}.hashes'.format(job_id)))
+                    if os.path.exists(remain_path(hash_file)):
+                        # hashes left after the potfile resolve at submit
+                        hash_file = remain_path(hash_file)
                     pot_path = str(valid.val_filepath(path_string=self.log_dir,
                                                       file_string='crackq.pot'))
                     job_deets = self.get_restore(self.log_dir, job_id)
@@ -1413,6 +1812,7 @@ class Adder(MethodView):
                         'brain': False if 'disable_brain' in job_deets else True,
                         'name': job_deets['name'] if 'name' in job_deets else None,
                         'pot_path': pot_path,
+                        'slices': int(job_deets['slices']) if str(job_deets.get('slices')).isdigit() else None,
                         }
                     job = self.q.fetch_job(job_id)
                     job.meta['CrackQ State'] = 'Run/Restored'
@@ -1437,9 +1837,14 @@ class Adder(MethodView):
                 attack_mode = None
             try:
                 logger.debug('Writing hashes to file: {}'.format(hash_file))
-                with open(hash_file, 'w') as hash_fh:
-                    for hash_l in args['hash_list']:
-                        hash_fh.write(hash_l.rstrip() + '\n')
+                if args.get('upload_id'):
+                    if not upload.claim(args['upload_id'], str(current_user.id),
+                                        hash_file):
+                        return jsonify({'msg': 'Invalid upload ID'}), 500
+                else:
+                    with open(hash_file, 'w') as hash_fh:
+                        for hash_l in args['hash_list']:
+                            hash_fh.write(hash_l.rstrip() + '\n')
             except KeyError as err:
                 logger.debug('No hash list provided: {}'.format(err))
                 return jsonify({'msg': 'No hashes provided'}), 500
@@ -1493,6 +1898,21 @@ class Adder(MethodView):
             except KeyError as err:
                 logger.debug('Username value not provided')
                 username = False
+            if hashid.hashid_conf():
+                try:
+                    match, mode_list = hashid.check(hashid.sample_file(hash_file),
+                                                    mode, username=username)
+                except IOError as err:
+                    logger.debug('Unable to sample hash file: {}'.format(err))
+                    match, mode_list = True, []
+                if not match:
+                    logger.debug('Hashes do not match hash mode: {}'.format(mode))
+                    return jsonify({'msg': 'Hashes do not match the selected hash mode',
+                                    'Modes': mode_list[:5]}), 500
+            hash_stats = hashprep.prepare(hash_file, mode, username=username)
+            pot_cracked, remain_count, hash_file = self.pot_resolve(
+                hash_file, outfile, pot_path, username, mode)
+            pot_complete = bool(pot_cracked) and remain_count == 0
             try:
                 increment = args['increment']
             except KeyError as err:
@@ -1527,6 +1947,11 @@ class Adder(MethodView):
             except KeyError as err:
                 logger.debug('Potcheck value not provided')
                 potcheck = False
+            try:
+                slices = args['slices']
+            except KeyError as err:
+                logger.debug('Slices value not provided')
+                slices = distrib.slice_conf()['slices']
             timeout = 1814400
             if 'jobtimeout' in CRACK_CONF:
                 if not CRACK_CONF['jobtimeout']['Modify']:
@@ -1554,12 +1979,24 @@ class Adder(MethodView):
                 'name': name,
                 'pot_path': pot_path,
                 'restore': 0,
-                'potcheck': potcheck
+                'potcheck': potcheck,
+                'slices': slices,
             }
         q_args = {
             'job_id': job_id,
             'kwargs': hc_args,
             }
+        skip_speed = False
+        brain, estimate = self.brain_estimate(hc_args)
+        meta = {'Estimate': estimate} if estimate else {}
+        meta['owner'] = str(current_user.id)
+        if hc_args['restore'] == 0 and pot_cracked:
+            meta['Pot Cracked'] = pot_cracked
+            if pot_complete:
+                # every hash was in the potfile, hashcat isn't run
+                meta['Pot Complete'] = True
+        if args.get('priority') is not None:
+            meta['priority'] = args['priority']
         try:
             q = self.crack_q.q_connect()
             try:
@@ -1572,19 +2009,45 @@ class Adder(MethodView):
                         time.sleep(3)
                     else:
                         logger.debug('Restored job, disabling speed check')
+                elif meta.get('Pot Complete'):
+                    logger.debug('All hashes found in potfile, no speed_check needed')
+                    skip_speed = True
+                elif not hc_args['brain'] and potindex.enabled():
+                    logger.debug('Brain disabled and potfile resolved, no speed_check needed')
+                    skip_speed = True
                 else:
-                    logger.debug('Job not a restore, queuing speed_check')
-                    self.speed_check(q_args=q_args)
-                    time.sleep(3)
+                    # without the potfile index the speed check also runs
+                    # hashcat --show, so it can't be skipped for a cached
+                    # or estimated brain decision
+                    if brain is not None and potindex.enabled():
+                        logger.debug('Brain decided without speed check: {}'.format(brain))
+                        meta['brain_check'] = brain
+                        skip_speed = True
+                    else:
+                        logger.debug('Job not a restore, queuing speed_check')
+                        self.speed_check(q_args=q_args)
+                        time.sleep(3)
             ###***remove below now?
             except KeyError as err:
                 logger.debug('Job not a restore, queuing speed_check')
                 self.speed_check(q_args=q_args)
                 time.sleep(3)
-            self.crack_q.q_add(q, q_args, timeout=timeout)
+            jobspec.save(job_id, jobspec.build(hc_args))
+            self.crack_q.q_add(q, q_args, timeout=timeout, meta=meta)
             logger.debug('API Job {} added to queue'.format(job_id))
             logger.debug('Job Details: {}'.format(q_args))
+            if skip_speed:
+                run_hashcat.init_status(job_id, hash_mode=hc_args['hash_mode'],
+                                        attack_mode=hc_args['attack_mode'],
+                                        mask=hc_args['mask'],
+                                        wordlist=hc_args['wordlist'],
+                                        wordlist2=hc_args['wordlist2'],
+                                        rules=hc_args['rules'],
+                                        brain=hc_args['brain'],
+                                        name=hc_args['name'])
             job = self.q.fetch_job(job_id)
+            if hc_args['restore'] == 0 and hash_stats:
+                job.meta['Hash Stats'] = hash_stats
             if 'task_id' in args:
                 job.meta['task_id'] = args['task_id']
             job.meta['email_count'] = 0
@@ -1600,8 +2063,8 @@ class Adder(MethodView):
                     job.meta['email'] = current_user.username
                     job.meta['last_seen'] = str(current_user.last_seen)
             job.meta['CrackQ State'] = 'Run/Restored'
-            job.meta['Speed Array'] = []
             job.save_meta()
+            snapshot.invalidate(q.name)
             return job_id, 202
         except KeyError as err:
             logger.warning('Key missing from meta data:\n{}'.format(err))
@@ -1788,6 +2251,11 @@ class Reports(MethodView):
                                                           file_string='{}.cracked'.format(job_id)))
                     hash_path = str(valid.val_filepath(path_string=self.log_dir,
                                                          file_string='{}.hashes'.format(job_id)))
+                    # all user:hash lines, before the hash file was deduplicated
+                    users_path = str(valid.val_filepath(path_string=self.log_dir,
+                                                          file_string='{}.users'.format(job_id)))
+                    if os.path.exists(users_path):
+                        hash_path = users_path
                     report_path = str(valid.val_filepath(path_string=self.report_dir,
                                                          file_string='{}.json'.format(job_id)))
                     donut_path = str(valid.val_filepath(path_string=self.report_dir,
@@ -2096,15 +2564,17 @@ class TasksView(MethodView):
                         task_dict['task_id'] = uuid.UUID(task_id)
                         task_dict['name'] = task.name
                         job_list = []
-                        for job_id in json.loads(task.job_ids):
+                        task_jobs = json.loads(task.job_ids)
+                        owned = check_jobids(task_jobs)
+                        for job_id in task_jobs:
                             job_deets = {}
                             if session:
-                                if check_jobid(job_id):
+                                if job_id in owned:
                                     job = self.q.fetch_job(job_id)
                                 else:
                                     job = None
                             if job:
-                                job_deets = get_jobdetails(job.description)
+                                job_deets = jobspec.details(job)
                                 job_deets['job_id'] = job_id
                                 job_list.append(job_deets)
                         task_dict['jobs'] = job_list
@@ -2150,6 +2620,9 @@ class TasksView(MethodView):
                 task_id = task.id.hex
                 result['task_id'] = task_id
                 self.add_taskid(task_id)
+                JobOwner.query.filter(JobOwner.job_id.in_(result_jobs)).update(
+                    {'task_id': task.id}, synchronize_session=False)
+                db.session.commit()
             else:
                 result = {'msg': 'API error jobs list required'}, 500
         except AttributeError as err:
@@ -2489,6 +2962,7 @@ class Benchmark(MethodView):
                 'job_id': job_id,
                 'kwargs': hc_args,
                 }
+            jobspec.save(job_id, jobspec.build(hc_args))
             self.crack_q.q_add(q, q_args)
             logger.debug('API Job {} added to queue'.format(job_id))
             logger.debug('Job Details: {}'.format(q_args))
@@ -2503,8 +2977,8 @@ class Benchmark(MethodView):
                     job.meta['email'] = current_user.username
                     job.meta['last_seen'] = str(current_user.last_seen)
             job.meta['CrackQ State'] = 'Run/Restored'
-            job.meta['Speed Array'] = []
             job.save_meta()
+            snapshot.invalidate(q.name)
             return job_id, 202
         except Exception as err:
             logger.error('Error running benchmark: {}'.format(err))
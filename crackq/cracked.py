@@ -0,0 +1,160 @@
+"""Sparse line offset index for paginated access to cracked results"""
+import os
+import tempfile
+
+from array import array
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from crackq.validator import FileValidation as valid
+
+CRACK_CONF = hc_conf()
+log_dir = CRACK_CONF['files']['log_dir']
+# lines between index entries
+INDEX_EVERY = 256
+CHUNK = 1048576
+# largest page of results returned at once
+MAX_PAGE = 10000
+
+
+def cracked_path(job_id):
+    """Location of a job's cracked file"""
+    return str(valid.val_filepath(path_string=log_dir,
+                                  file_string='{}.cracked'.format(job_id)))
+
+
+class CrackedIndex(object):
+    """
+    Index of the start offset of every INDEX_EVERY'th line of a cracked
+    file
+
+    Hashcat only appends to the cracked file, so an update reads from
+    the last indexed line to the end of the file. The index is replaced
+    atomically, so the worker and API can both update it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.idx_path = '{}.idx'.format(path)
+
+    def load(self):
+        """Load the index entries"""
+        offsets = array('Q')
+        try:
+            with open(self.idx_path, 'rb') as idx_fh:
+                offsets.frombytes(idx_fh.read())
+        except (IOError, ValueError):
+            pass
+        if not offsets:
+            offsets.append(0)
+        return offsets
+
+    def update(self):
+        """
+        Index lines appended since the last update
+
+        Returns
+        -------
+        total: int
+            number of complete lines in the cracked file
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        offsets = self.load()
+        if offsets[-1] > size:
+            logger.debug('Cracked file truncated, rebuilding index')
+            offsets = array('Q', [0])
+        count = len(offsets)
+        line_num = (len(offsets) - 1) * INDEX_EVERY
+        pos = offsets[-1]
+        with open(self.path, 'rb') as cracked_fh:
+            cracked_fh.seek(pos)
+            while True:
+                data = cracked_fh.read(CHUNK)
+                if not data:
+                    break
+                start = 0
+                while True:
+                    end = data.find(b'\n', start)
+                    if end < 0:
+                        break
+                    line_num += 1
+                    if line_num % INDEX_EVERY == 0:
+                        offsets.append(pos + end + 1)
+                    start = end + 1
+                pos += len(data)
+        if len(offsets) != count:
+            # the worker and API may both update the index, so each
+            # writes its own temporary file
+            tmp_fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.idx_path),
+                prefix='{}.'.format(os.path.basename(self.idx_path)))
+            try:
+                with os.fdopen(tmp_fd, 'wb') as idx_fh:
+                    idx_fh.write(offsets.tobytes())
+                os.replace(tmp_path, self.idx_path)
+            except OSError:
+                os.remove(tmp_path)
+                raise
+        return line_num
+
+    def read(self, offset=0, limit=1000):
+        """
+        Read a page of cracked results
+
+        Arguments
+        ---------
+        offset: int
+            first line to return
+        limit: int
+            maximum number of lines to return
+
+        Returns
+        -------
+        lines: list
+        total: int
+            number of complete lines in the cracked file
+        """
+        total = self.update()
+        if offset >= total or limit < 1:
+            return [], total
+        offsets = self.load()
+        entry = min(offset // INDEX_EVERY, len(offsets) - 1)
+        skip = offset - entry * INDEX_EVERY
+        end = min(offset + limit, total)
+        lines = []
+        with open(self.path, 'rb') as cracked_fh:
+            cracked_fh.seek(offsets[entry])
+            for line_num in range(entry * INDEX_EVERY, end):
+                line = cracked_fh.readline()
+                if line_num - entry * INDEX_EVERY >= skip:
+                    lines.append(line.decode('utf-8', errors='replace').strip())
+        return lines, total
+
+
+def update(job_id):
+    """
+    Update the cracked index for a job, called as results are written
+
+    Returns
+    -------
+    total: int
+        number of cracked lines
+    """
+    try:
+        return CrackedIndex(cracked_path(job_id)).update()
+    except (IOError, OSError) as err:
+        logger.debug('Cracked index update failed: {}'.format(err))
+        return 0
+
+
+def read(job_id, offset=0, limit=1000):
+    """
+    Read a page of a job's cracked results
+
+    Returns
+    -------
+    lines: list
+    total: int
+    """
+    return CrackedIndex(cracked_path(job_id)).read(offset=offset, limit=limit)
@@ -2,7 +2,7 @@
 import json
 import rq
 
-from crackq import cq_api, run_hashcat
+from crackq import estimator, jobspec, run_hashcat, scheduler, speedhistory
 from crackq.conf import hc_conf
 from crackq.logger import logger
 from pathlib import Path
@@ -10,9 +10,39 @@ from redis import Redis
 from rq import Queue
 from rq.registry import StartedJobRegistry
 from rq.serializers import JSONSerializer
+from rq.worker import Worker
 
 
 CRACK_CONF = hc_conf()
+# rewrite a queue list in the requested order, keeping jobs missing
+# from the request at the end in their current order and ignoring
+# requested jobs no longer in the queue
+REORDER_LUA = """
+local current = redis.call('LRANGE', KEYS[1], 0, -1)
+local queued = {}
+for _, job_id in ipairs(current) do
+    queued[job_id] = true
+end
+local order = {}
+for _, job_id in ipairs(ARGV) do
+    if queued[job_id] then
+        table.insert(order, job_id)
+        queued[job_id] = false
+    end
+end
+for _, job_id in ipairs(current) do
+    if queued[job_id] then
+        table.insert(order, job_id)
+    end
+end
+if #order > 0 then
+    redis.call('DEL', KEYS[1])
+    for pos = 1, #order, 1000 do
+        redis.call('RPUSH', KEYS[1], unpack(order, pos, math.min(pos + 999, #order)))
+    end
+end
+return order
+"""
 
 
 class Queuer(object):
@@ -24,7 +54,7 @@ class Queuer(object):
         self.redis_con = Redis(rconf['host'], rconf['port'])
         self.log_dir = CRACK_CONF['files']['log_dir']
 
-    def q_add(self, q_obj, arg_dict, timeout=30240):
+    def q_add(self, q_obj, arg_dict, timeout=30240, meta=None):
         """
         This method adds a new crack job to the queue
 
@@ -38,6 +68,9 @@ class Queuer(object):
                 hc_worker function arguments to run hashcat
         timeout: int
                 number of seconds before job will time out
+        meta: dict
+                initial job meta data, set before a worker can
+                pick up the job
 
         Returns
         -------
@@ -53,9 +86,30 @@ class Queuer(object):
         else:
             q_obj.enqueue_call(func=run_hashcat.hc_worker, job_id=arg_dict['job_id'],
                                kwargs=arg_dict['kwargs'], timeout=timeout,
-                               result_ttl=-1)
+                               result_ttl=-1, meta=meta)
         return
 
+    def q_reorder(self, q_obj, job_ids):
+        """
+        Reorder the queued jobs atomically in a single Lua script
+
+        Parameters
+        ---------
+        q_obj: object
+                queue object to use (returned from q_connect)
+        job_ids: list
+                job IDs in the new order, queued jobs not listed keep
+                their relative order after these
+
+        Returns
+        -------
+        order: list
+                the new queue order
+        """
+        reorder = self.redis_con.register_script(REORDER_LUA)
+        order = reorder(keys=[q_obj.key], args=job_ids)
+        return [job_id.decode() for job_id in order]
+
     def q_monitor(self, q_obj):
         """
         Method to monitor jobs in queue
@@ -73,19 +127,25 @@ class Queuer(object):
         Returns
         -------
         qstate_dict: dictionary
-                dictionary containing job details and hashcat status
+                dictionary containing job details and hashcat status,
+                with projected start/finish times for each job
         """
-        jobstate_dict = {job.id: self.q_jobstate(job) for job in
-                         q_obj.jobs}
+        jobs = {job.id: job for job in q_obj.jobs}
+        jobstate_dict = {job_id: self.q_jobstate(jobs[job_id]) for job_id in
+                         scheduler.order_jobs(list(jobs.values()), self.redis_con)}
 
         cur_jobs = StartedJobRegistry(queue=q_obj).get_job_ids()
         cur_job_dict = {job: self.q_jobstate(q_obj.fetch_job(job)) for job in cur_jobs}
+        for job_id, job_dict in cur_job_dict.items():
+            if job_dict:
+                job_dict['State']['Speed Array'] = speedhistory.recent(job_id)
         qstate_dict = {
             'Queue Size': q_obj.count,
             'Queued Jobs': jobstate_dict,
             'Current Job': cur_job_dict,
             }
-        return qstate_dict
+        slots = max(Worker.count(queue=q_obj), len(cur_job_dict), 1)
+        return estimator.project(qstate_dict, slots=slots)
 
     def q_jobstate(self, job):
         """
@@ -200,7 +260,7 @@ class Queuer(object):
                     job = q_obj.fetch_job(job_id)
                     failed_dict[job_id]['Error'] = self.error_parser(job)
                     try:
-                        name = cq_api.get_jobdetails(job.description)['name']
+                        name = jobspec.details(job)['name']
                         failed_dict[job_id]['Name'] = name
                     except KeyError:
                         failed_dict[job_id]['Name'] = 'No name'
@@ -0,0 +1,157 @@
+"""Device group slots, pinning concurrent hashcat sessions on a host to
+subsets of its devices"""
+import socket
+import threading
+import time
+
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from redis import Redis
+
+CRACK_CONF = hc_conf()
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+# slot claims expire unless refreshed, a claimed slot is refreshed by
+# a keepalive thread every SLOT_TTL / 4 seconds until released
+SLOT_TTL = 120
+
+
+def device_conf():
+    """
+    Get the device group settings from the config file, using defaults
+    if the section is missing
+
+    Returns
+    -------
+    conf_dict: dict
+        'groups' list of (backend_devices, slots) tuples, empty to use
+        all devices, and the hashcat 'workload' profile
+    """
+    conf_dict = {
+        'groups': [],
+        'workload': 4,
+        }
+    if 'devices' in CRACK_CONF:
+        dev_conf = CRACK_CONF['devices']
+        conf_dict['groups'] = parse_groups(dev_conf.get('groups', ''),
+                                           int(dev_conf.get('concurrency', 1)))
+        if dev_conf.get('workload'):
+            conf_dict['workload'] = int(dev_conf['workload'])
+    return conf_dict
+
+
+def parse_groups(groups, concurrency=1):
+    """
+    Parse the device groups setting
+
+    Arguments
+    ---------
+    groups: str
+        groups separated by ';', each a comma separated list of hashcat
+        backend device IDs with an optional '*' concurrent session
+        count, i.e. '1,2,3,4;5,6*2;7;8'
+    concurrency: int
+        default sessions per group
+
+    Returns
+    -------
+    group_list: list
+        (backend_devices, slots) tuples
+    """
+    group_list = []
+    for group in groups.split(';'):
+        group = group.replace(' ', '')
+        if not group:
+            continue
+        if '*' in group:
+            group, slots = group.split('*', 1)
+            slots = int(slots)
+        else:
+            slots = concurrency
+        group_list.append((group, max(slots, 1)))
+    return group_list
+
+
+def workload():
+    """Get the hashcat workload profile to use"""
+    return device_conf()['workload']
+
+
+class DeviceSlot(object):
+    """
+    Claim on a device group slot for a hashcat session
+
+    Each configured group has a number of slots per host, claimed with
+    an expiring Redis key so a crashed worker releases its devices. The
+    claim is kept alive from a background thread, so it can't expire
+    while the session is still starting up, i.e. waiting on the speed
+    check.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.host = socket.gethostname()
+        self.key = None
+        self.devices = None
+        self.stop_event = threading.Event()
+
+    def slot_key(self, group, slot):
+        """Redis key for a slot in a device group on this host"""
+        return 'crackq:devices:{}:{}:{}'.format(self.host, group, slot)
+
+    def claim(self, timeout=3600):
+        """
+        Claim a free slot, waiting for one to be released if needed
+
+        Arguments
+        ---------
+        timeout: int
+            seconds to wait for a free slot
+
+        Returns
+        -------
+        devices: str | None
+            hashcat backend_devices for the slot, None when no groups
+            are configured
+        """
+        groups = device_conf()['groups']
+        if not groups:
+            return None
+        deadline = time.time() + timeout
+        while True:
+            for devices, slots in groups:
+                for slot in range(slots):
+                    key = self.slot_key(devices, slot)
+                    if redis_con.set(key, self.session, nx=True, ex=SLOT_TTL):
+                        self.key = key
+                        self.devices = devices
+                        self.stop_event.clear()
+                        threading.Thread(target=self.keepalive,
+                                         daemon=True).start()
+                        logger.info('Session {} using devices {}'.format(
+                            self.session, devices))
+                        return devices
+            if time.time() > deadline:
+                raise ValueError('Error: No free device group')
+            logger.debug('No free device group, waiting')
+            time.sleep(5)
+
+    def refresh(self):
+        """Extend the slot claim"""
+        if self.key:
+            redis_con.expire(self.key, SLOT_TTL)
+
+    def keepalive(self):
+        """Refresh the slot claim until it's released"""
+        while not self.stop_event.wait(SLOT_TTL / 4):
+            try:
+                self.refresh()
+            except Exception as err:
+                logger.warning('Failed to refresh device slot: {}'.format(err))
+
+    def release(self):
+        """Release the slot if it's still held by this session"""
+        self.stop_event.set()
+        if self.key:
+            if redis_con.get(self.key) == self.session.encode():
+                redis_con.delete(self.key)
+            self.key = None
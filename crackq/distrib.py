@@ -0,0 +1,618 @@
+"""Keyspace sliced distributed execution of a single job across RQ workers"""
+#!/usr/bin/env python
+import json
+import os
+import time
+
+from crackq import control, devices, events
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from crackq.validator import FileValidation as valid
+from redis import Redis
+from rq import Queue
+from rq.serializers import JSONSerializer
+from time import sleep
+
+# set perms
+os.umask(0o077)
+
+CRACK_CONF = hc_conf()
+log_dir = CRACK_CONF['files']['log_dir']
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+slice_q = Queue('slices', connection=redis_con, serializer=JSONSerializer)
+
+
+def slice_conf():
+    """
+    Get the slicing settings from the config file, using defaults
+    if the section is missing
+
+    Returns
+    -------
+    conf_dict: dict
+        'slices' and 'min_keyspace' integer settings
+    """
+    conf_dict = {
+        'slices': 0,
+        'min_keyspace': 100000,
+        }
+    if 'distrib' in CRACK_CONF:
+        for key in conf_dict:
+            if key in CRACK_CONF['distrib']:
+                conf_dict[key] = int(CRACK_CONF['distrib'][key])
+    return conf_dict
+
+
+def slice_ranges(keyspace, slices):
+    """
+    Split a hashcat base keyspace into skip/limit ranges
+
+    Arguments
+    ---------
+    keyspace: int
+        total base keyspace as reported by hashcat (restore total)
+    slices: int
+        number of slices to create
+
+    Returns
+    -------
+    range_list: list
+        list of (skip, limit) tuples covering the full keyspace
+    """
+    slices = max(1, min(int(slices), int(keyspace)))
+    size, rem = divmod(int(keyspace), slices)
+    range_list = []
+    skip = 0
+    for i in range(slices):
+        limit = size + 1 if i < rem else size
+        range_list.append((skip, limit))
+        skip += limit
+    return range_list
+
+
+def keyspace_probe(hash_file=None, session=None, hash_mode=1000,
+                   attack_mode=0, rules=None, mask=None, wordlist=None,
+                   wordlist2=None, outfile=None, username=False,
+                   pot_path=None, **kwargs):
+    """
+    Start a short hashcat session to read the base keyspace for the job
+
+    Arguments
+    ---------
+    As per hc_worker
+
+    Returns
+    -------
+    keyspace: int | boolean
+        hashcat restore total for the job or False on failure
+    """
+    # run_hashcat imports this module, so it's imported when needed
+    from crackq import run_hashcat
+    logger.debug('Probing keyspace: {}'.format(session))
+    hcat = run_hashcat.runner(hash_file=hash_file, mask=mask,
+                              session='{}_probe'.format(session),
+                              wordlist=wordlist, wordlist2=wordlist2,
+                              outfile=outfile, attack_mode=attack_mode,
+                              hash_mode=hash_mode, rules=rules,
+                              username=username, pot_path=pot_path,
+                              brain=False)
+    keyspace = False
+    counter = 0
+    try:
+        while counter < 300:
+            hc_state = hcat.status_get_status_string()
+            if hc_state == 'Aborted':
+                logger.error('Keyspace probe aborted: {}'.format(
+                    hcat.hashcat_status_get_log()))
+                break
+            hcat_status = run_hashcat.status(hcat)
+            if isinstance(hcat_status, dict):
+                if int(hcat_status['Restore Total']) > 0:
+                    keyspace = int(hcat_status['Restore Total'])
+                    break
+            if hc_state in ['Exhausted', 'Cracked']:
+                break
+            sleep(1)
+            counter += 1
+    except KeyError as err:
+        logger.error('Keyspace probe failed: {}'.format(err))
+    hcat.hashcat_session_quit()
+    hcat.reset()
+    logger.debug('Keyspace for {}: {}'.format(session, keyspace))
+    return keyspace
+
+
+class Coordinator(object):
+    """
+    Track the keyspace slices of a job in Redis
+
+    Each slice is stored as a JSON field in the hash
+    'crackq:slices:<job_id>', keyed by the slice index.
+    """
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.redis_con = redis_con
+        self.key = 'crackq:slices:{}'.format(job_id)
+        self.stop_key = '{}:stop'.format(self.key)
+        self.offset_key = '{}:offsets'.format(self.key)
+        # lines already in the job's cracked file and how far it's
+        # been read, so merge() only reads what was appended since
+        self.merged = set()
+        self.merged_offset = 0
+
+    def plan(self, keyspace, slices):
+        """
+        Create the slice plan, an existing plan is kept so stopped jobs
+        resume only the unfinished slices
+
+        Arguments
+        ---------
+        keyspace: int
+            total base keyspace
+        slices: int
+            number of slices
+
+        Returns
+        -------
+        slice_dict: dict
+            slice index: slice state
+        """
+        slice_dict = self.slices()
+        if slice_dict:
+            logger.debug('Existing slice plan found: {}'.format(self.job_id))
+            return slice_dict
+        for index, (skip, limit) in enumerate(slice_ranges(keyspace, slices)):
+            slice_dict[str(index)] = {
+                'skip': skip,
+                'limit': limit,
+                'restore': 0,
+                'state': 'Queued',
+                'cracked': 0,
+                'total': 0,
+                'speed': 0,
+                'retries': 0,
+                }
+        self.redis_con.hset(self.key, mapping={
+            index: json.dumps(state) for index, state in slice_dict.items()})
+        return slice_dict
+
+    def slices(self):
+        """Return all slice states"""
+        return {index.decode(): json.loads(state) for index, state
+                in self.redis_con.hgetall(self.key).items()}
+
+    def update(self, index, **state):
+        """Update a single slice state, None if the plan was removed"""
+        slice_state = self.redis_con.hget(self.key, str(index))
+        if slice_state is None:
+            return None
+        slice_state = json.loads(slice_state)
+        slice_state.update(state)
+        self.redis_con.hset(self.key, str(index), json.dumps(slice_state))
+        return slice_state
+
+    def fan_out(self, hc_args, timeout=1814400, indexes=None):
+        """
+        Queue unfinished slices on the slices queue
+
+        Arguments
+        ---------
+        hc_args: dict
+            hc_worker arguments for the parent job
+        timeout: int
+            timeout for each slice job
+        indexes: list
+            only queue these slice indexes, default is all unfinished slices
+        """
+        self.redis_con.delete(self.stop_key)
+        slice_args = {k: v for k, v in hc_args.items()
+                      if k in ['hash_file', 'hash_mode', 'attack_mode',
+                               'rules', 'mask', 'wordlist', 'wordlist2',
+                               'username', 'pot_path']}
+        for index, state in self.slices().items():
+            if state['state'] in ['Exhausted', 'Cracked']:
+                continue
+            if indexes is not None and index not in indexes:
+                continue
+            slice_id = '{}_slice{}'.format(self.job_id, index)
+            logger.debug('Queuing slice: {}'.format(slice_id))
+            slice_q.enqueue_call(func=slice_worker, job_id=slice_id,
+                                 kwargs=dict(slice_args, job_id=self.job_id,
+                                             index=index),
+                                 timeout=timeout, result_ttl=86400,
+                                 failure_ttl=604800)
+            self.update(index, state='Queued')
+
+    def stop(self):
+        """Signal all slices to stop"""
+        logger.debug('Stopping all slices: {}'.format(self.job_id))
+        self.redis_con.set(self.stop_key, 1)
+        control.publish(self.stop_key, 'Stop')
+
+    def stopped(self):
+        """Check for the stop signal"""
+        return bool(self.redis_con.exists(self.stop_key))
+
+    def wait_stopped(self, timeout=120):
+        """
+        Wait for running slices to stop, after stop()
+
+        Returns
+        -------
+        boolean
+            True if no slices are still running
+        """
+        end = time.time() + timeout
+        while True:
+            running = False
+            for index in self.slices():
+                slice_job = slice_q.fetch_job('{}_slice{}'.format(self.job_id, index))
+                if slice_job and slice_job.get_status() == 'started':
+                    running = True
+                    break
+            if not running or time.time() > end:
+                return not running
+            sleep(2)
+
+    def cleanup(self):
+        """Remove all slice state, slice jobs and slice output files"""
+        for index in self.slices():
+            slice_id = '{}_slice{}'.format(self.job_id, index)
+            slice_job = slice_q.fetch_job(slice_id)
+            if slice_job:
+                slice_job.delete()
+            slice_file = valid.val_filepath(
+                path_string=log_dir,
+                file_string='{}.cracked'.format(slice_id))
+            try:
+                os.remove(slice_file)
+            except OSError:
+                pass
+        self.redis_con.delete(self.key, self.stop_key, self.offset_key)
+
+    def merge(self, outfile):
+        """
+        Append newly cracked lines from each slice output file to the
+        job's cracked file, skipping hashes already present
+
+        Only lines appended to the job's cracked file since the last
+        call are read, the file offset is tracked as for the slice files
+
+        Arguments
+        ---------
+        outfile: str
+            job .cracked file
+
+        Returns
+        -------
+        cracked: int
+            number of unique cracked hashes in the job's cracked file
+        """
+        merged = self.merged
+        try:
+            with open(outfile, 'r') as fh_out:
+                fh_out.seek(self.merged_offset)
+                for line in iter(fh_out.readline, ''):
+                    if not line.endswith('\n'):
+                        break
+                    self.merged_offset += len(line.encode())
+                    merged.add(line.rstrip('\n'))
+        except FileNotFoundError:
+            self.merged_offset = 0
+        with open(outfile, 'a') as fh_out:
+            for index in self.slices():
+                slice_file = valid.val_filepath(
+                    path_string=log_dir,
+                    file_string='{}_slice{}.cracked'.format(self.job_id, index))
+                offset = int(self.redis_con.hget(self.offset_key, index) or 0)
+                try:
+                    with open(slice_file, 'r') as fh_slice:
+                        fh_slice.seek(offset)
+                        for line in iter(fh_slice.readline, ''):
+                            if not line.endswith('\n'):
+                                # partial write, pick it up next pass
+                                break
+                            offset += len(line.encode())
+                            if line.rstrip('\n') not in merged:
+                                merged.add(line.rstrip('\n'))
+                                fh_out.write(line)
+                                self.merged_offset += len(line.encode())
+                    self.redis_con.hset(self.offset_key, index, offset)
+                except FileNotFoundError:
+                    logger.debug('No output yet for slice: {}'.format(index))
+        return len(merged)
+
+    def progress(self, cracked, pot_cracked=0):
+        """
+        Aggregate slice state into a hashcat like status dict
+
+        Arguments
+        ---------
+        cracked: int
+            number of unique cracked hashes, from merge()
+        pot_cracked: int
+            hashes resolved from the potfile index at submit, these are
+            in the job's cracked file but not the slices' hash file
+
+        Returns
+        -------
+        status_dict: dict
+        """
+        slice_dict = self.slices()
+        keyspace = sum(s['limit'] for s in slice_dict.values())
+        done = sum(s['limit'] if s['state'] in ['Exhausted', 'Cracked']
+                   else s['restore'] for s in slice_dict.values())
+        speed = sum(s['speed'] for s in slice_dict.values()
+                    if s['state'] == 'Running')
+        status_dict = {
+            'Status': 'Running',
+            'Cracked Hashes': cracked,
+            'Total Hashes': max([s['total'] for s in slice_dict.values()] + [0])
+                            + pot_cracked,
+            'Progress': int(done * 100 / keyspace) if keyspace else 0,
+            'Restore Point': done,
+            'Restore Total': keyspace,
+            'Speed Raw': speed,
+            'Speed All': '{} H/s'.format(speed),
+            'Slices': {index: s['state'] for index, s in slice_dict.items()},
+            }
+        return status_dict
+
+    def complete(self, status_dict, pot_cracked=0):
+        """
+        Check if the job is finished
+
+        Arguments
+        ---------
+        status_dict: dict
+            from progress()
+        pot_cracked: int
+            as passed to progress()
+
+        Returns
+        -------
+        result: str | None
+            'Cracked', 'Exhausted', 'Failed' if every slice finished but
+            some failed, or None if still running
+        """
+        states = status_dict['Slices'].values()
+        # no slice has reported its hash count yet
+        started = status_dict['Total Hashes'] > pot_cracked
+        if 'Cracked' in states or (started
+                                   and status_dict['Cracked Hashes']
+                                   >= status_dict['Total Hashes']):
+            return 'Cracked'
+        if all(state in ['Exhausted', 'Failed'] for state in states):
+            if 'Failed' in states:
+                return 'Failed'
+            return 'Exhausted'
+        return None
+
+    def failed_ranges(self):
+        """
+        Keyspace ranges of the failed slices
+
+        Returns
+        -------
+        ranges: list
+            [skip, limit] of each failed slice
+        """
+        return [[state['skip'], state['limit']] for index, state
+                in sorted(self.slices().items(), key=lambda s: int(s[0]))
+                if state['state'] == 'Failed']
+
+    def requeue_failed(self, hc_args, req_max, timeout=1814400):
+        """
+        Requeue slices whose RQ job failed, up to req_max times
+        """
+        for index, state in self.slices().items():
+            slice_job = slice_q.fetch_job('{}_slice{}'.format(self.job_id, index))
+            if slice_job and slice_job.get_status() == 'failed':
+                if state['retries'] < int(req_max):
+                    logger.warning('Requeuing failed slice: {}'.format(slice_job.id))
+                    slice_job.delete()
+                    self.update(index, retries=state['retries'] + 1)
+                    self.fan_out(hc_args, timeout=timeout, indexes=[index])
+                elif state['state'] != 'Failed':
+                    self.update(index, state='Failed')
+
+
+def run_sliced(job, slices, hc_args):
+    """
+    Coordinate a sliced job, called from hc_worker in place of runner
+
+    Arguments
+    ---------
+    job: object
+        RQ job for the parent job
+    slices: int
+        number of slices to split the job into
+    hc_args: dict
+        hc_worker arguments
+
+    Returns
+    -------
+    result: str | None
+        'Cracked'/'Exhausted' on completion, None if stopped, or
+        False if the job is not worth slicing and should run normally.
+        Raises ValueError if slices failed past their retries, with
+        their keyspace ranges in the job meta as 'Failed Slices'
+    """
+    coord = Coordinator(job.id)
+    if not coord.slices():
+        keyspace = keyspace_probe(**hc_args)
+        if not keyspace or keyspace < slice_conf()['min_keyspace']:
+            logger.info('Keyspace too small to slice: {}'.format(keyspace))
+            return False
+        coord.plan(keyspace, slices)
+    coord.fan_out(hc_args, timeout=job.timeout)
+    req_max = CRACK_CONF['misc']['req_max']
+    listener = control.Listener(coord.job_id)
+    try:
+        return coordinate(coord, hc_args, req_max, listener)
+    finally:
+        listener.close()
+
+
+def coordinate(coord, hc_args, req_max, listener):
+    """
+    Coordinator loop for run_sliced, merges output and tracks progress
+    until the job completes or is stopped
+    """
+    from crackq import run_hashcat
+    while True:
+        job = run_hashcat.redis_q.fetch_job(coord.job_id)
+        if not job:
+            coord.stop()
+            return None
+        if job.meta['CrackQ State'] in ['Stop', 'Delete']:
+            logger.info('Stopping sliced job: {}'.format(job.id))
+            coord.stop()
+            if job.meta['CrackQ State'] == 'Delete':
+                coord.cleanup()
+            control.ack(job.id)
+            return None
+        cracked = coord.merge(hc_args['outfile'])
+        pot_cracked = job.meta.get('Pot Cracked', 0)
+        status_dict = coord.progress(cracked, pot_cracked=pot_cracked)
+        result = coord.complete(status_dict, pot_cracked=pot_cracked)
+        if result:
+            # final merge once any running slices have stopped
+            cracked = drain(coord, hc_args['outfile'])
+            status_dict = coord.progress(cracked, pot_cracked=pot_cracked)
+            status_dict['Status'] = result
+        job.meta['HC State'] = status_dict
+        if result == 'Failed':
+            job.meta['Failed Slices'] = coord.failed_ranges()
+        job.save_meta()
+        write_status(job.id, status_dict)
+        events.publish(job.id, status_dict)
+        if result:
+            coord.cleanup()
+        if result == 'Failed':
+            raise ValueError('Aborted: slices failed, keyspace ranges: {}'.format(
+                job.meta['Failed Slices']))
+        if result:
+            logger.info('Sliced job complete: {} {}'.format(job.id, result))
+            return result
+        coord.requeue_failed(hc_args, req_max, timeout=job.timeout)
+        listener.wait(timeout=10)
+
+
+def drain(coord, outfile):
+    """
+    Stop any running slices once the job has a final result and merge
+    their last output, before the slices are cleaned up
+
+    Returns
+    -------
+    cracked: int
+        as per Coordinator.merge()
+    """
+    coord.stop()
+    if not coord.wait_stopped():
+        logger.warning('Slices still running for: {}'.format(coord.job_id))
+    return coord.merge(outfile)
+
+
+def write_status(job_id, status_dict):
+    """
+    Update cracked/total counts in the CrackQ json status file
+    """
+    result_file = valid.val_filepath(path_string=log_dir,
+                                     file_string='{}.json'.format(job_id))
+    try:
+        with open(result_file, 'r+') as result_fh:
+            job_details = json.loads(result_fh.read().strip())
+            job_details['Cracked Hashes'] = status_dict['Cracked Hashes']
+            job_details['Total Hashes'] = status_dict['Total Hashes']
+            result_fh.seek(0)
+            result_fh.write(json.dumps(job_details))
+            result_fh.truncate()
+    except (IOError, ValueError) as err:
+        logger.debug('Status update failure: {}'.format(err))
+
+
+def slice_worker(job_id=None, index=None, hash_file=None, hash_mode=1000,
+                 attack_mode=0, rules=None, mask=None, wordlist=None,
+                 wordlist2=None, username=False, pot_path=None):
+    """
+    Run a single keyspace slice of a job, executed by any RQ worker
+    listening on the 'slices' queue
+
+    Arguments
+    ---------
+    job_id: str
+        parent job ID
+    index: str
+        slice index in the coordinator plan
+
+    Returns
+    -------
+    hc_state: str
+        final hashcat state for the slice
+    """
+    from crackq import run_hashcat
+    coord = Coordinator(job_id)
+    state = coord.slices()[str(index)]
+    session = '{}_slice{}'.format(job_id, index)
+    outfile = str(valid.val_filepath(path_string=log_dir,
+                                     file_string='{}.cracked'.format(session)))
+    logger.info('Running slice {}: skip {} limit {}'.format(
+        session, state['skip'], state['limit']))
+    slot = devices.DeviceSlot(session)
+    try:
+        hcat = run_hashcat.runner(hash_file=hash_file, mask=mask,
+                                  session=session, wordlist=wordlist,
+                                  wordlist2=wordlist2, outfile=outfile,
+                                  attack_mode=attack_mode, hash_mode=hash_mode,
+                                  rules=rules, username=username,
+                                  pot_path=pot_path, brain=False,
+                                  restore=state['skip'] + state['restore'],
+                                  limit=state['limit'] - state['restore'],
+                                  backend_devices=slot.claim())
+    except Exception:
+        slot.release()
+        raise
+    try:
+        coord.update(index, state='Running')
+        hcat.event_connect(callback=run_hashcat.error_callback,
+                           signal="EVENT_LOG_ERROR")
+        started = time.time()
+        listener = control.Listener(coord.stop_key)
+        try:
+            while True:
+                hc_state = hcat.status_get_status_string()
+                hcat_status = run_hashcat.status(hcat)
+                if isinstance(hcat_status, dict):
+                    # restore point is absolute, store it relative to the slice
+                    coord.update(index,
+                                 restore=max(0, int(hcat_status['Restore Point'])
+                                             - state['skip']),
+                                 cracked=hcat.status_get_digests_done(),
+                                 total=hcat.status_get_digests_cnt(),
+                                 speed=int(hcat_status['Speed Raw']))
+                if hc_state in ['Exhausted', 'Cracked']:
+                    logger.info('Slice finished {}: {}'.format(session, hc_state))
+                    coord.update(index, state=hc_state, restore=state['limit'])
+                    break
+                elif hc_state == 'Aborted':
+                    event_log = hcat.hashcat_status_get_log()
+                    coord.update(index, state='Failed')
+                    raise ValueError('Aborted: {}'.format(event_log))
+                elif coord.stopped():
+                    logger.info('Stopping slice: {}'.format(session))
+                    coord.update(index, state='Stopped')
+                    break
+                elif hc_state != 'Running' and time.time() - started > 3000:
+                    raise ValueError('Error: Hashcat hung - Initialize timeout')
+                listener.wait(timeout=10)
+                slot.refresh()
+        finally:
+            listener.close()
+        hcat.hashcat_session_quit()
+        hcat.reset()
+    finally:
+        slot.release()
+    return hc_state
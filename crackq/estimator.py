@@ -0,0 +1,241 @@
+"""Offline speed and runtime prediction from the hash mode benchmarks"""
+from datetime import datetime, timedelta
+
+from crackq import hash_modes, keyspace, speedcache
+from crackq.conf import hc_conf
+from crackq.logger import logger
+
+CRACK_CONF = hc_conf()
+# categories of hash modes without salts
+UNSALTED_CATEGORIES = [
+    'Raw Hash',
+    'Raw Checksum',
+    'Plaintext',
+    ]
+UNSALTED_MODES = [
+    '900',
+    '1000',
+    '3000',
+    ]
+# brain_check() speed per salt threshold
+BRAIN_THRESHOLD = 500000
+
+
+def estimator_conf():
+    """
+    Get the estimator settings from the config file, using defaults
+    if the section is missing
+
+    Returns
+    -------
+    conf_dict: dict
+        'host_rate' words/sec the host can feed to the devices and the
+        decision 'margin' required for a confident prediction
+    """
+    conf_dict = {
+        'host_rate': 5000000,
+        'margin': 10,
+        }
+    if 'estimator' in CRACK_CONF:
+        for key in conf_dict:
+            if key in CRACK_CONF['estimator']:
+                conf_dict[key] = int(CRACK_CONF['estimator'][key])
+    return conf_dict
+
+
+def mode_bench(hash_mode):
+    """
+    Get the benchmark speed for a hash mode from hashm_dict
+
+    Returns
+    -------
+    bench: float | None
+        benchmark speed in H/s
+    category: str | None
+        hash mode category
+    """
+    try:
+        mode_info = hash_modes.HModes.modes_dict()[str(hash_mode)]
+    except (IOError, KeyError, ValueError) as err:
+        logger.debug('No hash mode info: {}'.format(err))
+        return None, None
+    if len(mode_info) < 3:
+        return None, mode_info[1]
+    return float(mode_info[2]), mode_info[1]
+
+
+def salts_estimate(hash_mode, category, hash_count):
+    """
+    Estimate the salt count, unsalted modes have a single salt and for
+    others each hash is assumed to have a unique salt
+
+    Returns
+    -------
+    salts: int
+    exact: boolean
+    """
+    if category in UNSALTED_CATEGORIES or str(hash_mode) in UNSALTED_MODES:
+        return 1, True
+    if hash_count <= 1:
+        return 1, True
+    return hash_count, False
+
+
+def efficiency(attack_mode, bench, rules=None, wordlist2=None):
+    """
+    Fraction of the device benchmark speed expected for an attack
+
+    Wordlist attacks are limited by the rate the host can feed words to
+    the devices, rules and the right hand combinator wordlist amplify
+    each word on the device.
+    """
+    attack_mode = int(attack_mode) if attack_mode is not None else 0
+    if attack_mode in [3, 6, 7] or not bench:
+        return 1.0
+    amplifier = 1
+    if attack_mode == 0 and rules:
+        amplifier = max(speedcache.rule_lines(rules), 1)
+    elif attack_mode == 1 and wordlist2:
+        amplifier = max(keyspace.wordlist_lines(wordlist2)[0], 1)
+    return min(1.0, estimator_conf()['host_rate'] * amplifier / bench)
+
+
+def estimate(hash_mode=1000, attack_mode=0, hash_count=1, rules=None,
+             wordlist2=None, **kwargs):
+    """
+    Predict the speed and runtime for a job without running hashcat
+
+    Arguments
+    ---------
+    hash_mode: int
+    attack_mode: int
+    hash_count: int
+        number of hashes in the job
+    rules: list
+        rule file paths
+    kwargs: dict
+        other hc_worker arguments, used to calculate the keyspace
+
+    Returns
+    -------
+    est_dict: dict | None
+        'Speed' H/s, 'Salts', 'Keyspace', 'Seconds' to exhaust the
+        keyspace, 'Brain' decision and 'Confident' if the brain
+        decision is well clear of the threshold. None if there's no
+        benchmark for the hash mode
+    """
+    bench, category = mode_bench(hash_mode)
+    if not bench:
+        return None
+    salts, salts_exact = salts_estimate(hash_mode, category, hash_count)
+    speed = int(bench * efficiency(attack_mode, bench, rules=rules,
+                                   wordlist2=wordlist2))
+    ks, ks_exact = keyspace.job_keyspace(attack_mode=attack_mode,
+                                         rules=rules, wordlist2=wordlist2,
+                                         **kwargs)
+    margin = estimator_conf()['margin']
+    # the hash count is an upper bound for salts, so the speed per salt
+    # lies between speed / salts and speed when salts aren't exact
+    upper = speed if not salts_exact else speed / salts
+    lower = speed / salts
+    brain = lower < BRAIN_THRESHOLD
+    confident = (upper < BRAIN_THRESHOLD / margin
+                 or lower > BRAIN_THRESHOLD * margin)
+    est_dict = {
+        'Speed': speed,
+        'Salts': salts,
+        'Keyspace': ks,
+        'Seconds': int(ks * salts / speed) if ks and speed else None,
+        'Exact Keyspace': ks_exact,
+        'Brain': brain,
+        'Confident': confident,
+        }
+    logger.debug('Job estimate: {}'.format(est_dict))
+    return est_dict
+
+
+def remaining(job_dict, now):
+    """
+    Estimate the seconds left for a running job, extrapolated from its
+    progress or falling back to the submit time estimate
+
+    Arguments
+    ---------
+    job_dict: dict
+        job state, as per Queuer.q_jobstate
+    now: datetime
+        current UTC time
+
+    Returns
+    -------
+    seconds: int | None
+    """
+    meta = job_dict.get('State') or {}
+    hc_state = meta.get('HC State')
+    try:
+        started = datetime.fromisoformat(job_dict['Time started'])
+        elapsed = max((now - started).total_seconds(), 0)
+    except (KeyError, TypeError, ValueError):
+        started = None
+        elapsed = 0
+    if started and isinstance(hc_state, dict):
+        try:
+            progress = float(hc_state.get('Progress', 0))
+        except (TypeError, ValueError):
+            progress = 0
+        if 0 < progress < 100:
+            return int(elapsed * (100 - progress) / progress)
+    est = meta.get('Estimate')
+    if isinstance(est, dict) and est.get('Seconds') is not None:
+        return int(max(est['Seconds'] - elapsed, 0))
+    return None
+
+
+def project(q_dict, slots=1, now=None):
+    """
+    Add projected start and finish times to each job in a queue status
+    dictionary, assuming queued jobs run in order on the first worker
+    to become free
+
+    Arguments
+    ---------
+    q_dict: dict
+        queue status, as per Queuer.q_monitor
+    slots: int
+        number of workers processing the queue
+    now: datetime
+        current UTC time
+
+    Returns
+    -------
+    q_dict: dict
+        with 'Projected Start' and 'Projected Finish' set on each job,
+        None where the projection isn't possible
+    """
+    if not now:
+        now = datetime.utcnow()
+    free = []
+    for job_dict in q_dict['Current Job'].values():
+        seconds = remaining(job_dict, now)
+        finish = now + timedelta(seconds=seconds) if seconds is not None else None
+        job_dict['Projected Start'] = job_dict.get('Time started')
+        job_dict['Projected Finish'] = str(finish.replace(microsecond=0)) if finish else None
+        if finish:
+            free.append(finish)
+    # idle workers and workers with unknown runtimes
+    idle = max(slots - len(q_dict['Current Job']), 0)
+    free.extend([now] * idle)
+    for job_dict in q_dict['Queued Jobs'].values():
+        job_dict['Projected Start'] = None
+        job_dict['Projected Finish'] = None
+        if not free:
+            continue
+        free.sort()
+        start = free.pop(0)
+        job_dict['Projected Start'] = str(start.replace(microsecond=0))
+        est = (job_dict.get('State') or {}).get('Estimate')
+        if isinstance(est, dict) and est.get('Seconds') is not None:
+            finish = start + timedelta(seconds=est['Seconds'])
+            job_dict['Projected Finish'] = str(finish.replace(microsecond=0))
+            free.append(finish)
+    return q_dict
@@ -0,0 +1,126 @@
+"""Job progress events, published by the workers and streamed to clients"""
+import json
+import time
+
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from redis import Redis
+from redis.exceptions import RedisError
+
+CRACK_CONF = hc_conf()
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+CHANNEL = 'crackq:events'
+FIELDS = [
+    'Status',
+    'Progress',
+    'Speed Raw',
+    'Cracked Hashes',
+    'Total Hashes',
+    'CrackQ State',
+    ]
+# last values published by this process, used to only send deltas
+last_sent = {}
+
+
+def stream_conf():
+    """
+    Get the event stream settings from the config file, using defaults
+    if the section is missing
+
+    Returns
+    -------
+    conf_dict: dict
+        'heartbeat' and 'max_time' integer settings in seconds
+    """
+    conf_dict = {
+        'heartbeat': 15,
+        'max_time': 300,
+        }
+    if 'events' in CRACK_CONF:
+        for key in conf_dict:
+            if key in CRACK_CONF['events']:
+                conf_dict[key] = int(CRACK_CONF['events'][key])
+    return conf_dict
+
+
+def publish(job_id, update, delta=True):
+    """
+    Publish a job update event
+
+    Arguments
+    ---------
+    job_id: str
+        RQ job ID
+    update: dict
+        job state values, only the keys in FIELDS are sent
+    delta: boolean
+        only send values that changed since the last event published
+        for this job by this process
+
+    Returns
+    -------
+    message: dict | None
+        the event sent or None if nothing changed
+    """
+    last = last_sent.setdefault(job_id, {})
+    message = {key: val for key, val in update.items() if key in FIELDS
+               and (not delta or last.get(key) != val)}
+    if not message:
+        return None
+    last.update(message)
+    message['job_id'] = job_id
+    try:
+        redis_con.publish(CHANNEL, json.dumps(message))
+    except RedisError as err:
+        logger.debug('Failed to publish event: {}'.format(err))
+    return message
+
+
+def forget(job_id):
+    """Clear the last published values for a finished job"""
+    last_sent.pop(job_id, None)
+
+
+def format_event(event, data):
+    """Format a Server-Sent Events message"""
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+
+
+def stream(initial=None):
+    """
+    Generator producing a Server-Sent Events stream of job updates
+
+    The stream ends after max_time seconds, clients reconnect
+    automatically which frees the API worker thread periodically.
+
+    Arguments
+    ---------
+    initial: dict
+        job states keyed by job ID, sent as the first event so clients
+        don't need to poll for the current state
+
+    Returns
+    -------
+    generator of str
+    """
+    conf = stream_conf()
+    pubsub = redis_con.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(CHANNEL)
+    try:
+        yield 'retry: 3000\n\n'
+        if initial is not None:
+            yield format_event('snapshot', initial)
+        start = time.time()
+        last_beat = start
+        while time.time() - start < conf['max_time']:
+            message = pubsub.get_message(timeout=1)
+            if message and message['type'] == 'message':
+                yield format_event('job', json.loads(message['data']))
+            elif time.time() - last_beat >= conf['heartbeat']:
+                last_beat = time.time()
+                yield ': heartbeat\n\n'
+    except RedisError as err:
+        logger.warning('Event stream error: {}'.format(err))
+    finally:
+        pubsub.close()
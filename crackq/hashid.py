@@ -0,0 +1,151 @@
+"""Hash mode identification from samples of a submitted hash list"""
+import re
+
+from crackq import hash_modes
+from crackq.conf import hc_conf
+from crackq.logger import logger
+
+CRACK_CONF = hc_conf()
+# lines sampled from a hash list
+SAMPLE = 1000
+# hash formats and the modes accepting them, a mode listed here is
+# assumed not to accept any format it isn't listed against
+FORMATS = [
+    ('Hex 16', r'^[a-f0-9]{16}$', ['3000']),
+    ('Hex 32', r'^[a-f0-9]{32}$', ['0', '900', '1000', '3000', '2600',
+                                    '3500', '4300']),
+    ('Hex 40', r'^[a-f0-9]{40}$', ['100', '300', '4500', '4700', '6000']),
+    ('Hex 56', r'^[a-f0-9]{56}$', ['1300', '17300']),
+    ('Hex 64', r'^[a-f0-9]{64}$', ['1400', '6900', '11700', '17400']),
+    ('Hex 96', r'^[a-f0-9]{96}$', ['10800', '17500']),
+    ('Hex 128', r'^[a-f0-9]{128}$', ['1700', '6100', '17600']),
+    ('PWDUMP', r'^[^:]*:\d+:[a-f0-9]{32}:[a-f0-9]{32}:::', ['1000', '3000']),
+    ('md5crypt', r'^\$1\$', ['500']),
+    ('sha256crypt', r'^\$5\$', ['7400']),
+    ('sha512crypt', r'^\$6\$', ['1800']),
+    ('bcrypt', r'^\$2[abxy]?\$\d{2}\$', ['3200', '25600', '25800']),
+    ('phpass', r'^\$[PH]\$', ['400']),
+    ('DCC2', r'^\$DCC2\$', ['2100']),
+    ('NetNTLMv1', r'^[^:]*::[^:]*:[a-f0-9]{48}:[a-f0-9]{48}:[a-f0-9]{16}$',
+     ['5500', '27000']),
+    ('NetNTLMv2', r'^[^:]*::[^:]*:[a-f0-9]{16}:[a-f0-9]{32}:[a-f0-9]+$',
+     ['5600', '27100']),
+    ('Kerberos TGS-REP RC4', r'^\$krb5tgs\$23\$', ['13100']),
+    ('Kerberos TGS-REP AES128', r'^\$krb5tgs\$17\$', ['19600']),
+    ('Kerberos TGS-REP AES256', r'^\$krb5tgs\$18\$', ['19700']),
+    ('Kerberos AS-REP', r'^\$krb5asrep\$23\$', ['18200']),
+    ('Kerberos AS-REQ', r'^\$krb5pa\$23\$', ['7500']),
+    ('WPA', r'^WPA\*0[12]\*', ['22000', '22001']),
+    ('PMKID', r'^[a-f0-9]{32}\*[a-f0-9]{12}\*[a-f0-9]{12}\*[a-f0-9]*$',
+     ['16800']),
+    ('MS Office', r'^\$office\$\*(2007|2010|2013)\*', ['9400', '9500', '9600']),
+    ('WinZip', r'^\$zip2\$', ['13600']),
+    ('7-Zip', r'^\$7z\$', ['11600']),
+    ('KeePass', r'^\$keepass\$', ['13400']),
+    ('RAR5', r'^\$rar5\$', ['13000']),
+    ('MSSQL 2005', r'^0x0100[a-f0-9]{48}$', ['132']),
+    ('MSSQL 2012', r'^0x0200[a-f0-9]{136}$', ['1731']),
+    ]
+PATTERNS = [(name, re.compile(regex, re.IGNORECASE), modes)
+            for name, regex, modes in FORMATS]
+
+
+def hashid_conf():
+    """
+    Check if mismatched hash modes are rejected at submit time, set in
+    the config file
+    """
+    if 'hashid' in CRACK_CONF:
+        return str(CRACK_CONF['hashid'].get('reject', 'True')).lower() == 'true'
+    return True
+
+
+def sample_file(hash_file, size=SAMPLE):
+    """
+    Read a sample of non-empty lines from the start of a hash file
+
+    Returns
+    -------
+    sample: list
+    """
+    sample = []
+    with open(hash_file, 'r') as hash_fh:
+        for line in hash_fh:
+            line = line.strip()
+            if line:
+                sample.append(line)
+                if len(sample) >= size:
+                    break
+    return sample
+
+
+def strip_user(line, username=False):
+    """Remove the username from a hash line"""
+    if username and ':' in line:
+        return line.split(':', 1)[1]
+    return line
+
+
+def classify(sample, username=False):
+    """
+    Propose hash modes for a sample of hashes
+
+    Arguments
+    ---------
+    sample: list
+        hash lines
+    username: boolean
+        hashes are prefixed with a username
+
+    Returns
+    -------
+    mode_list: list
+        dicts with the 'Mode', mode 'Name', matching 'Format' and
+        'Confidence', the fraction of sampled hashes matching the
+        format, best matches first
+    """
+    sample = [strip_user(line.strip(), username) for line in sample if line.strip()]
+    if not sample:
+        return []
+    try:
+        modes_dict = hash_modes.HModes.modes_dict()
+    except (IOError, ValueError) as err:
+        logger.debug('No hash mode info: {}'.format(err))
+        modes_dict = {}
+    mode_list = []
+    for name, pattern, modes in PATTERNS:
+        matched = sum(1 for line in sample if pattern.match(line))
+        if not matched:
+            continue
+        for mode in modes:
+            mode_list.append({
+                'Mode': int(mode),
+                'Name': modes_dict[mode][0] if mode in modes_dict else None,
+                'Format': name,
+                'Confidence': round(matched / len(sample), 3),
+                })
+    mode_list.sort(key=lambda mode_d: -mode_d['Confidence'])
+    return mode_list
+
+
+def check(sample, hash_mode, username=False):
+    """
+    Check a sample of hashes against the selected hash mode
+
+    Only modes with known formats are checked, a mismatch is when none
+    of the sampled hashes match any format the mode accepts.
+
+    Returns
+    -------
+    match: boolean
+        False for an obvious mismatch
+    mode_list: list
+        as per classify()
+    """
+    mode_list = classify(sample, username=username)
+    hash_mode = str(hash_mode)
+    known = [modes for _, _, modes in PATTERNS if hash_mode in modes]
+    if not known or not sample:
+        return True, mode_list
+    match = any(mode_d['Mode'] == int(hash_mode) for mode_d in mode_list)
+    return match, mode_list
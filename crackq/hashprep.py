@@ -0,0 +1,160 @@
+"""Hash list normalization and deduplication before a job is queued"""
+import os
+import re
+import sqlite3
+
+from crackq.logger import logger
+
+# raw hex digest modes, where hashcat ignores case
+HEX_MODES = [
+    '0',
+    '100',
+    '300',
+    '900',
+    '1000',
+    '1300',
+    '1400',
+    '1700',
+    '3000',
+    '5100',
+    '6000',
+    '10800',
+    '17300',
+    '17400',
+    '17500',
+    '17600',
+    ]
+HEX = re.compile(r'^[0-9A-Fa-f]+$')
+# lines per insert batch
+BATCH = 10000
+
+
+def split_user(line, username=False):
+    """
+    Split a hash line into the username and hash
+
+    Returns
+    -------
+    user: str | None
+    hash_v: str
+    """
+    if username and ':' in line:
+        user, hash_v = line.split(':', 1)
+        return user, hash_v
+    return None, line
+
+
+def normalize(hash_v, hash_mode):
+    """
+    Normalize a hash for its mode, so equivalent hashes deduplicate
+
+    Arguments
+    ---------
+    hash_v: str
+        hash without any username
+    hash_mode: int
+
+    Returns
+    -------
+    hash_v: str
+        stripped and, for raw hex digests, lower cased
+    """
+    hash_v = hash_v.strip()
+    if str(hash_mode) in HEX_MODES and HEX.match(hash_v):
+        return hash_v.lower()
+    return hash_v
+
+
+def prepare(hash_file, hash_mode, username=False):
+    """
+    Normalize and deduplicate a job hash file in place, leaving it as
+    submitted on failure
+
+    Returns
+    -------
+    stats_dict: dict | None
+        as per dedupe(), None on failure
+    """
+    try:
+        return dedupe(hash_file, hash_mode, username=username)
+    except (IOError, OSError, sqlite3.Error) as err:
+        logger.error('Failed to prepare hash list: {}'.format(err))
+        return None
+
+
+def dedupe(hash_file, hash_mode, username=False):
+    """
+    Normalize and deduplicate a job hash file in place
+
+    Duplicates are tracked in a temporary SQLite table on disk, so large
+    hash lists don't need to fit in memory. For username jobs the first
+    username for each hash is kept in the hash file and every normalized
+    user:hash line is written to a '.users' file alongside it, so
+    reports can still count shared passwords.
+
+    Arguments
+    ---------
+    hash_file: str
+        job hash file location
+    hash_mode: int
+    username: boolean
+        hashes are prefixed with a username
+
+    Returns
+    -------
+    stats_dict: dict
+        'Submitted', 'Unique' and 'Duplicates' hash counts
+    """
+    db_path = '{}.dedup'.format(hash_file)
+    out_path = '{}.tmp'.format(hash_file)
+    users_path = '{}.users'.format(os.path.splitext(hash_file)[0])
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    total = 0
+    try:
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('CREATE TABLE uniq (hash TEXT UNIQUE, line TEXT)')
+        conn.execute('BEGIN')
+        batch = []
+        users_fh = open(users_path, 'w') if username else None
+        try:
+            with open(hash_file, 'r') as hash_fh:
+                for line in hash_fh:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    user, hash_v = split_user(line, username)
+                    hash_v = normalize(hash_v, hash_mode)
+                    line = '{}:{}'.format(user, hash_v) if user is not None else hash_v
+                    if users_fh:
+                        users_fh.write(line + '\n')
+                    batch.append((hash_v, line))
+                    total += 1
+                    if len(batch) >= BATCH:
+                        conn.executemany('INSERT OR IGNORE INTO uniq (hash, line) '
+                                         'VALUES (?, ?)', batch)
+                        batch = []
+        finally:
+            if users_fh:
+                users_fh.close()
+        conn.executemany('INSERT OR IGNORE INTO uniq (hash, line) '
+                         'VALUES (?, ?)', batch)
+        conn.execute('COMMIT')
+        unique = 0
+        with open(out_path, 'w') as out_fh:
+            for (line,) in conn.execute('SELECT line FROM uniq ORDER BY rowid'):
+                out_fh.write(line + '\n')
+                unique += 1
+    finally:
+        conn.close()
+        os.remove(db_path)
+    os.replace(out_path, hash_file)
+    stats_dict = {
+        'Submitted': total,
+        'Unique': unique,
+        'Duplicates': total - unique,
+        }
+    logger.debug('Hash list prepared: {}'.format(stats_dict))
+    return stats_dict
@@ -0,0 +1,205 @@
+"""Structured job specification, stored in Redis when a job is queued"""
+import json
+
+from crackq import cq_api
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from redis import Redis
+from redis.exceptions import RedisError
+
+CRACK_CONF = hc_conf()
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+
+JOB_KEYS = [
+    'hash_mode',
+    'attack_mode',
+    'mask',
+    'wordlist',
+    'wordlist2',
+    'rules',
+    'name',
+    'username',
+    'increment',
+    'increment_min',
+    'increment_max',
+    'slices',
+    'restore',
+    ]
+BENCH_KEYS = [
+    'name',
+    'benchmark',
+    'benchmark_all',
+    ]
+# typed values, as passed to hc_worker
+INT_KEYS = [
+    'hash_mode',
+    'attack_mode',
+    'increment_min',
+    'increment_max',
+    'slices',
+    'restore',
+    ]
+BOOL_KEYS = [
+    'username',
+    'increment',
+    'disable_brain',
+    'brain_check',
+    'benchmark',
+    'benchmark_all',
+    ]
+
+
+def spec_key(job_id):
+    """Job spec key for a job"""
+    return 'crackq:jobspec:{}'.format(job_id)
+
+
+def conf_name(section, path):
+    """Reverse lookup of a config entry name from its path"""
+    for key, val in CRACK_CONF[section].items():
+        if val == path:
+            return key
+    return None
+
+
+def build(hc_args):
+    """
+    Build a job spec from the hc_worker arguments, with the same keys
+    as returned by get_jobdetails()
+
+    Values keep their hc_worker types: INT_KEYS are ints, BOOL_KEYS are
+    booleans and unset values are None rather than the strings parsed
+    from job descriptions. Details for jobs without a spec are converted
+    to match with normalise().
+
+    Arguments
+    ---------
+    hc_args: dict
+        hc_worker keyword arguments
+
+    Returns
+    -------
+    spec: dict
+        job details with wordlists, rules and mask files referenced by
+        their config names rather than paths
+    """
+    if hc_args.get('benchmark'):
+        return {key: hc_args[key] for key in BENCH_KEYS if key in hc_args}
+    spec = {key: hc_args[key] for key in JOB_KEYS if key in hc_args}
+    for key in ['wordlist', 'wordlist2']:
+        if spec.get(key):
+            spec[key] = conf_name('wordlists', spec[key])
+    if spec.get('rules'):
+        spec['rules'] = [conf_name('rules', rule) for rule in spec['rules']]
+    else:
+        spec['rules'] = None
+    if hc_args.get('mask_file') and spec.get('mask'):
+        spec['mask'] = conf_name('masks', spec['mask'])
+    return spec
+
+
+def normalise(deets_dict):
+    """
+    Convert job details parsed from a job description by
+    get_jobdetails(), where every value is a string, to the types
+    stored by build()
+
+    Arguments
+    ---------
+    deets_dict: dict
+        as returned by get_jobdetails()
+
+    Returns
+    -------
+    spec: dict
+    """
+    spec = {}
+    for key, val in deets_dict.items():
+        if val == 'None':
+            val = None
+        elif key in INT_KEYS:
+            try:
+                val = int(val)
+            except (TypeError, ValueError):
+                val = None
+        elif key in BOOL_KEYS:
+            val = val == 'True'
+        spec[key] = val
+    return spec
+
+
+def save(job_id, spec):
+    """Store the job spec"""
+    redis_con.set(spec_key(job_id), json.dumps(spec))
+
+
+def delete(job_id):
+    """Remove the job spec when a job is deleted"""
+    redis_con.delete(spec_key(job_id))
+
+
+def load(job_id):
+    """
+    Get the job spec
+
+    Returns
+    -------
+    spec: dict | None
+        None if no spec is stored for the job
+    """
+    try:
+        spec = redis_con.get(spec_key(job_id))
+    except RedisError as err:
+        logger.debug('Failed to get job spec: {}'.format(err))
+        return None
+    return json.loads(spec) if spec else None
+
+
+def details(job):
+    """
+    Get the job details for an RQ job, falling back to parsing the job
+    description for jobs queued before job specs were stored
+
+    Arguments
+    ---------
+    job: object
+        RQ job object
+
+    Returns
+    -------
+    spec: dict
+    """
+    spec = load(job.id)
+    if spec is None:
+        spec = normalise(cq_api.get_jobdetails(job.description))
+    return spec
+
+
+def details_many(jobs):
+    """
+    Get the job details for a list of RQ jobs using a single MGET
+
+    Arguments
+    ---------
+    jobs: list
+        RQ job objects
+
+    Returns
+    -------
+    spec_dict: dict
+        job details keyed by job ID
+    """
+    if not jobs:
+        return {}
+    specs = redis_con.mget([spec_key(job.id) for job in jobs])
+    spec_dict = {}
+    for job, spec in zip(jobs, specs):
+        if spec:
+            spec_dict[job.id] = json.loads(spec)
+        else:
+            try:
+                spec_dict[job.id] = normalise(cq_api.get_jobdetails(job.description))
+            except AttributeError:
+                spec_dict[job.id] = {}
+    return spec_dict
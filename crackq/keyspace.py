@@ -0,0 +1,247 @@
+"""Keyspace calculation for hashcat jobs"""
+import os
+
+from crackq import speedcache, wordindex
+from crackq.logger import logger
+
+# built-in charset sizes, plus the custom charsets set in runner()
+CHARSETS = {
+    'l': 26,
+    'u': 26,
+    'd': 10,
+    's': 33,
+    'a': 95,
+    'b': 256,
+    'h': 16,
+    'H': 16,
+    '1': 36,
+    '2': 62,
+    '3': 69,
+    '4': 69,
+    }
+# rough bytes per line, used when a wordlist hasn't been counted
+AVG_LINE = 10
+GZIP_RATIO = 3
+# wordlists larger than this are estimated from the file size rather
+# than counted
+COUNT_LIMIT = 268435456
+# wordlist line counts keyed by (path, mtime)
+line_counts = {}
+
+
+def mask_positions(mask, custom=None):
+    """
+    Get the number of candidates for each position in a mask
+
+    Arguments
+    ---------
+    mask: str
+        hashcat mask, i.e. ?u?l?l?l?d?d
+    custom: dict
+        custom charset sizes keyed by charset number, overriding the
+        defaults set in runner()
+
+    Returns
+    -------
+    positions: list
+        charset size for each position
+    """
+    charsets = dict(CHARSETS)
+    if custom:
+        charsets.update(custom)
+    positions = []
+    pos = 0
+    while pos < len(mask):
+        if mask[pos] == '?' and pos + 1 < len(mask):
+            charset = mask[pos+1]
+            if charset == '?':
+                positions.append(1)
+            else:
+                positions.append(charsets.get(charset, 1))
+            pos += 2
+        else:
+            positions.append(1)
+            pos += 1
+    return positions
+
+
+def charset_size(charset):
+    """
+    Get the number of characters in a custom charset definition, i.e.
+    ?l?d_ is 37
+
+    Overlapping built-in charsets are counted separately, so this can
+    overestimate slightly.
+    """
+    return min(sum(mask_positions(charset)), 256)
+
+
+def split_hcmask(line):
+    """
+    Split a .hcmask line into its fields, on commas not escaped with a
+    backslash
+
+    Returns
+    -------
+    fields: list
+        custom charsets followed by the mask
+    """
+    fields = ['']
+    pos = 0
+    while pos < len(line):
+        if line[pos] == '\\' and pos + 1 < len(line) and line[pos+1] == ',':
+            fields[-1] += ','
+            pos += 2
+            continue
+        if line[pos] == ',':
+            fields.append('')
+        else:
+            fields[-1] += line[pos]
+        pos += 1
+    return fields
+
+
+def mask_keyspace(mask, increment=False, increment_min=None,
+                  increment_max=None, custom=None):
+    """
+    Calculate the number of candidates for a mask
+
+    Arguments
+    ---------
+    mask: str
+        hashcat mask
+    increment: boolean
+        mask increment mode
+    increment_min: int
+        minimum increment length, default 1
+    increment_max: int
+        maximum increment length, default the mask length
+    custom: dict
+        custom charset sizes keyed by charset number
+
+    Returns
+    -------
+    keyspace: int
+    """
+    positions = mask_positions(mask, custom=custom)
+    if not increment:
+        lengths = [len(positions)]
+    else:
+        start = int(increment_min) if increment_min else 1
+        end = int(increment_max) if increment_max else len(positions)
+        lengths = range(max(start, 1), min(end, len(positions)) + 1)
+    keyspace = 0
+    for length in lengths:
+        count = 1
+        for size in positions[:length]:
+            count *= size
+        keyspace += count
+    return keyspace
+
+
+def mask_file_keyspace(mask_file, increment=False, increment_min=None,
+                       increment_max=None):
+    """
+    Calculate the number of candidates for a .hcmask file, including
+    any custom charsets set on each line
+
+    Returns
+    -------
+    keyspace: int | None
+        None if the file can't be read
+    """
+    keyspace = 0
+    try:
+        with open(mask_file, 'r') as fh_mask:
+            for line in fh_mask:
+                line = line.rstrip('\r\n')
+                if not line or line.startswith('#'):
+                    continue
+                fields = split_hcmask(line)
+                custom = {str(num): charset_size(charset) for num, charset
+                          in enumerate(fields[:-1][:4], start=1)}
+                keyspace += mask_keyspace(fields[-1], increment,
+                                          increment_min, increment_max,
+                                          custom=custom)
+    except (IOError, TypeError, UnicodeDecodeError) as err:
+        logger.debug('Mask file error: {}'.format(err))
+        return None
+    return keyspace
+
+
+def wordlist_lines(wordlist):
+    """
+    Get the number of words in a wordlist, from the wordlist index or
+    counted once per file modification and cached
+
+    Returns
+    -------
+    lines: int
+        line count, estimated from the file size for large or
+        compressed wordlists that haven't been indexed
+    exact: boolean
+        False if the count is an estimate
+    """
+    meta = wordindex.lookup(wordlist)
+    if meta:
+        return meta['Lines'], True
+    try:
+        stat = os.stat(wordlist)
+    except (OSError, TypeError) as err:
+        logger.debug('Wordlist not found: {}'.format(err))
+        return 0, False
+    key = (wordlist, stat.st_mtime)
+    if key in line_counts:
+        return line_counts[key], True
+    size = stat.st_size
+    if str(wordlist).endswith('.gz'):
+        return max(size * GZIP_RATIO // AVG_LINE, 1), False
+    if size > COUNT_LIMIT:
+        return max(size // AVG_LINE, 1), False
+    with open(wordlist, 'rb') as fh_wordlist:
+        line_counts[key] = sum(chunk.count(b'\n') for chunk
+                               in iter(lambda: fh_wordlist.read(1048576), b''))
+    return line_counts[key], True
+
+
+def job_keyspace(attack_mode=0, wordlist=None, wordlist2=None, rules=None,
+                 mask=None, mask_file=False, increment=False,
+                 increment_min=None, increment_max=None, **kwargs):
+    """
+    Calculate the total number of candidates for a job
+
+    Arguments
+    ---------
+    hc_worker keyword arguments
+
+    Returns
+    -------
+    keyspace: int | None
+        number of candidates or None if unknown
+    exact: boolean
+        False if the result is based on estimated wordlist sizes
+    """
+    attack_mode = int(attack_mode) if attack_mode is not None else 0
+    if isinstance(mask, list):
+        mask = mask[0] if mask else None
+    mask_count = None
+    if mask and mask_file:
+        mask_count = mask_file_keyspace(mask, increment, increment_min,
+                                        increment_max)
+    elif mask:
+        mask_count = mask_keyspace(mask, increment, increment_min,
+                                   increment_max)
+    if attack_mode == 3:
+        return mask_count, mask_count is not None
+    words, exact = wordlist_lines(wordlist)
+    if not words:
+        return None, False
+    if attack_mode == 0:
+        rule_count = speedcache.rule_lines(rules) if rules else 1
+        return words * max(rule_count, 1), exact
+    if attack_mode == 1:
+        words2, exact2 = wordlist_lines(wordlist2)
+        return words * words2, exact and exact2
+    if attack_mode in [6, 7] and mask_count:
+        return words * mask_count, exact
+    return None, False
@@ -0,0 +1,69 @@
+"""job_owner table
+
+Revision ID: 4b7e2f1a9c3d
+Revises: edc2261bfd64
+Create Date: 2026-10-18 10:12:31.208745
+
+"""
+import json
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+
+# revision identifiers, used by Alembic.
+revision = '4b7e2f1a9c3d'
+down_revision = 'edc2261bfd64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    if 'job_owner' not in sa.inspect(conn).get_table_names():
+        op.create_table('job_owner',
+        sa.Column('job_id', sa.String(length=32), nullable=False),
+        sa.Column('user_id', sqlalchemy_utils.types.uuid.UUIDType(binary=True), nullable=False),
+        sa.Column('task_id', sqlalchemy_utils.types.uuid.UUIDType(binary=True), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('job_id')
+        )
+        with op.batch_alter_table('job_owner', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_job_owner_user_id'), ['user_id'], unique=False)
+            batch_op.create_index(batch_op.f('ix_job_owner_task_id'), ['task_id'], unique=False)
+
+    # copy ownership from the legacy JSON columns
+    job_owner = sa.table('job_owner',
+                         sa.column('job_id', sa.String),
+                         sa.column('user_id', sqlalchemy_utils.types.uuid.UUIDType(binary=True)),
+                         sa.column('task_id', sqlalchemy_utils.types.uuid.UUIDType(binary=True)),
+                         sa.column('created_at', sa.DateTime))
+    existing = {row[0] for row in conn.execute(sa.text('SELECT job_id FROM job_owner'))}
+    task_map = {}
+    for task_id, job_ids in conn.execute(sa.text('SELECT id, job_ids FROM tasks')):
+        if job_ids:
+            for job_id in json.loads(job_ids):
+                task_map[job_id] = task_id
+    rows = []
+    now = datetime.utcnow()
+    for user_id, job_ids in conn.execute(sa.text('SELECT id, job_ids FROM "user"')):
+        if not job_ids:
+            continue
+        for job_id in set(json.loads(job_ids)):
+            if job_id in existing:
+                continue
+            existing.add(job_id)
+            rows.append({'job_id': job_id, 'user_id': user_id,
+                         'task_id': task_map.get(job_id), 'created_at': now})
+    if rows:
+        op.bulk_insert(job_owner, rows)
+
+
+def downgrade():
+    with op.batch_alter_table('job_owner', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_job_owner_task_id'))
+        batch_op.drop_index(batch_op.f('ix_job_owner_user_id'))
+
+    op.drop_table('job_owner')
@@ -3,7 +3,8 @@
 import json
 import uuid
 
-from sqlalchemy import Column
+from datetime import datetime
+from sqlalchemy import Column, ForeignKey
 from sqlalchemy.types import (
     Boolean,
     DateTime,
@@ -71,6 +72,18 @@ class User(db.Model):
         return json.dumps(ret)
 
 
+class JobOwner(db.Model):
+    """Job ownership, mapping RQ job IDs to users and tasks"""
+    __tablename__ = 'job_owner'
+    job_id = Column(String(32), primary_key=True)
+    __table_args__ = {'extend_existing': True}
+    user_id = Column(UUIDType(binary=True),
+                     ForeignKey('user.id', ondelete='CASCADE'),
+                     nullable=False, index=True)
+    task_id = Column(UUIDType(binary=True), index=True)
+    created_at = Column(DateTime(), default=datetime.utcnow)
+
+
 class Templates(db.Model):
     """Template job array list"""
     __tablename__ = 'templates'
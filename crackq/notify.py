@@ -0,0 +1,362 @@
+"""Asynchronous email notifications, sent by a dispatcher worker reusing
+pooled SMTP connections"""
+import email.utils
+import json
+import os
+import smtplib
+import ssl
+import time
+
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from datetime import timedelta
+from email.mime.text import MIMEText
+from redis import Redis
+from redis.exceptions import RedisError
+from rq import Queue, Retry
+from rq.serializers import JSONSerializer
+
+CRACK_CONF = hc_conf()
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+# idle seconds before a pooled connection is checked with NOOP
+IDLE_CHECK = 30
+SUBJECTS = {
+    'Cracked': 'CrackQ: Hash cracked notification',
+    'Complete': 'CrackQ: Job complete notification',
+    }
+
+
+def notify_conf():
+    """
+    Get the notification settings from the config file, using defaults
+    for the dispatcher settings if they're missing
+
+    Returns
+    -------
+    conf_dict: dict
+        mail server settings plus 'retries', 'backoff' seconds before
+        the first retry, doubling each time, and 'rate_limit' messages
+        per recipient every 'rate_window' seconds. With 'digest' set,
+        job events are batched per recipient over 'digest_window'
+        seconds
+    """
+    conf_dict = {
+        'mail_server': None,
+        'mail_port': 25,
+        'src': None,
+        'tls': False,
+        'retries': 3,
+        'backoff': 60,
+        'rate_limit': 10,
+        'rate_window': 3600,
+        'digest': False,
+        'digest_window': 900,
+        }
+    if CRACK_CONF.get('notify'):
+        not_conf = CRACK_CONF['notify']
+        conf_dict['mail_server'] = not_conf.get('mail_server')
+        conf_dict['src'] = not_conf.get('src')
+        conf_dict['tls'] = str(not_conf.get('tls', False)).lower() == 'true'
+        conf_dict['digest'] = str(not_conf.get('digest', False)).lower() == 'true'
+        for key in ['mail_port', 'retries', 'backoff', 'rate_limit', 'rate_window',
+                    'digest_window']:
+            if key in not_conf:
+                conf_dict[key] = int(not_conf[key])
+    return conf_dict
+
+
+class SMTPPool(object):
+    """
+    Reusable SMTP connection
+
+    The dispatcher runs as a SimpleWorker, so the module level pool
+    lives for the life of the worker and each message reuses the open,
+    authenticated connection rather than reconnecting and negotiating
+    STARTTLS again. Idle connections are checked before use and
+    reopened if the server has dropped them.
+    """
+    def __init__(self, conf=None, factory=smtplib.SMTP):
+        self.conf = conf
+        self.factory = factory
+        self.server = None
+        self.last_used = 0
+
+    def connect(self):
+        """Open and authenticate a new SMTP connection"""
+        conf = self.conf or notify_conf()
+        server = self.factory(conf['mail_server'], conf['mail_port'],
+                              timeout=30)
+        if conf['tls']:
+            server.starttls(context=ssl.create_default_context())
+            username = os.environ.get('MAIL_USERNAME')
+            password = os.environ.get('MAIL_PASSWORD')
+            if username and password:
+                server.login(username, password)
+        logger.debug('SMTP connection opened')
+        return server
+
+    def get(self):
+        """Get an open connection, reconnecting if needed"""
+        if self.server and time.time() - self.last_used > IDLE_CHECK:
+            try:
+                if self.server.noop()[0] != 250:
+                    self.close()
+            except smtplib.SMTPException:
+                self.close()
+        if not self.server:
+            self.server = self.connect()
+        return self.server
+
+    def send(self, src, dest, msg):
+        """
+        Send a message, retrying once on a fresh connection if the pooled
+        one was dropped
+        """
+        try:
+            self.get().sendmail(src, [dest], msg)
+        except smtplib.SMTPServerDisconnected:
+            logger.debug('SMTP connection dropped, reconnecting')
+            self.close()
+            self.get().sendmail(src, [dest], msg)
+        self.last_used = time.time()
+
+    def close(self):
+        """Close the pooled connection"""
+        if self.server:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+
+pool = SMTPPool()
+
+
+def rate_key(dest, window, now=None):
+    """Redis key counting messages to a recipient in the current window"""
+    if now is None:
+        now = time.time()
+    return 'crackq:notify:rate:{}:{}'.format(dest, int(now // window))
+
+
+def allow(dest, conf=None):
+    """
+    Check and count a message against the recipient's rate limit
+
+    Returns
+    -------
+    boolean
+        False if the recipient has reached the limit for this window
+    """
+    conf = conf or notify_conf()
+    key = rate_key(dest, conf['rate_window'])
+    with redis_con.pipeline() as pipe:
+        pipe.incr(key)
+        pipe.expire(key, conf['rate_window'])
+        count = pipe.execute()[0]
+    return count <= conf['rate_limit']
+
+
+def build(src, dest, sub, body=''):
+    """Build a notification email"""
+    msg = MIMEText(body)
+    msg['To'] = email.utils.formataddr(('CrackQ', dest))
+    msg['From'] = email.utils.formataddr(('CrackQ', src))
+    msg['Subject'] = sub
+    msg['Date'] = email.utils.formatdate(localtime=True)
+    return msg.as_string()
+
+
+def deliver(dest, sub, body=''):
+    """
+    Send a notification, run by the dispatcher worker
+
+    SMTP and connection errors are raised so RQ retries the job with
+    backoff. Messages over the recipient's rate limit are dropped.
+
+    Returns
+    -------
+    str
+        delivery result
+    """
+    conf = notify_conf()
+    if not allow(dest, conf):
+        logger.warning('Notification rate limit reached for {}'.format(dest))
+        return 'Rate limited'
+    pool.send(conf['src'], dest, build(conf['src'], dest, sub, body))
+    logger.info('Notification sent: {}'.format(sub))
+    return 'Sent'
+
+
+def enqueue(dest, sub, body=''):
+    """
+    Queue a notification for the dispatcher, called from the hashcat
+    callbacks so they never wait on the mail server
+
+    Returns
+    -------
+    boolean
+        True if the notification was queued
+    """
+    conf = notify_conf()
+    if not conf['mail_server']:
+        logger.debug('No mail server configured')
+        return False
+    try:
+        notify_q = Queue('notify', connection=redis_con,
+                         serializer=JSONSerializer)
+        notify_q.enqueue_call(func=deliver, args=[dest, sub, body],
+                              timeout=120, result_ttl=0,
+                              failure_ttl=86400, retry=retry_conf(conf))
+        return True
+    except RedisError as err:
+        logger.error('Failed to queue notification: {}'.format(err))
+        return False
+
+
+def retry_conf(conf):
+    """RQ retry policy, doubling the backoff after each attempt"""
+    return Retry(max=conf['retries'],
+                 interval=[conf['backoff'] * 2 ** i for i in range(conf['retries'])])
+
+
+def digest_key(dest):
+    """Redis list of job events waiting for a recipient's digest"""
+    return 'crackq:notify:digest:{}'.format(dest)
+
+
+def pending_key(dest):
+    """Redis key set while a recipient's digest is scheduled"""
+    return 'crackq:notify:digest:{}:pending'.format(dest)
+
+
+def job_event(dest, event, job_id, name=None, task_id=None):
+    """
+    Notify a recipient of a job event, sent straight away or added to
+    their digest if digest mode is enabled
+
+    Arguments
+    ---------
+    dest: str
+        recipient email address
+    event: str
+        'Cracked' or 'Complete'
+    job_id: str
+    name: str
+        job name
+    task_id: str
+        task the job belongs to, if any
+
+    Returns
+    -------
+    boolean
+        True if the notification was queued
+    """
+    conf = notify_conf()
+    if not conf['digest']:
+        return enqueue(dest, SUBJECTS[event])
+    if not conf['mail_server']:
+        logger.debug('No mail server configured')
+        return False
+    entry = {
+        'Event': event,
+        'Job ID': job_id,
+        'Name': name,
+        'Task ID': str(task_id) if task_id else None,
+        }
+    try:
+        with redis_con.pipeline() as pipe:
+            pipe.rpush(digest_key(dest), json.dumps(entry))
+            pipe.expire(digest_key(dest), conf['digest_window'] * 4)
+            pipe.execute()
+        schedule(dest, conf)
+        return True
+    except RedisError as err:
+        logger.error('Failed to queue notification: {}'.format(err))
+        return False
+
+
+def schedule(dest, conf):
+    """
+    Schedule a recipient's digest at the end of the digest window, unless
+    one is already scheduled
+    """
+    window = conf['digest_window']
+    if redis_con.set(pending_key(dest), 1, nx=True, ex=window * 2):
+        notify_q = Queue('notify', connection=redis_con,
+                         serializer=JSONSerializer)
+        notify_q.enqueue_in(timedelta(seconds=window), send_digest, dest,
+                            job_timeout=120, result_ttl=0, failure_ttl=86400,
+                            retry=retry_conf(conf))
+        logger.debug('Digest scheduled in {}s'.format(window))
+
+
+def summarize(events):
+    """
+    Build a digest email from a recipient's job events
+
+    Arguments
+    ---------
+    events: list
+        event dicts, as added by job_event()
+
+    Returns
+    -------
+    sub: str
+    body: str
+    """
+    jobs = {}
+    for event in events:
+        job_dict = jobs.setdefault(event['Job ID'], {
+            'Name': event.get('Name') or event['Job ID'],
+            'Task ID': event.get('Task ID'),
+            'Events': [],
+            })
+        if event['Event'] not in job_dict['Events']:
+            job_dict['Events'].append(event['Event'])
+    cracked = sum(1 for job_dict in jobs.values() if 'Cracked' in job_dict['Events'])
+    complete = sum(1 for job_dict in jobs.values() if 'Complete' in job_dict['Events'])
+    sub = 'CrackQ: {} job{} updated'.format(len(jobs), '' if len(jobs) == 1 else 's')
+    lines = [
+        'Jobs with cracked hashes: {}'.format(cracked),
+        'Jobs complete: {}'.format(complete),
+        '',
+        ]
+    tasks = {}
+    for job_dict in jobs.values():
+        tasks.setdefault(job_dict['Task ID'], []).append(job_dict)
+    for task_id in sorted(tasks, key=lambda task: task or ''):
+        if task_id:
+            lines.append('Task {}:'.format(task_id))
+        for job_dict in tasks[task_id]:
+            lines.append('  {}: {}'.format(job_dict['Name'],
+                                           ', '.join(job_dict['Events'])))
+    return sub, '\n'.join(lines)
+
+
+def send_digest(dest):
+    """
+    Send a recipient's digest, run by the dispatcher worker
+
+    Events are only removed once the digest is sent, so a failed send
+    is retried with the same events. Events added while sending are
+    left for the next digest.
+
+    Returns
+    -------
+    str
+        delivery result
+    """
+    key = digest_key(dest)
+    entries = redis_con.lrange(key, 0, -1)
+    result = 'Empty'
+    if entries:
+        sub, body = summarize([json.loads(entry) for entry in entries])
+        result = deliver(dest, sub, body)
+        redis_con.ltrim(key, len(entries), -1)
+    redis_con.delete(pending_key(dest))
+    if redis_con.llen(key):
+        schedule(dest, notify_conf())
+    return result
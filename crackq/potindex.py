@@ -0,0 +1,505 @@
+"""On-disk index of the CrackQ potfile for instant cracked hash lookups
+and the deduplicated potfile wordlist"""
+import hashlib
+import os
+import sqlite3
+import struct
+
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from crackq.validator import FileValidation as valid
+from redis import Redis
+from redis.exceptions import RedisError
+from rq import Queue
+from rq.serializers import JSONSerializer
+
+CRACK_CONF = hc_conf()
+log_dir = CRACK_CONF['files']['log_dir']
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+INDEX_JOB = 'potindex'
+# potfile bytes indexed per transaction
+READ_SIZE = 8388608
+# largest unindexed part of the potfile indexed while a job is submitted,
+# larger backlogs, i.e. the initial build, go to the background queue
+REQUEST_MAX = 16777216
+# limit the number of hash/plain split points indexed per potfile line
+MAX_SPLITS = 32
+# number of hashes per lookup query
+CHUNK = 500
+
+
+def enabled():
+    """Check if the potfile index is enabled in the config file"""
+    if 'potindex' in CRACK_CONF:
+        return str(CRACK_CONF['potindex'].get('enabled', 'True')).lower() == 'true'
+    return True
+
+
+def split_points(line):
+    """
+    Get every possible (hash, plain) pair for a potfile line
+
+    Hashes and plaintexts may both contain colons, so the line is
+    indexed at each colon. The potfile is shared by all hash modes, so
+    a submitted hash can match the wrong split of another mode's line,
+    i.e. a mode 0 hash against a mode 10 'hash:salt:plain' line.
+    Lookups confirm candidates against the submitted mode for this
+    reason, see confirmed().
+
+    Arguments
+    ---------
+    line: str
+        potfile line, without the trailing newline
+
+    Returns
+    -------
+    pairs: list
+        list of (hash, plain) tuples
+    """
+    pairs = []
+    pos = line.find(':')
+    while pos > 0 and len(pairs) < MAX_SPLITS:
+        pairs.append((line[:pos], line[pos+1:]))
+        pos = line.find(':', pos + 1)
+    return pairs
+
+
+def plaintext(line):
+    """Get the plaintext from a potfile line, after the last colon"""
+    if ':' in line:
+        return line.rsplit(':', 1)[1]
+    return line
+
+
+def md4(data):
+    """
+    MD4 digest, for NTLM verification where OpenSSL no longer provides
+    MD4 through hashlib
+    """
+    try:
+        return hashlib.new('md4', data).hexdigest()
+    except ValueError:
+        pass
+    mask = 0xffffffff
+
+    def rotl(val, bits):
+        return ((val << bits) | (val >> (32 - bits))) & mask
+    length = len(data) * 8
+    data += b'\x80' + b'\x00' * ((55 - len(data)) % 64) + struct.pack('<Q', length)
+    state = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476]
+    for pos in range(0, len(data), 64):
+        x = struct.unpack('<16I', data[pos:pos+64])
+        a, b, c, d = state
+        for i in range(16):
+            k, s = i, [3, 7, 11, 19][i % 4]
+            a, b, c, d = d, rotl((a + ((b & c) | (~b & d)) + x[k]) & mask, s), b, c
+        for i in range(16):
+            k, s = (i % 4) * 4 + i // 4, [3, 5, 9, 13][i % 4]
+            a, b, c, d = d, rotl((a + ((b & c) | (b & d) | (c & d)) + x[k]
+                                  + 0x5a827999) & mask, s), b, c
+        for i in range(16):
+            k = [0, 8, 4, 12, 2, 10, 6, 14, 1, 9, 5, 13, 3, 11, 7, 15][i]
+            s = [3, 9, 11, 15][i % 4]
+            a, b, c, d = d, rotl((a + (b ^ c ^ d) + x[k] + 0x6ed9eba1) & mask, s), b, c
+        state = [(val + new) & mask for val, new in zip(state, [a, b, c, d])]
+    return struct.pack('<4I', *state).hex()
+
+
+def ntlm(plain):
+    """NTLM digests of a plaintext, as UTF-16LE and byte expanded"""
+    digests = {md4(plain.decode('latin-1').encode('utf-16le'))}
+    try:
+        digests.add(md4(plain.decode('utf-8').encode('utf-16le')))
+    except UnicodeDecodeError:
+        pass
+    return digests
+
+
+# raw digest modes that can be checked directly against a plaintext
+HASHERS = {
+    '0': lambda plain: {hashlib.md5(plain).hexdigest()},
+    '100': lambda plain: {hashlib.sha1(plain).hexdigest()},
+    '900': lambda plain: {md4(plain)},
+    '1000': ntlm,
+    '1300': lambda plain: {hashlib.sha224(plain).hexdigest()},
+    '1400': lambda plain: {hashlib.sha256(plain).hexdigest()},
+    '1700': lambda plain: {hashlib.sha512(plain).hexdigest()},
+    '10800': lambda plain: {hashlib.sha384(plain).hexdigest()},
+    }
+
+
+def plain_bytes(plain):
+    """Decode a potfile plaintext, including hashcat's $HEX[] encoding"""
+    if plain.startswith('$HEX[') and plain.endswith(']'):
+        try:
+            return bytes.fromhex(plain[5:-1])
+        except ValueError:
+            pass
+    return plain.encode('utf-8', errors='surrogateescape')
+
+
+def confirmed(hash_v, plain, hash_mode):
+    """
+    Confirm a potfile match is valid for the submitted hash mode
+
+    Raw digest modes are verified by hashing the plaintext. Other modes
+    need the hash to match one of the mode's known formats, and modes
+    without a known format are never resolved from the index, leaving
+    hashcat to check its potfile itself.
+
+    Arguments
+    ---------
+    hash_v: str
+        hash without any username
+    plain: str
+        plaintext from the index
+    hash_mode: int
+
+    Returns
+    -------
+    boolean
+    """
+    hash_mode = str(hash_mode)
+    if hash_mode in HASHERS:
+        return hash_v.lower() in HASHERS[hash_mode](plain_bytes(plain))
+    from crackq import hashid
+    formats = [pattern for _, pattern, modes in hashid.PATTERNS
+               if hash_mode in modes]
+    return any(pattern.match(hash_v) for pattern in formats)
+
+
+class PotIndex(object):
+    """
+    SQLite index of a hashcat potfile, mapping hash to plaintext
+
+    The index tracks the potfile offset it has processed, so updates
+    only read lines appended since the last update. Updates are read
+    and committed in READ_SIZE chunks, so the lock is only held briefly
+    and a large potfile isn't loaded into memory. New plaintexts are
+    appended to the potfile wordlist, deduplicated using the plains
+    table.
+    """
+    def __init__(self, pot_path=None, db_path=None, wordlist_path=None):
+        if not pot_path:
+            pot_path = str(valid.val_filepath(path_string=log_dir,
+                                              file_string='crackq.pot'))
+        if not db_path:
+            db_path = str(valid.val_filepath(path_string=log_dir,
+                                             file_string='crackq_pot.db'))
+        if not wordlist_path:
+            wordlist_path = str(valid.val_filepath(path_string=log_dir,
+                                                   file_string='pot_wordlist.txt'))
+        self.pot_path = pot_path
+        self.db_path = db_path
+        self.wordlist_path = wordlist_path
+        self.conn = sqlite3.connect(db_path, timeout=30,
+                                    isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS pot '
+                          '(hash TEXT PRIMARY KEY, plain TEXT NOT NULL) '
+                          'WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS plains '
+                          '(plain TEXT PRIMARY KEY) WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS state '
+                          '(name TEXT PRIMARY KEY, value INTEGER)')
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
+
+    def get_state(self, name):
+        """Get an integer state value, i.e. the potfile offset"""
+        row = self.conn.execute('SELECT value FROM state WHERE name = ?',
+                                (name,)).fetchone()
+        return row[0] if row else 0
+
+    def set_state(self, name, value):
+        """Set an integer state value"""
+        self.conn.execute('INSERT OR REPLACE INTO state (name, value) '
+                          'VALUES (?, ?)', (name, value))
+
+    def reset_wordlist(self):
+        """Clear the potfile wordlist, before it's rebuilt"""
+        self.conn.execute('DELETE FROM plains')
+        with open(self.wordlist_path, 'w'):
+            logger.debug('Pot wordlist cleared')
+        self.set_state('wordlist', 1)
+
+    def process(self, lines):
+        """
+        Process new potfile lines within the update transaction
+
+        Arguments
+        ---------
+        lines: list
+            new potfile lines, without trailing newlines
+        """
+        self.conn.executemany('INSERT OR REPLACE INTO pot (hash, plain) '
+                              'VALUES (?, ?)',
+                              (pair for line in lines
+                               for pair in split_points(line)))
+        new_plains = []
+        for line in lines:
+            plain = plaintext(line)
+            cur = self.conn.execute('INSERT OR IGNORE INTO plains (plain) '
+                                    'VALUES (?)', (plain,))
+            if cur.rowcount:
+                new_plains.append(plain)
+        # written before commit, a failed commit leaves duplicates rather
+        # than missing entries
+        if new_plains:
+            with open(self.wordlist_path, 'a') as fh_wordlist:
+                for plain in new_plains:
+                    fh_wordlist.write(plain + '\n')
+
+    def pending(self):
+        """
+        Get the number of potfile bytes not yet indexed
+
+        Returns
+        -------
+        size: int
+        """
+        try:
+            pot_size = os.path.getsize(self.pot_path)
+        except OSError:
+            return 0
+        offset = self.get_state('offset')
+        if pot_size < offset or not self.get_state('wordlist'):
+            return pot_size
+        return pot_size - offset
+
+    def update_chunk(self):
+        """
+        Index up to READ_SIZE bytes of potfile lines in one transaction
+
+        Returns
+        -------
+        count: int | None
+            number of new potfile lines indexed, None once the index
+            is up to date
+        """
+        try:
+            pot_size = os.path.getsize(self.pot_path)
+        except OSError as err:
+            logger.debug('Potfile not found: {}'.format(err))
+            return None
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            offset = self.get_state('offset')
+            if pot_size < offset:
+                logger.info('Potfile truncated, rebuilding index')
+                offset = 0
+            if offset == 0 or not self.get_state('wordlist'):
+                logger.info('Building potfile wordlist')
+                offset = 0
+                self.reset_wordlist()
+            if pot_size == offset:
+                self.conn.execute('COMMIT')
+                return None
+            with open(self.pot_path, 'rb') as fh_pot:
+                fh_pot.seek(offset)
+                data = fh_pot.read(READ_SIZE)
+                if not data.endswith(b'\n'):
+                    # finish the line split by the chunk
+                    data += fh_pot.readline()
+            # leave any partially written line for the next update
+            end = data.rfind(b'\n') + 1
+            if not end:
+                self.conn.execute('COMMIT')
+                return None
+            lines = [line.decode('utf-8', errors='replace').rstrip('\r')
+                     for line in data[:end].split(b'\n')[:-1]]
+            self.process(lines)
+            self.set_state('offset', offset + end)
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return len(lines)
+
+    def update(self):
+        """
+        Index any lines appended to the potfile since the last update
+
+        Returns
+        -------
+        count: int
+            number of new potfile lines indexed
+        """
+        count = 0
+        while True:
+            lines = self.update_chunk()
+            if lines is None:
+                break
+            count += lines
+        if count:
+            logger.debug('Indexed {} potfile lines'.format(count))
+        return count
+
+    def lookup(self, hash_list, username=False, hash_mode=None):
+        """
+        Find already cracked hashes
+
+        Arguments
+        ---------
+        hash_list: list
+            hashes, as submitted
+        username: boolean
+            hashes are prefixed with a username
+        hash_mode: int
+            submitted hash mode, matches are only returned if
+            confirmed() for the mode. None returns all matches
+
+        Returns
+        -------
+        found: dict
+            plaintext keyed by submitted hash line, for cracked hashes
+        """
+        hash_map = {}
+        for hash_l in hash_list:
+            hash_l = hash_l.rstrip('\r\n')
+            if username:
+                if ':' not in hash_l:
+                    continue
+                hash_map.setdefault(hash_l.split(':', 1)[1], []).append(hash_l)
+            else:
+                hash_map.setdefault(hash_l, []).append(hash_l)
+        found = {}
+        keys = list(hash_map)
+        for pos in range(0, len(keys), CHUNK):
+            chunk = keys[pos:pos+CHUNK]
+            query = 'SELECT hash, plain FROM pot WHERE hash IN ({})'.format(
+                ','.join('?' * len(chunk)))
+            for hash_v, plain in self.conn.execute(query, chunk):
+                if hash_mode is not None and not confirmed(hash_v, plain, hash_mode):
+                    logger.debug('Potfile match not valid for mode {}'.format(hash_mode))
+                    continue
+                for hash_l in hash_map[hash_v]:
+                    found[hash_l] = plain
+        return found
+
+
+def update(pot_path=None, force=False):
+    """
+    Update the potfile index and wordlist, used from the cracked callback
+
+    Arguments
+    ---------
+    pot_path: str
+        potfile location
+    force: boolean
+        update even if the index is disabled in the config file, for the
+        potfile wordlist
+
+    Returns
+    -------
+    count: int
+        number of new potfile lines indexed
+    """
+    if not enabled() and not force:
+        return 0
+    try:
+        pot_index = PotIndex(pot_path=pot_path)
+        try:
+            return pot_index.update()
+        finally:
+            pot_index.close()
+    except sqlite3.Error as err:
+        logger.error('Potfile index update failed: {}'.format(err))
+        return 0
+
+
+def schedule(pot_path=None):
+    """
+    Queue an index update on the background queue, if one isn't
+    already queued or running
+
+    Returns
+    -------
+    boolean
+        True if the update was queued
+    """
+    try:
+        q = Queue('background', connection=redis_con,
+                  serializer=JSONSerializer)
+        job = q.fetch_job(INDEX_JOB)
+        if job and job.get_status() in ['queued', 'started']:
+            return False
+        q.enqueue_call(func=update, job_id=INDEX_JOB,
+                       kwargs={'pot_path': pot_path}, timeout=86400,
+                       result_ttl=0)
+        logger.debug('Potfile index update queued')
+        return True
+    except RedisError as err:
+        logger.error('Failed to queue potfile index update: {}'.format(err))
+        return False
+
+
+def open_index(pot_path=None):
+    """
+    Open and update the potfile index, for resolving a job's hashes
+
+    Called while a job is submitted, so if more than REQUEST_MAX of the
+    potfile needs indexing the update is queued in the background and
+    the index is used as it is, resolving fewer hashes
+
+    Returns
+    -------
+    pot_index: object | None
+        PotIndex, to be closed by the caller, None if the index is
+        disabled or unavailable
+    """
+    if not enabled():
+        return None
+    try:
+        pot_index = PotIndex(pot_path=pot_path)
+    except sqlite3.Error as err:
+        logger.error('Potfile index unavailable: {}'.format(err))
+        return None
+    try:
+        if pot_index.pending() > REQUEST_MAX:
+            logger.info('Potfile index behind, updating in the background')
+            schedule(pot_path=pot_path)
+        else:
+            pot_index.update()
+    except sqlite3.Error as err:
+        logger.error('Potfile index update failed: {}'.format(err))
+    return pot_index
+
+
+def resolve(hash_list, pot_index, hash_mode, username=False):
+    """
+    Split a list of hashes into those already in the potfile and the
+    remainder to be cracked
+
+    Arguments
+    ---------
+    hash_list: list
+        hashes, as submitted
+    pot_index: object
+        PotIndex, from open_index()
+    hash_mode: int
+        submitted hash mode
+    username: boolean
+        hashes are prefixed with a username
+
+    Returns
+    -------
+    found: dict
+        plaintext keyed by submitted hash line
+    remainder: list
+        hash lines not found in the potfile
+    """
+    hash_list = [hash_l.rstrip() for hash_l in hash_list]
+    if pot_index is None:
+        return {}, hash_list
+    try:
+        found = pot_index.lookup(hash_list, username=username,
+                                 hash_mode=hash_mode)
+    except sqlite3.Error as err:
+        logger.error('Potfile index lookup failed: {}'.format(err))
+        return {}, hash_list
+    remainder = [hash_l for hash_l in hash_list if hash_l not in found]
+    return found, remainder
@@ -1,19 +1,15 @@
 """This module handles the PyHashcat integration"""
 #!/usr/bin/env python
-import email.utils
 import json
 import os
 import time
 import rq
-import smtplib
-import ssl
 
-from crackq import crackqueue, hash_modes, cq_api
+from crackq import control, cracked, crackqueue, devices, distrib, events, hash_modes, jobspec, notify, potindex, cq_api, snapshot, speedcache, speedhistory, statuswriter, timeslice
 from crackq.conf import hc_conf
 from crackq.logger import logger
 from crackq.validator import FileValidation as valid
 from datetime import datetime, timedelta
-from email.mime.text import MIMEText
 from time import sleep
 from pyhashcat import Hashcat
 from redis import Redis
@@ -31,6 +27,7 @@ redis_con = Redis(rconf['host'], rconf['port'])
 redis_q = Queue('default', connection=redis_con, serializer=JSONSerializer)
 speed_q = Queue('speed_check', connection=redis_con,
                 serializer=JSONSerializer)
+status_writer = statuswriter.StatusWriter()
 
 
 def del_check(job):
@@ -47,57 +44,47 @@ def del_check(job):
     return False
 
 
-def send_email(mail_server, port, src, dest, sub, tls):
+def session_job_id(session):
     """
-    Simple email notification
+    Get the job ID for a hashcat session, stripping the '_speed' and
+    '_slice' suffixes of speed check and slice sessions
+    """
+    return str(session).split('_', 1)[0]
 
-    Arguments
-    --------
-    mail_server: str
-        email server hostname/ip
-    port: int
-        port to use
-    src: str
-        email from address
-    dest: str
-        email to address
-    tls: boolean
-        use encryption for SMTP
+
+def pause_running():
+    """
+    Pause all running jobs, so a speed check has the devices to itself
 
     Returns
     -------
+    paused: list
+        IDs of the jobs paused, to resume after the speed check
     """
-    if os.environ['MAIL_USERNAME']:
-        mail_username = os.environ['MAIL_USERNAME']
-    if os.environ['MAIL_PASSWORD']:
-        mail_password = os.environ['MAIL_PASSWORD']
-    msg = MIMEText('')
-    msg['To'] = email.utils.formataddr(('CrackQ', dest))
-    msg['From'] = email.utils.formataddr(('CrackQ', src))
-    msg['Subject'] = sub
-    try:
-        if tls:
-            server = smtplib.SMTP(mail_server, port)
-            server.starttls()
-            if mail_username and mail_password:
-                server.login(mail_username, mail_password)
-            #server.set_debuglevel(True)
-            server.sendmail(src, [dest],
-                            msg.as_string())
-            server.quit()
-        else:
-            server = smtplib.SMTP(mail_server, port)
-            #server.set_debuglevel(True)
-            server.sendmail(src, [dest],
-                            msg.as_string())
-            server.quit()
-    except TimeoutError:
-        logger.error('SMTP connection error - timeout')
-        server.quit()
-    except ssl.SSLError as err:
-        logger.debug(err)
-        logger.error('SMTP SSL/TLS error')
-        server.quit()
+    started = rq.registry.StartedJobRegistry(queue=redis_q)
+    paused = []
+    for job_id in started.get_job_ids():
+        cur_job = redis_q.fetch_job(job_id)
+        if not cur_job:
+            logger.debug('Failed to pause job: {}'.format(job_id))
+            continue
+        if del_check(cur_job):
+            logger.debug('Job stop already requested, not pausing')
+            continue
+        logger.debug('Pausing active job: {}'.format(job_id))
+        control.send(cur_job, 'Pause')
+        paused.append(job_id)
+    return paused
+
+
+def resume_paused(paused):
+    """Resume the jobs paused by pause_running()"""
+    for job_id in paused:
+        cur_job = redis_q.fetch_job(job_id)
+        if cur_job and not del_check(cur_job):
+            control.send(cur_job, 'Run/Restored')
+            logger.debug('Resuming active job: {}'.format(job_id))
+
 
 def status(sender):
     status_data = sender.hashcat_status_get_status()
@@ -112,7 +99,8 @@ def runner(hash_file=None, hash_mode=1000,
            pot_path=None, show=False, brain=True,
            increment=False, increment_min=None,
            increment_max=False, speed=False, benchmark=False,
-           benchmark_all=False, wordlist2=None):
+           benchmark_all=False, wordlist2=None, limit=None,
+           backend_devices=None):
     logger.info('Running hashcat')
     hc = Hashcat()
     logger.debug('Hashcat object ID: {}'.format(id(hc)))
@@ -131,7 +119,9 @@ def runner(hash_file=None, hash_mode=1000,
         hc.potfile_path = pot_path
     hc.quiet = False
     hc.optimized_kernel_enable = True
-    hc.workload_profile = 4
+    hc.workload_profile = devices.workload()
+    if backend_devices:
+        hc.backend_devices = backend_devices
     if username is True:
         hc.username = True
     if increment is True:
@@ -243,6 +233,8 @@ def runner(hash_file=None, hash_mode=1000,
     logger.debug('HC. Hashcat rp_files_cnt: {}'.format(hc.rp_files_cnt))
     if restore:
         hc.skip = int(restore)
+    if limit:
+        hc.limit = int(limit)
     hc.hashcat_session_execute()
     speed_started = rq.registry.StartedJobRegistry(queue=speed_q)
     cur_speed = speed_started.get_job_ids()
@@ -262,15 +254,21 @@ def cracked_callback(sender):
     Action is to write the latest cracked hashes
     """
     logger.debug('Callback Triggered: Cracked')
-    status_dict = status(sender)
-    logger.debug('Hashcat status: {}'.format(status_dict))
+    hcat_status = status(sender)
+    written = write_result(sender, hcat_status=hcat_status)
+    # this fires for every cracked hash, so the index updates and
+    # notification checks are throttled like the status writes, the
+    # first crack is always handled and finished_callback catches up
+    session = sender.session
+    if not status_writer.due('{}:cracked'.format(session), 'Cracked'):
+        if written:
+            snapshot.invalidate()
+        return
+    logger.debug('Hashcat status: {}'.format(hcat_status))
+    potindex.update(sender.potfile_path)
+    cracked.update(session)
     if CRACK_CONF['notify']:
-        mail_server = CRACK_CONF['notify']['mail_server']
-        mail_port = CRACK_CONF['notify']['mail_port']
-        email_src = CRACK_CONF['notify']['src']
         inactive_time = CRACK_CONF['notify']['inactive_time']
-        tls = CRACK_CONF['notify']['tls']
-    session = sender.session
     job = redis_q.fetch_job(session)
     if job:
         if 'notify' in job.meta.keys():
@@ -287,16 +285,13 @@ def cracked_callback(sender):
                         inactive_time = timedelta(minutes=int(inactive_time))
                         activity = now - last
                         if (activity > inactive_time and job.meta['email_count'] < 1):
-                            sub = 'CrackQ: Hash cracked notification'
-                            send_email(mail_server, mail_port,
-                                       email_src, user_email, sub, tls)
-                            job.meta['email_count'] += 1
-                            job.save()
-                    except ssl.SSLError as err:
-                        logger.error('Failed to connect to mail server')
-                        logger.error(err)
-                    except Exception as err:
-                        logger.error('Failed to connect to mail server')
+                            if notify.job_event(user_email, 'Cracked', job.id,
+                                                name=jobspec.details(job).get('name'),
+                                                task_id=job.meta.get('task_id')):
+                                job.meta['email_count'] += 1
+                                job.save()
+                    except (KeyError, ValueError) as err:
+                        logger.error('Failed to queue notification')
                         logger.error(err)
                 else:
                     job.meta['Warning'] = "No email address in profile"
@@ -306,7 +301,7 @@ def cracked_callback(sender):
             job.save()
     else:
         logger.debug('No job yet')
-    write_result(sender)
+    snapshot.invalidate()
 
 
 def bench_callback(sender):
@@ -343,15 +338,16 @@ def finished_callback(sender):
     #changed to just writing restul file for now
     """
     logger.debug('Callback Triggered: Cracking Finished')
+    potindex.update(sender.potfile_path)
+    cracked.update(sender.session)
+    status_writer.forget('{}:cracked'.format(sender.session))
     if CRACK_CONF['notify']:
-        mail_server = CRACK_CONF['notify']['mail_server']
-        mail_port = CRACK_CONF['notify']['mail_port']
-        email_src = CRACK_CONF['notify']['src']
         inactive_time = CRACK_CONF['notify']['inactive_time']
-        tls = CRACK_CONF['notify']['tls']
     session = sender.session
     job = redis_q.fetch_job(session)
-    if job:
+    if job and job.meta.get('CrackQ State') == 'Preempted':
+        logger.debug('Job preempted, skipping notification')
+    elif job:
         if 'notify' in job.meta.keys():
             logger.debug('Sending notification')
             if job.meta['notify']:
@@ -367,13 +363,13 @@ def finished_callback(sender):
                         activity = now - last
                         if (activity > inactive_time
                                 and job.meta['email_count'] < 2):
-                            sub = 'CrackQ: Job complete notification'
-                            send_email(mail_server, mail_port,
-                                            email_src, user_email, sub, tls)
-                            job.meta['email_count'] += 1
-                            job.save()
-                    except Exception as err:
-                        logger.error('Failed to connect to mail server')
+                            if notify.job_event(user_email, 'Complete', job.id,
+                                                name=jobspec.details(job).get('name'),
+                                                task_id=job.meta.get('task_id')):
+                                job.meta['email_count'] += 1
+                                job.save()
+                    except (KeyError, ValueError) as err:
+                        logger.error('Failed to queue notification')
                         logger.error(err)
                 else:
                     job.meta['Warning'] = "No email address in profile"
@@ -383,7 +379,9 @@ def finished_callback(sender):
             job.save()
     else:
         logger.debug('No job yet')
-    write_result(sender)
+    write_result(sender, force=True)
+    snapshot.invalidate()
+    events.forget(sender.session)
     if sender.benchmark:
         sender.status_reset()
 
@@ -396,7 +394,8 @@ def init_callback(sender):
     logger.debug('Callback Triggered: Init')
     status_dict = status(sender)
     logger.debug('Hashcat status: {}'.format(status_dict))
-    write_result(sender)
+    if write_result(sender):
+        snapshot.invalidate()
 
 
 def warning_callback(sender):
@@ -406,12 +405,10 @@ def warning_callback(sender):
     logger.warning('Callback Triggered: WARNING')
     msg_buf = sender.hashcat_status_get_log()
     logger.warning('{}'.format(msg_buf))
-    started = rq.registry.StartedJobRegistry(queue=redis_q)
-    logger.warning('{}'.format(msg_buf))
-    if len(started.get_job_ids()) > 0:
-        session = started.get_job_ids()[0]
-        logger.warning('{}: {}'.format(session, msg_buf))
-        job = redis_q.fetch_job(session)
+    session = session_job_id(sender.session)
+    logger.warning('{}: {}'.format(session, msg_buf))
+    job = redis_q.fetch_job(session)
+    if job:
         if sender.username and 'Separator unmatched' in msg_buf:
             job.meta['TIP'] = 'This algorithm probably doesn\'t' \
                               ' support the username flag'
@@ -427,14 +424,13 @@ def error_callback(sender):
     logger.debug('Callback Triggered: ERROR')
     msg_buf = sender.hashcat_status_get_log()
     logger.debug('{}'.format(msg_buf))
-    started = rq.registry.StartedJobRegistry(queue=redis_q)
-    logger.error('{}'.format(msg_buf))
-    if len(started.get_job_ids()) > 0:
-        session = started.get_job_ids()[0]
-        logger.error('{}: {}'.format(session, msg_buf))
-        job = redis_q.fetch_job(session)
+    session = session_job_id(sender.session)
+    logger.error('{}: {}'.format(session, msg_buf))
+    job = redis_q.fetch_job(session)
+    if job:
         job.meta['ERROR'] = msg_buf
         job.save_meta()
+        snapshot.invalidate()
 
 
 def abort_callback(sender):
@@ -459,159 +455,123 @@ def any_callback(sender):
     #    event_log = sender.hashcat_status_get_log()
     #    raise ValueError('Aborted: {}'.format(event_log))
 
-def circulator(circList, entry, limit):
-    """
-    This method will wrap a list overwriting at the
-    beginning when limit is reached.
-
-    Args
-    ----
-    circList: list
-        initial list
-    entry: any
-        item to add to list
-    limit: int
-        size limit for circular list
-
-    Returns
-    -------
-    circList: list
-        updated list
-    """
-    circList.append(entry)
-    if len(circList) > limit:
-        circList.pop(0)
-    return circList
-
-
-def write_result(sender):
+def write_result(sender, force=False, hcat_status=None):
     """
     Method to write cracking results to file in json format
 
-    When executed, this will open the corresponding session.crack file and
-    load the data into a results file with other meta data relating to the
-    job
+    Writes are coalesced by status_writer, so this is a no-op unless
+    the hashcat state changed or the write interval has passed. When
+    due, the job meta is updated in one transaction and the session's
+    json results file is replaced atomically.
 
     Arguments
     ---------
+    sender: object
+        Hashcat session object
+    force: boolean
+        write regardless of the interval and drop the cached session
+        state, used when the session ends
     hcat_status: dict
-        Hashcat status dict (from status()), containing hashcat data
-        form the cracking session
-    redis_con: object
-        redis connection object initiated
+        status already taken by the caller, from status()
+
     Returns
     -------
-
+    boolean
+        True if the status was written
     """
-    logger.debug('Updating status file')
-    hcat_status = status(sender)
+    if hcat_status is None:
+        hcat_status = status(sender)
     if '_speed' in sender.session:
         session = sender.session[:-6]
     else:
         session = sender.session
+    if sender.benchmark:
+        return False
+    state = hcat_status.get('Status') if isinstance(hcat_status, dict) else hcat_status
+    if not status_writer.due(session, state, force=force):
+        return False
+    logger.debug('Updating status file')
     result_file = valid.val_filepath(path_string=log_dir,
                                      file_string='{}.json'.format(session))
     if 'Progress' in hcat_status:
         hcat_status['Progress'] = int(hcat_status['Progress'])
     logger.debug('Updating job metadata')
-    if not sender.benchmark:
-        try:
-            with open(result_file, 'r+') as result_fh:
-                job = redis_q.fetch_job(session)
-                if job and isinstance(hcat_status, dict):
-                    job.meta['HC State'] = hcat_status
-                    job.meta['Speed Array'] = circulator(job.meta['Speed Array'],
-                                                         int(hcat_status['Speed Raw']), 180)
-                    job.save_meta()
-                    job_details = cq_api.get_jobdetails(job.description)
-                    job_details['restore'] = hcat_status['Restore Point']
-                    if 'brain_check' in job.meta:
-                        job_details['brain_check'] = job.meta['brain_check']
-                else:
-                    result = result_fh.read()
-                    job_details = json.loads(result.strip())
-                job_details['Cracked Hashes'] = sender.status_get_digests_done()
-                job_details['Total Hashes'] = sender.status_get_digests_cnt()
-                job_details['timeout'] = job.timeout
-                result_fh.seek(0)
-                result_fh.write(json.dumps(job_details))
-                result_fh.truncate()
-        except AttributeError as err:
-            logger.debug('Status update failure: {}'.format(err))
-        except KeyError as err:
-            logger.debug('Status update failure: {}'.format(err))
-        except UnboundLocalError as err:
-            logger.debug('Status update failure: {}'.format(err))
-
 
-def pot_check(outfile):
-    """
-    Simple check if crackq potfile wordlist has been updated today
-
-    Arguments
-    ---------
-    outfile: string
-        location of wordlist file
-
-    Returns
-    -------
-    ret: boolean
-        If file has been updated in the past 24 hours return true else false
-    """
-    logger.debug('Checking pot wordlist is up-to-date')
+    def apply(meta):
+        meta['HC State'] = hcat_status
+        # speed history is kept by speedhistory, not in the job meta
+        meta.pop('Speed Array', None)
     try:
-        file_stat = int(outfile.stat().st_mtime)
-        edit_time = int(time.time()) - file_stat
-        ret = True if edit_time < 86400 else False
-    except (IOError, FileNotFoundError) as err:
-        logger.debug('Pot wordlist files not found, creating new file: {}'.format(err))
-        with outfile.open('w+'):
-            logger.debug('Do nothing')
-        ret = False
-    except Exception as err:
-        logger.debug('Pot wordlist file update error: {}'.format(err))
-        ret = False
-    return ret
+        meta = None
+        if isinstance(hcat_status, dict):
+            meta = statuswriter.update_meta(redis_con, session, apply)
+            if meta is not None:
+                speedhistory.record(session, hcat_status['Speed Raw'])
+        if meta is not None:
+            if session not in status_writer.details:
+                job = redis_q.fetch_job(session)
+                status_writer.details[session] = (jobspec.details(job), job.timeout)
+            job_details, timeout = status_writer.details[session]
+            job_details = dict(job_details)
+            job_details['restore'] = hcat_status['Restore Point']
+            job_details['timeout'] = timeout
+            if 'brain_check' in meta:
+                job_details['brain_check'] = meta['brain_check']
+        else:
+            with open(result_file, 'r') as result_fh:
+                job_details = json.loads(result_fh.read().strip())
+            meta = {}
+        # hashes resolved from the potfile index at submit time
+        pot_cracked = meta.get('Pot Cracked', 0)
+        job_details['Cracked Hashes'] = sender.status_get_digests_done() + pot_cracked
+        job_details['Total Hashes'] = sender.status_get_digests_cnt() + pot_cracked
+        statuswriter.write_json(result_file, job_details)
+        event_dict = dict(hcat_status) if isinstance(hcat_status, dict) else {}
+        event_dict['Cracked Hashes'] = job_details['Cracked Hashes']
+        event_dict['Total Hashes'] = job_details['Total Hashes']
+        events.publish(session, event_dict)
+    except (AttributeError, KeyError, IOError, ValueError) as err:
+        logger.debug('Status update failure: {}'.format(err))
+    if force:
+        status_writer.forget(session)
+    return True
 
 
-def potter(potfile, outfile):
+def pot_complete(job):
     """
-    Extract cracked passwords from potfile to generate wordlist
+    Complete a job whose hashes were all resolved from the potfile index
+    at submit time, without running hashcat
 
     Arguments
     ---------
-    potfile: string
-        location of potfile
-    outfile: string
-        location of wordlist file
-
-    Returns
-    -------
-    ret: boolean
-        True if successfully updated
-
+    job: object
+        RQ job object
     """
-    logger.debug('Updating pot wordlist')
+    logger.info('All hashes found in potfile index: {}'.format(job.id))
+    pot_cracked = job.meta.get('Pot Cracked', 0)
+    hc_state = {
+        'Status': 'Cracked',
+        'Progress': 100,
+        'Cracked Hashes': pot_cracked,
+        'Total Hashes': pot_cracked,
+        }
+
+    def apply(meta):
+        meta['HC State'] = hc_state
+    statuswriter.update_meta(redis_con, job.id, apply)
+    result_file = valid.val_filepath(path_string=log_dir,
+                                     file_string='{}.json'.format(job.id))
     try:
-        with open(potfile, 'r') as fh_pot:
-            with open(outfile, 'w+') as fh_out:
-                for cracked in fh_pot:
-                    if ':' in cracked:
-                        split_list = cracked.split(':')
-                        if len(split_list[0]) > 1:
-                            passwd = split_list[-1]
-                        else:
-                            passwd = cracked
-                    else:
-                        passwd = cracked
-                    fh_out.write(passwd)
-    except (IOError, FileNotFoundError) as err:
-        logger.debug('Pot wordlist files not found: {}'.format(err))
-        return False
-    except Exception as err:
-        logger.debug('Pot wordlist update error: {}'.format(err))
-        return False
-    return True
+        with open(result_file, 'r') as result_fh:
+            job_details = json.loads(result_fh.read().strip())
+        job_details['Cracked Hashes'] = pot_cracked
+        job_details['Total Hashes'] = pot_cracked
+        statuswriter.write_json(result_file, job_details)
+    except (IOError, ValueError) as err:
+        logger.debug('Status update failure: {}'.format(err))
+    cracked.update(job.id)
+    events.publish(job.id, hc_state)
+    snapshot.invalidate()
 
 
 def brain_check(speed, salts):
@@ -656,7 +616,7 @@ def hc_worker(crack=None, hash_file=None, session=None,
               brain=True, mask_file=False, increment=False,
               increment_min=None, increment_max=None, speed=True,
               benchmark=False, benchmark_all=False, wordlist2=None,
-              potcheck=None):
+              potcheck=None, slices=None):
     """
     Method to load a rq worker to take jobs from redis queue for execution
 
@@ -669,6 +629,9 @@ def hc_worker(crack=None, hash_file=None, session=None,
         File containing hashes to feed to hashcat
     session: Hashcat session
     wordlist: Wordlist to feed Hashcat
+    slices: int
+        split the job into this many keyspace slices, run by the
+        workers on the 'slices' queue
     Returns
     -------
     """
@@ -676,6 +639,11 @@ def hc_worker(crack=None, hash_file=None, session=None,
     if attack_mode:
         if not isinstance(attack_mode, int):
             attack_mode = None
+    if not benchmark and not restore:
+        job = redis_q.fetch_job(session)
+        if job and job.meta.get('Pot Complete'):
+            pot_complete(job)
+            return 'Cracked'
     # first run with potfile wordlist if option is enabled
     if potcheck:
         try:
@@ -684,14 +652,40 @@ def hc_worker(crack=None, hash_file=None, session=None,
                     pot_path=pot_path, username=username)
         except Exception as err:
             logger.error('Error running potcheck: {}'.format(err))
+    if slices and int(slices) > 1 and not benchmark and not mask_file:
+        job = redis_q.fetch_job(session)
+        hc_args = {
+            'hash_file': hash_file,
+            'session': session,
+            'wordlist': wordlist,
+            'wordlist2': wordlist2,
+            'outfile': outfile,
+            'hash_mode': hash_mode,
+            'attack_mode': attack_mode,
+            'mask': mask,
+            'rules': rules,
+            'username': username,
+            'pot_path': pot_path,
+            }
+        result = distrib.run_sliced(job, int(slices), hc_args)
+        if result is not False:
+            return result
+        logger.debug('Running job without slicing: {}'.format(session))
     #job = redis_q.fetch_job(session)
-    hcat = runner(hash_file=hash_file, mask=mask,
-                  session=session, wordlist=wordlist,
-                  outfile=outfile, attack_mode=attack_mode,
-                  hash_mode=hash_mode, rules=rules,
-                  username=username, pot_path=pot_path,
-                  restore=restore, brain=brain, wordlist2=wordlist2,
-                  benchmark=benchmark, benchmark_all=benchmark_all)
+    slot = devices.DeviceSlot(session)
+    backend_devices = slot.claim() if not benchmark else None
+    try:
+        hcat = runner(hash_file=hash_file, mask=mask,
+                      session=session, wordlist=wordlist,
+                      outfile=outfile, attack_mode=attack_mode,
+                      hash_mode=hash_mode, rules=rules,
+                      username=username, pot_path=pot_path,
+                      restore=restore, brain=brain, wordlist2=wordlist2,
+                      benchmark=benchmark, benchmark_all=benchmark_all,
+                      backend_devices=backend_devices)
+    except Exception:
+        slot.release()
+        raise
     hcat.event_connect(callback=error_callback,
                        signal="EVENT_LOG_ERROR")
     hcat.event_connect(callback=warning_callback,
@@ -708,8 +702,13 @@ def hc_worker(crack=None, hash_file=None, session=None,
                            signal="EVENT_CRACKER_FINISHED")
         hcat.event_connect(callback=cracked_callback,
                            signal="EVENT_CRACKER_HASH_CRACKED")
+    listener = control.Listener(session)
+    can_slice = timeslice.preemptable(mask_file=mask_file, increment=increment,
+                                      benchmark=benchmark)
+    slice_start = time.time()
     try:
         main_counter = 0
+        ctl_state = None
         while True:
             hc_state = hcat.status_get_status_string()
             logger.debug('MAIN loop')
@@ -740,77 +739,95 @@ def hc_worker(crack=None, hash_file=None, session=None,
                 if 'Initializing' not in hc_state:
                     init_callback(hcat)
                     logger.debug('Hashcat initialized')
-                job = redis_q.fetch_job(str(hcat.session))
-                speed_started = rq.registry.StartedJobRegistry(queue=speed_q)
-                cur_speed = speed_started.get_job_ids()
-                if job:
-                    if job.meta['CrackQ State'] == 'Stop':
-                        logger.info('Stopping Job: {}'.format(hcat.session))
-                        hcat.hashcat_session_quit()
-                        return
-                    elif job.meta['CrackQ State'] == 'Delete':
-                        logger.info('Deleting Job: {}'.format(hcat.session))
-                        speed_session = '{}_speed'.format(hcat.session)
-                        speed_job = speed_q.fetch_job(speed_session)
-                        if speed_job:
-                            logger.debug('Deleting speed job')
-                            speed_status = speed_job.get_status()
-                            finished_states = ['finished',
-                                               'failed']
-                            del_count = 0
-                            while (speed_status not in finished_states
-                                   and del_count < 100):
-                                logger.debug('DELETE wait loop')
+                # full state poll is a fallback for missed control messages
+                if ctl_state or main_counter % 60 == 0:
+                    job = redis_q.fetch_job(str(hcat.session))
+                    speed_started = rq.registry.StartedJobRegistry(queue=speed_q)
+                    cur_speed = speed_started.get_job_ids()
+                    if job:
+                        if (can_slice and hc_state == 'Running'
+                                and job.meta['CrackQ State'] == 'Run/Restored'
+                                and timeslice.due(slice_start, redis_q)):
+                            hcat_status = status(hcat)
+                            if isinstance(hcat_status, dict):
+                                write_result(hcat, force=True)
+                                timeslice.preempt(job, hcat_status['Restore Point'])
+                                hcat.hashcat_session_quit()
+                                snapshot.invalidate()
+                                return 'Preempted'
+                        if job.meta['CrackQ State'] == 'Stop':
+                            logger.info('Stopping Job: {}'.format(hcat.session))
+                            hcat.hashcat_session_quit()
+                            control.ack(hcat.session)
+                            return
+                        elif job.meta['CrackQ State'] == 'Delete':
+                            logger.info('Deleting Job: {}'.format(hcat.session))
+                            speed_session = '{}_speed'.format(hcat.session)
+                            speed_job = speed_q.fetch_job(speed_session)
+                            if speed_job:
+                                logger.debug('Deleting speed job')
                                 speed_status = speed_job.get_status()
-                                del_count += 1
-                            logger.debug('Breaking runner loop speed check job has finished')
-                            speed_job.delete()
-                        cq_api.del_jobid(hcat.session)
-                        hcat.hashcat_session_quit()
-                        hcat.reset()
-                        return
-                    elif job.meta['CrackQ State'] == 'Pause':
-                        hcat.hashcat_session_pause()
-                        pause_counter = 0
-                        logger.debug('Pausing job: {}'.format(hcat.session))
-                        logger.debug('PAUSE loop begin')
-                        while pause_counter < 600:
-                            if hcat.status_get_status_string() == 'Paused':
-                                logger.debug('Job Paused: {}'.format(hcat.session))
-                                break
-                            elif del_check(job):
-                                break
-                            pause_counter += 1
-                        logger.debug('PAUSE loop finished')
-                        if hcat.status_get_status_string() != 'Paused':
-                            logger.debug('Pause failed: {}'.format(hc_state))
-                        ###***below not needed?
-                        if len(cur_speed) < 1:
-                            if not del_check(job):
-                                logger.debug('Stale paused job caught, resuming')
-                                job.meta['CrackQ State'] == 'Run/Restored'
-                                job.save_meta()
-                                hcat.hashcat_session_resume()
-                    elif hc_state == 'Bypass':
-                        logger.debug('Error: Bypass not cleared')
-                    else:
-                        logger.debug('Haschat state: {}'.format(hc_state))
-                        if len(cur_speed) < 1:
-                            if not del_check(job):
+                                finished_states = ['finished',
+                                                   'failed']
+                                del_count = 0
+                                while (speed_status not in finished_states
+                                       and del_count < 100):
+                                    logger.debug('DELETE wait loop')
+                                    speed_status = speed_job.get_status()
+                                    del_count += 1
+                                logger.debug('Breaking runner loop speed check job has finished')
+                                speed_job.delete()
+                            cq_api.del_jobid(hcat.session)
+                            hcat.hashcat_session_quit()
+                            hcat.reset()
+                            control.ack(hcat.session)
+                            return
+                        elif job.meta['CrackQ State'] == 'Pause':
+                            hcat.hashcat_session_pause()
+                            pause_counter = 0
+                            logger.debug('Pausing job: {}'.format(hcat.session))
+                            logger.debug('PAUSE loop begin')
+                            while pause_counter < 600:
                                 if hcat.status_get_status_string() == 'Paused':
+                                    logger.debug('Job Paused: {}'.format(hcat.session))
+                                    break
+                                elif del_check(job):
+                                    break
+                                pause_counter += 1
+                            logger.debug('PAUSE loop finished')
+                            if hcat.status_get_status_string() != 'Paused':
+                                logger.debug('Pause failed: {}'.format(hc_state))
+                            ###***below not needed?
+                            if len(cur_speed) < 1:
+                                if not del_check(job):
                                     logger.debug('Stale paused job caught, resuming')
                                     job.meta['CrackQ State'] == 'Run/Restored'
                                     job.save_meta()
                                     hcat.hashcat_session_resume()
-                else:
-                    logger.error('Error finding redis job')
-            sleep(10)
+                        elif hc_state == 'Bypass':
+                            logger.debug('Error: Bypass not cleared')
+                        else:
+                            logger.debug('Haschat state: {}'.format(hc_state))
+                            if len(cur_speed) < 1:
+                                if not del_check(job):
+                                    if hcat.status_get_status_string() == 'Paused':
+                                        logger.debug('Stale paused job caught, resuming')
+                                        job.meta['CrackQ State'] == 'Run/Restored'
+                                        job.save_meta()
+                                        hcat.hashcat_session_resume()
+                    else:
+                        logger.error('Error finding redis job')
+            ctl_state = listener.wait(timeout=10)
+            slot.refresh()
             main_counter += 10
     except KeyboardInterrupt:
         hcat.hashcat_session_quit()
         exit(0)
     except Exception as err:
         logger.error('MAIN loop closed: {}'.format(err))
+    finally:
+        listener.close()
+        slot.release()
 
 
 def pot_job(hash_file=None, session=None, hash_mode=None,
@@ -832,11 +849,11 @@ def pot_job(hash_file=None, session=None, hash_mode=None,
     Returns
     -------
     """
-    # check potfile wordlist is up-to-date
+    # catch up the potfile wordlist with any recent cracks
     pot_wordlist = valid.val_filepath(path_string=log_dir,
                                       file_string='pot_wordlist.txt')
-    if not pot_check(pot_wordlist):
-        potter(pot_path, pot_wordlist)
+    potindex.update(pot_path, force=True)
+    pot_wordlist.touch(exist_ok=True)
     outfile = valid.val_filepath(path_string=log_dir,
                                  file_string='{}.cracked'.format(session))
     # run hashcat with potfile wordlist
@@ -870,49 +887,22 @@ def pot_job(hash_file=None, session=None, hash_mode=None,
     hcat.reset()
     return True
 
-def show_speed(hash_file=None, session=None,
-               wordlist=None, hash_mode=1000, speed_session=None,
-               attack_mode=None, mask=None, rules=None,
-               pot_path=None, brain=False, username=False,
-               name=None, wordlist2=None):
+def init_status(session, hash_mode=1000, attack_mode=None, mask=None,
+                wordlist=None, wordlist2=None, rules=None, brain=True,
+                name=None):
     """
-    Method to run hashcat with 'show' and 'speed_only' options to
-    gather information relevant to brain use, and also for quick wins
-    to skip the queue. It will pause the current job then run in the
-    above modes to get passwords from the potfile and an estimated speed.
+    Create the initial CrackQ json state file for a new job
 
     Arguments
     ---------
-    crack: object
-        Hashcat execution python object for rq to execute
-    hash_file: string
-        File containing hashes to feed to hashcat
-    session: Hashcat session
-    wordlist: Wordlist to feed Hashcat
+    session: str
+        job ID
+    brain: boolean
+        if False the brain check is marked as complete
 
     Returns
     -------
     """
-    started = rq.registry.StartedJobRegistry(queue=redis_q)
-    cur_list = started.get_job_ids()
-    speed_job = speed_q.fetch_job(speed_session)
-    if len(cur_list) > 0:
-        cur_job = redis_q.fetch_job(cur_list[0])
-        if cur_job:
-            if del_check(cur_job):
-                logger.debug('Job stop already requested, not pausing')
-                time.sleep(10)
-            else:
-                cur_job.meta['CrackQ State'] = 'Pause'
-                logger.debug('Pausing active job')
-                cur_job.save_meta()
-        else:
-            logger.debug('Failed to pause current job')
-            raise ValueError('Speed check error')
-    if attack_mode:
-        if not isinstance(attack_mode, int):
-            attack_mode = None
-    # create initial json state, run show check and create file
     job_dict = {}
     job_dict['hash_mode'] = hash_mode
     job_dict['attack_mode'] = attack_mode
@@ -922,8 +912,9 @@ def show_speed(hash_file=None, session=None,
     if wordlist2:
         job_dict['wordlist2'] = [wl for wl, path in CRACK_CONF['wordlists'].items() if path == wordlist2][0]
     if rules:
-        job_dict['rules'] = [rl for rl, path in CRACK_CONF['rules'].items() if path == rules]
-    job = redis_q.fetch_job(speed_session[:-6])
+        rules = [rules] if isinstance(rules, str) else rules
+        job_dict['rules'] = [rl for rl, path in CRACK_CONF['rules'].items() if path in rules]
+    job = redis_q.fetch_job(session)
     if brain:
         job_dict['brain_check'] = None
     else:
@@ -931,7 +922,7 @@ def show_speed(hash_file=None, session=None,
         job_dict['brain_check'] = False
         if job:
             job.meta['brain_check'] = False
-            speed_job.save_meta()
+            job.save_meta()
     if job:
         job_dict['timeout'] = job.timeout
     job_dict['name'] = name
@@ -939,8 +930,24 @@ def show_speed(hash_file=None, session=None,
     job_dict['Cracked Hashes'] = 0
     job_dict['Total Hashes'] = 0
     status_file = valid.val_filepath(path_string=log_dir,
-                                     file_string='{}.json'.format(speed_session[:-6]))
+                                     file_string='{}.json'.format(session))
     cq_api.write_template(job_dict, status_file)
+
+
+def show_check(hash_file=None, mask=None, speed_session=None,
+               wordlist=None, attack_mode=None, hash_mode=1000,
+               wordlist2=None, username=False, pot_path=None,
+               speed_job=None):
+    """
+    Run hashcat with the 'show' option to write any hashes already in
+    the potfile to the job's cracked file
+
+    Returns
+    -------
+    hcat: None | str
+        None on success, or the runner return value if hashcat
+        didn't start
+    """
     outfile = valid.val_filepath(path_string=log_dir,
                                  file_string='{}.cracked'.format(speed_session[:-6]))
     # clear contents of previous cracked passwords file before running show
@@ -983,6 +990,73 @@ def show_speed(hash_file=None, session=None,
     logger.debug('SHOW loop complete, quitting hashcat')
     hcat.hashcat_session_quit()
     hcat.reset()
+    return None
+
+
+def show_speed(hash_file=None, session=None,
+               wordlist=None, hash_mode=1000, speed_session=None,
+               attack_mode=None, mask=None, rules=None,
+               pot_path=None, brain=False, username=False,
+               name=None, wordlist2=None):
+    """
+    Method to run hashcat with 'show' and 'speed_only' options to
+    gather information relevant to brain use, and also for quick wins
+    to skip the queue. It will pause the running jobs then run in the
+    above modes to get passwords from the potfile and an estimated
+    speed, resuming the paused jobs however the check ends.
+    """
+    paused = pause_running()
+    try:
+        return run_speed_check(hash_file=hash_file, session=session,
+                               wordlist=wordlist, hash_mode=hash_mode,
+                               speed_session=speed_session,
+                               attack_mode=attack_mode, mask=mask, rules=rules,
+                               pot_path=pot_path, brain=brain, username=username,
+                               name=name, wordlist2=wordlist2)
+    finally:
+        resume_paused(paused)
+
+
+def run_speed_check(hash_file=None, session=None,
+                    wordlist=None, hash_mode=1000, speed_session=None,
+                    attack_mode=None, mask=None, rules=None,
+                    pot_path=None, brain=False, username=False,
+                    name=None, wordlist2=None):
+    """
+    Run the show and speed checks for show_speed(), with running jobs
+    already paused
+
+    Arguments
+    ---------
+    crack: object
+        Hashcat execution python object for rq to execute
+    hash_file: string
+        File containing hashes to feed to hashcat
+    session: Hashcat session
+    wordlist: Wordlist to feed Hashcat
+
+    Returns
+    -------
+    """
+    speed_job = speed_q.fetch_job(speed_session)
+    if attack_mode:
+        if not isinstance(attack_mode, int):
+            attack_mode = None
+    init_status(speed_session[:-6], hash_mode=hash_mode,
+                attack_mode=attack_mode, mask=mask, wordlist=wordlist,
+                wordlist2=wordlist2, rules=rules, brain=brain, name=name)
+    if potindex.enabled():
+        logger.debug('Potfile index enabled, quick wins resolved at submit')
+    else:
+        hcat = show_check(hash_file=hash_file, mask=mask,
+                          speed_session=speed_session, wordlist=wordlist,
+                          attack_mode=attack_mode, hash_mode=hash_mode,
+                          wordlist2=wordlist2, username=username,
+                          pot_path=pot_path, speed_job=speed_job)
+        if hcat is not None:
+            return hcat
+    counter = 0
+    hc_state = None
     if brain:
         logger.debug('Brain not disabled by user')
         hcat = runner(hash_file=hash_file, mask=mask,
@@ -998,6 +1072,8 @@ def show_speed(hash_file=None, session=None,
         logger.debug('Mode info: {}'.format(mode_info))
         salts = hcat.status_get_salts_cnt()
         logger.debug('Salts Count: {}'.format(salts))
+        with open(hash_file, 'rb') as hash_fh:
+            hash_count = sum(1 for line in hash_fh)
         speed_counter = 0
         logger.debug('SPEED loop')
         while counter < 180:
@@ -1019,16 +1095,9 @@ def show_speed(hash_file=None, session=None,
                         mode_info.append(salts)
                         speed_job.meta['Mode Info'] = mode_info
                         speed_job.save_meta()
+                        speedcache.store(hash_mode, attack_mode, rules,
+                                         hash_count, speed_info, salts)
                         hc_state = hcat.status_get_status_string()
-                    cur_list = started.get_job_ids()
-                    cur_job = redis_q.fetch_job(cur_list[0])
-                    if cur_job:
-                        if not del_check(cur_job):
-                            cur_job.meta['CrackQ State'] = 'Run/Restored'
-                            cur_job.save_meta()
-                            logger.debug('Resuming active job: {}'.format(cur_job.id))
-                    else:
-                        logger.debug('No job to resume')
                     hcat.status_reset()
                     hcat.hashcat_session_quit()
                     hcat.reset()
@@ -1051,27 +1120,10 @@ def show_speed(hash_file=None, session=None,
         hcat.status_reset()
         hcat.hashcat_session_quit()
         hcat.reset()
-        if len(cur_list) > 0:
-            cur_job = redis_q.fetch_job(cur_list[0])
-        else:
-            cur_job = None
-        if cur_job:
-            if cur_job.meta['CrackQ State'] == 'Pause':
-                cur_job.meta['CrackQ State'] = 'Run/Restored'
-                cur_job.save_meta()
-                logger.debug('Resuming active job')
         raise ValueError('Speed check error: {}'.format(event_log))
     else:
         logger.debug('Brain user-disabled')
         job = redis_q.fetch_job(session)
         if job:
             job.meta['brain_check'] = False
-        if len(cur_list) > 0:
-            cur_job = redis_q.fetch_job(cur_list[0])
-        else:
-            cur_job = None
-        if cur_job:
-            cur_job.meta['CrackQ State'] = 'Run/Restored'
-            cur_job.save_meta()
-            logger.debug('Resuming active job')
     return hc_state
@@ -0,0 +1,268 @@
+"""Priority and fair share job selection for the cracking queue"""
+import json
+import time
+
+from datetime import timezone
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from rq.serializers import resolve_serializer
+from rq.utils import as_text, utcparse
+
+CRACK_CONF = hc_conf()
+USAGE_KEY = 'crackq:scheduler:usage'
+DEFAULT_PRIORITY = 5
+
+
+def sched_conf():
+    """
+    Get the scheduler settings from the config file, using defaults
+    if the section is missing
+
+    Returns
+    -------
+    conf_dict: dict
+        'aging' score per hour queued, 'share' score penalty per job
+        recently run by the same owner, usage 'half_life' in hours and
+        'enabled'
+    """
+    conf_dict = {
+        'aging': 1.0,
+        'share': 2.0,
+        'half_life': 24.0,
+        'enabled': False,
+        }
+    if 'scheduler' in CRACK_CONF:
+        for key in ['aging', 'share', 'half_life']:
+            if key in CRACK_CONF['scheduler']:
+                conf_dict[key] = float(CRACK_CONF['scheduler'][key])
+        if 'enabled' in CRACK_CONF['scheduler']:
+            conf_dict['enabled'] = str(CRACK_CONF['scheduler']['enabled']).lower() == 'true'
+    return conf_dict
+
+
+def decayed(entry, now, half_life):
+    """
+    Get an owner's usage decayed to the current time
+
+    Arguments
+    ---------
+    entry: dict
+        'usage' and 'updated' timestamp
+    now: float
+        current timestamp
+    half_life: float
+        hours for usage to halve
+
+    Returns
+    -------
+    usage: float
+    """
+    if not entry:
+        return 0.0
+    hours = max(now - entry['updated'], 0) / 3600
+    return entry['usage'] * 0.5 ** (hours / half_life)
+
+
+def rank(candidates, usage, now, conf=None):
+    """
+    Order queued jobs by score, highest first
+
+    Each job scores its priority plus 'aging' per hour queued, less
+    'share' per unit of its owner's usage. The owner's usage is
+    increased after each pick, so jobs from a single owner are
+    interleaved with everyone else's. Ties keep the queue order.
+
+    Arguments
+    ---------
+    candidates: list
+        dicts with 'id', 'priority', 'owner' and 'enqueued_at'
+        timestamp, in queue order
+    usage: dict
+        decayed usage keyed by owner
+    now: float
+        current timestamp
+    conf: dict
+        as per sched_conf()
+
+    Returns
+    -------
+    order: list
+        job IDs in the order they'll be run
+    """
+    if not conf:
+        conf = sched_conf()
+    usage = dict(usage)
+    remaining = list(candidates)
+    order = []
+    while remaining:
+        best = None
+        best_score = None
+        for cand in remaining:
+            if cand['enqueued_at'] is None:
+                hours = 0
+            else:
+                hours = max(now - cand['enqueued_at'], 0) / 3600
+            score = (cand['priority'] + conf['aging'] * hours
+                     - conf['share'] * usage.get(cand['owner'], 0.0))
+            if best_score is None or score > best_score:
+                best = cand
+                best_score = score
+        remaining.remove(best)
+        order.append(best['id'])
+        usage[best['owner']] = usage.get(best['owner'], 0.0) + 1
+    return order
+
+
+def candidate(job_id, meta, enqueued_at):
+    """
+    Build a rank() candidate from a job's meta data
+
+    Arguments
+    ---------
+    job_id: str
+    meta: dict
+        job meta, with the 'priority' and 'owner' set at submit
+    enqueued_at: datetime | None
+        naive UTC, as set by RQ
+    """
+    try:
+        priority = int(meta.get('priority', DEFAULT_PRIORITY))
+    except (TypeError, ValueError):
+        priority = DEFAULT_PRIORITY
+    return {
+        'id': job_id,
+        'priority': priority,
+        'owner': meta.get('owner'),
+        'enqueued_at': (enqueued_at.replace(tzinfo=timezone.utc).timestamp()
+                        if enqueued_at else None),
+        }
+
+
+def get_usage(redis_con, now, half_life):
+    """Get the decayed usage for every owner"""
+    entries = redis_con.hgetall(USAGE_KEY)
+    return {as_text(owner): decayed(json.loads(entry), now, half_life)
+            for owner, entry in entries.items()}
+
+
+def add_usage(redis_con, owner, now, half_life):
+    """Record a job started for an owner"""
+    if owner is None:
+        return
+    entry = redis_con.hget(USAGE_KEY, owner)
+    usage = decayed(json.loads(entry) if entry else None, now, half_life)
+    redis_con.hset(USAGE_KEY, owner,
+                   json.dumps({'usage': usage + 1, 'updated': now}))
+
+
+def order_jobs(jobs, redis_con, now=None):
+    """
+    Order queued job objects as the scheduler will run them, for
+    queue status views
+
+    Arguments
+    ---------
+    jobs: list
+        RQ job objects, in queue order
+
+    Returns
+    -------
+    order: list
+        job IDs
+    """
+    conf = sched_conf()
+    if not conf['enabled']:
+        return [job.id for job in jobs]
+    if not now:
+        now = time.time()
+    usage = get_usage(redis_con, now, conf['half_life'])
+    candidates = [candidate(job.id, job.meta, job.enqueued_at)
+                  for job in jobs]
+    return rank(candidates, usage, now, conf)
+
+
+class FairQueue(Queue):
+    """
+    RQ queue class choosing the next job by priority, fair share and
+    aging rather than FIFO
+
+    Used by the cracking worker with --queue-class. The queue list
+    itself is left in submission order, the chosen job is removed with
+    LREM so concurrent workers can't both claim it.
+    """
+    @classmethod
+    def pick(cls, queue, connection, serializer, now, conf):
+        """
+        Choose and claim the best job from a queue
+
+        Returns
+        -------
+        job_id: str | None
+            None if the queue is empty or the job was claimed by
+            another worker
+        """
+        job_ids = [as_text(j) for j in connection.lrange(queue.key, 0, -1)]
+        if not job_ids:
+            return None
+        pipe = connection.pipeline()
+        for job_id in job_ids:
+            pipe.hmget(Job.key_for(job_id), 'meta', 'enqueued_at')
+        candidates = []
+        for job_id, (meta, enqueued_at) in zip(job_ids, pipe.execute()):
+            try:
+                meta = serializer.loads(meta) if meta else {}
+            except Exception:
+                meta = {}
+            enqueued_at = utcparse(as_text(enqueued_at)) if enqueued_at else None
+            candidates.append(candidate(job_id, meta, enqueued_at))
+        usage = get_usage(connection, now, conf['half_life'])
+        job_id = rank(candidates, usage, now, conf)[0]
+        if not connection.lrem(queue.key, 1, job_id):
+            return None
+        owner = [c['owner'] for c in candidates if c['id'] == job_id][0]
+        add_usage(connection, owner, now, conf['half_life'])
+        logger.debug('Scheduler picked job: {}'.format(job_id))
+        return job_id
+
+    @classmethod
+    def dequeue_any(cls, queues, timeout, connection=None, job_class=None,
+                    serializer=None, death_penalty_class=None):
+        """
+        Dequeue the best job from the first non-empty queue, falling
+        back to RQ's blocking pop while all queues are empty
+        """
+        conf = sched_conf()
+        job_class = job_class or Job
+        serializer = resolve_serializer(serializer)
+        # retry a few times if other workers claim the chosen jobs first
+        for _ in range(10):
+            if not conf['enabled']:
+                break
+            queued = False
+            for queue in queues:
+                queue_con = connection or queue.connection
+                job_id = cls.pick(queue, queue_con, serializer, time.time(), conf)
+                if not job_id:
+                    queued = queued or queue_con.llen(queue.key) > 0
+                    continue
+                try:
+                    job = job_class.fetch(job_id, connection=queue_con,
+                                          serializer=serializer)
+                except NoSuchJobError:
+                    logger.debug('Picked job missing: {}'.format(job_id))
+                    queued = True
+                    continue
+                return job, queue
+            if not queued:
+                break
+        result = super().dequeue_any(queues, timeout, connection=connection,
+                                     job_class=job_class, serializer=serializer,
+                                     death_penalty_class=death_penalty_class)
+        if result and conf['enabled']:
+            job, queue = result
+            add_usage(connection or queue.connection, job.meta.get('owner'),
+                      time.time(), conf['half_life'])
+        return result
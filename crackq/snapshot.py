@@ -0,0 +1,253 @@
+"""Batched queue status snapshot for the queuing API"""
+import json
+import time
+
+from crackq import crackqueue, jobspec, scheduler
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from crackq.validator import FileValidation as valid
+from redis import Redis
+from rq.job import Job
+from rq.registry import (
+    FailedJobRegistry,
+    FinishedJobRegistry,
+    StartedJobRegistry,
+    )
+from rq.serializers import JSONSerializer
+from rq.worker import Worker
+
+
+CRACK_CONF = hc_conf()
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+STATS_KEY = 'crackq:snapshot:stats'
+
+
+def cache_conf():
+    """
+    Get the snapshot cache settings from the config file, using defaults
+    if the section is missing
+
+    Returns
+    -------
+    conf_dict: dict
+        'ttl' and 'lock_timeout' integer settings in milliseconds
+    """
+    conf_dict = {
+        'ttl': 2000,
+        'lock_timeout': 5000,
+        }
+    if 'snapshot' in CRACK_CONF:
+        for key in conf_dict:
+            if key in CRACK_CONF['snapshot']:
+                conf_dict[key] = int(CRACK_CONF['snapshot'][key])
+    return conf_dict
+
+
+def cache_key(queue_name):
+    """Cached snapshot key for a queue"""
+    return 'crackq:snapshot:{}'.format(queue_name)
+
+
+def invalidate(queue_name='default'):
+    """
+    Drop the cached snapshot for a queue, called on job state
+    transitions so the next request rebuilds it
+    """
+    try:
+        redis_con.delete(cache_key(queue_name))
+    except Exception as err:
+        logger.debug('Failed to invalidate snapshot: {}'.format(err))
+
+
+def stats():
+    """
+    Get the snapshot cache hit/miss counters
+
+    Returns
+    -------
+    stats_dict: dict
+        'hits' and 'misses' counts
+    """
+    counts = redis_con.hgetall(STATS_KEY)
+    return {
+        'hits': int(counts.get(b'hits', 0)),
+        'misses': int(counts.get(b'misses', 0)),
+        }
+
+
+def cached(q_obj):
+    """
+    Get a queue snapshot shared between all API workers
+
+    The snapshot is cached in Redis with a short TTL, a lock ensures
+    only one worker rebuilds it on a miss while the others wait for
+    the result.
+
+    Arguments
+    ---------
+    q_obj: object
+        RQ queue object
+
+    Returns
+    -------
+    snap: dict
+        as per QueueSnapshot.build()
+    """
+    conf = cache_conf()
+    key = cache_key(q_obj.name)
+    lock_key = '{}:lock'.format(key)
+    deadline = time.time() + conf['lock_timeout'] / 1000
+    while True:
+        snap = redis_con.get(key)
+        if snap:
+            redis_con.hincrby(STATS_KEY, 'hits', 1)
+            return json.loads(snap)
+        if redis_con.set(lock_key, 1, nx=True, px=conf['lock_timeout']):
+            break
+        if time.time() > deadline:
+            logger.debug('Timed out waiting for snapshot, building')
+            break
+        time.sleep(0.05)
+    redis_con.hincrby(STATS_KEY, 'misses', 1)
+    try:
+        snap = QueueSnapshot(q_obj).build()
+        redis_con.set(key, json.dumps(snap), px=conf['ttl'])
+    finally:
+        redis_con.delete(lock_key)
+    return snap
+
+
+class QueueSnapshot(object):
+    """
+    Build a JSON serializable view of every job in a queue
+
+    All job ID lists are read in one Redis pipeline and all job
+    hashes are then loaded in a second pipeline using Job.fetch_many,
+    rather than a fetch_job call per job.
+    """
+    def __init__(self, q_obj):
+        self.q = q_obj
+        self.redis_con = q_obj.connection
+        self.crack_q = crackqueue.Queuer()
+        self.log_dir = CRACK_CONF['files']['log_dir']
+
+    def job_ids(self):
+        """
+        Get the queued, started, failed and finished job ID lists
+
+        Returns
+        -------
+        id_dict: dict
+            lists of job IDs keyed by status
+        """
+        registries = [
+            StartedJobRegistry(queue=self.q),
+            FailedJobRegistry(queue=self.q),
+            FinishedJobRegistry(queue=self.q),
+            ]
+        pipe = self.redis_con.pipeline()
+        pipe.lrange(self.q.key, 0, -1)
+        for registry in registries:
+            pipe.zrange(registry.key, 0, -1)
+        queued, started, failed, finished = pipe.execute()
+        id_dict = {
+            'queued': [j.decode() for j in queued],
+            'started': [j.decode() for j in started],
+            'failed': [j.decode() for j in failed],
+            'finished': [j.decode() for j in finished],
+            }
+        return id_dict
+
+    def state_file(self, job_id):
+        """
+        Read cracked/total counts from the CrackQ json state file, used
+        when a job has no HC State yet
+        """
+        job_file = valid.val_filepath(path_string=self.log_dir,
+                                      file_string='{}.json'.format(job_id))
+        try:
+            with open(job_file, 'r') as jobfile_fh:
+                return json.loads(jobfile_fh.read().strip())
+        except (IOError, ValueError) as err:
+            logger.debug('Failed to open job file: {}'.format(err))
+            return None
+
+    def job_state(self, job, status, job_details):
+        """
+        Build the job state dict, as per Queuer.q_jobstate, without
+        any further Redis calls
+
+        Arguments
+        ---------
+        job: object
+            RQ job object
+        status: str
+            registry the job was found in
+        job_details: dict
+            job spec, from jobspec.details_many()
+
+        Returns
+        -------
+        job_dict: dictionary
+            job stats, meta data and job details
+        """
+        job_dict = {
+            'Status': status,
+            'Time started': str(job.started_at),
+            'Time finished': str(job.ended_at),
+            'Result': None,
+            'State': job.meta,
+            }
+        if 'HC State' not in job.meta and status != 'failed':
+            job_deets = self.state_file(job.id)
+            if job_deets:
+                try:
+                    job_dict['State']['HC State'] = {
+                        'Cracked Hashes': job_deets['Cracked Hashes'],
+                        'Total Hashes': job_deets['Total Hashes'],
+                        'Progress': 0,
+                        }
+                except KeyError as err:
+                    logger.debug('Invalid job file: {}'.format(err))
+        job_dict['Job Details'] = job_details
+        if status == 'failed':
+            job_dict['Error'] = self.crack_q.error_parser(job)
+        return job_dict
+
+    def build(self):
+        """
+        Build the queue snapshot
+
+        Returns
+        -------
+        snap: dict
+            job ID lists keyed by status plus a 'jobs' dict containing
+            the state for each job and the number of 'workers'. Queued
+            jobs are listed in the order the scheduler will run them
+        """
+        snap = self.job_ids()
+        snap['workers'] = Worker.count(queue=self.q)
+        all_ids = [j for status in ['queued', 'started', 'failed', 'finished']
+                   for j in snap[status]]
+        jobs = Job.fetch_many(all_ids, connection=self.redis_con,
+                              serializer=JSONSerializer)
+        job_dict = dict(zip(all_ids, jobs))
+        spec_dict = jobspec.details_many([job for job in jobs if job])
+        snap['jobs'] = {}
+        for status in ['queued', 'started', 'failed', 'finished']:
+            present = []
+            for job_id in snap[status]:
+                job = job_dict[job_id]
+                if job is None:
+                    logger.debug('Job is missing: {}'.format(job_id))
+                    continue
+                present.append(job_id)
+                if job_id not in snap['jobs']:
+                    snap['jobs'][job_id] = self.job_state(job, status,
+                                                          spec_dict[job_id])
+            snap[status] = present
+        snap['queued'] = scheduler.order_jobs([job_dict[job_id] for job_id
+                                               in snap['queued']],
+                                              self.redis_con)
+        return snap
@@ -0,0 +1,159 @@
+"""Cache of measured speed check results, keyed by job shape"""
+import hashlib
+import json
+import os
+
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from crackq.validator import FileValidation as valid
+from redis import Redis
+from redis.exceptions import RedisError
+
+CRACK_CONF = hc_conf()
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+log_dir = CRACK_CONF['files']['log_dir']
+# rule line counts keyed by (path, mtime)
+rule_counts = {}
+
+
+def cache_conf():
+    """
+    Get the speed cache settings from the config file, using defaults
+    if the section is missing
+
+    Returns
+    -------
+    conf_dict: dict
+        'ttl' in seconds (0 disables the cache) and 'device'
+        fingerprint override
+    """
+    conf_dict = {
+        'ttl': 604800,
+        'device': None,
+        }
+    if 'speedcache' in CRACK_CONF:
+        if 'ttl' in CRACK_CONF['speedcache']:
+            conf_dict['ttl'] = int(CRACK_CONF['speedcache']['ttl'])
+        conf_dict['device'] = CRACK_CONF['speedcache'].get('device') or None
+    return conf_dict
+
+
+def bucket(count):
+    """Logarithmic bucket for a count, i.e. 0, 1, 2-3, 4-7..."""
+    return int(count).bit_length()
+
+
+def rule_lines(rules):
+    """
+    Count the rules in a list of rule files, cached by file mtime
+
+    Arguments
+    ---------
+    rules: list
+        rule file paths
+
+    Returns
+    -------
+    count: int
+        total rule count, the product for multiple rule files as per
+        hashcat
+    """
+    if not rules:
+        return 0
+    count = 1
+    for rule in rules:
+        try:
+            key = (rule, os.stat(rule).st_mtime)
+        except OSError as err:
+            logger.debug('Rule file error: {}'.format(err))
+            return 0
+        if key not in rule_counts:
+            with open(rule, 'rb') as fh_rule:
+                rule_counts[key] = sum(1 for line in fh_rule
+                                       if line.strip() and not line.startswith(b'#'))
+        count *= rule_counts[key]
+    return count
+
+
+def device_fingerprint():
+    """
+    Get a fingerprint for the cracking devices, either from the config
+    file or the checksum of the last system benchmark
+    """
+    device = cache_conf()['device']
+    if device:
+        return device
+    bench_file = valid.val_filepath(path_string=log_dir,
+                                    file_string='sys_benchmark.json')
+    try:
+        with open(bench_file, 'rb') as bench_fh:
+            return hashlib.sha1(bench_fh.read()).hexdigest()[:12]
+    except (IOError, TypeError):
+        return 'default'
+
+
+def cache_key(hash_mode, attack_mode, rules, hash_count):
+    """
+    Speed cache key for a job shape
+
+    Arguments
+    ---------
+    hash_mode: int
+    attack_mode: int
+    rules: list
+        rule file paths
+    hash_count: int
+        number of hashes, used as an upper bound for the salt count
+
+    Returns
+    -------
+    key: str
+    """
+    return 'crackq:speedcache:{}:{}:{}:{}:{}'.format(
+        hash_mode, attack_mode, bucket(rule_lines(rules)),
+        bucket(hash_count), device_fingerprint())
+
+
+def store(hash_mode, attack_mode, rules, hash_count, speed, salts):
+    """
+    Store a measured speed check result
+
+    Arguments
+    ---------
+    speed: int
+        measured speed from the speed check
+    salts: int
+        salt count reported by hashcat
+    """
+    ttl = cache_conf()['ttl']
+    if ttl < 1:
+        return
+    key = cache_key(hash_mode, attack_mode, rules, hash_count)
+    try:
+        redis_con.set(key, json.dumps({'speed': speed, 'salts': salts}),
+                      ex=ttl)
+        logger.debug('Speed cached: {}'.format(key))
+    except RedisError as err:
+        logger.debug('Failed to cache speed: {}'.format(err))
+
+
+def lookup(hash_mode, attack_mode, rules, hash_count):
+    """
+    Get a cached speed check result for a job shape
+
+    Returns
+    -------
+    result: dict | None
+        'speed' and 'salts' or None on a miss
+    """
+    if cache_conf()['ttl'] < 1:
+        return None
+    key = cache_key(hash_mode, attack_mode, rules, hash_count)
+    try:
+        result = redis_con.get(key)
+    except RedisError as err:
+        logger.debug('Failed to get cached speed: {}'.format(err))
+        return None
+    logger.debug('Speed cache {}: {}'.format('hit' if result else 'miss', key))
+    return json.loads(result) if result else None
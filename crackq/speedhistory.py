@@ -0,0 +1,188 @@
+"""Job speed history, kept in Redis at full and downsampled resolution"""
+import math
+import time
+
+from crackq import statuswriter
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from redis import Redis
+
+CRACK_CONF = hc_conf()
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+# entries in the Speed Array kept in job state for the dashboard
+SPEED_ARRAY = 180
+# append a point to the fine list, rolling the coarse bucket average
+# into the coarse list when a new bucket starts
+RECORD_LUA = """
+local fine, coarse, acc = KEYS[1], KEYS[2], KEYS[3]
+local ts, speed = ARGV[1], ARGV[2]
+local fine_len, period = tonumber(ARGV[3]), tonumber(ARGV[4])
+local coarse_len, ttl = tonumber(ARGV[5]), tonumber(ARGV[6])
+redis.call('RPUSH', fine, ts .. ':' .. speed)
+redis.call('LTRIM', fine, -fine_len, -1)
+local bucket = string.format('%.0f', math.floor(tonumber(ts) / period) * period)
+local cur = redis.call('HGET', acc, 'bucket')
+if cur and cur ~= bucket then
+    local sum = tonumber(redis.call('HGET', acc, 'sum'))
+    local count = tonumber(redis.call('HGET', acc, 'count'))
+    redis.call('RPUSH', coarse, cur .. ':' .. string.format('%.0f', math.floor(sum / count)))
+    redis.call('LTRIM', coarse, -coarse_len, -1)
+    redis.call('DEL', acc)
+end
+redis.call('HSET', acc, 'bucket', bucket)
+redis.call('HINCRBY', acc, 'sum', speed)
+redis.call('HINCRBY', acc, 'count', 1)
+for _, key in ipairs(KEYS) do
+    redis.call('EXPIRE', key, ttl)
+end
+return 1
+"""
+
+
+def history_conf():
+    """
+    Get the speed history settings from the config file, using defaults
+    if the section is missing
+
+    Returns
+    -------
+    conf_dict: dict
+        'fine_window' seconds kept at full resolution, 'coarse_period'
+        seconds averaged into each coarse point, 'coarse_len' maximum
+        coarse points and 'ttl' seconds history is kept after the last
+        update
+    """
+    conf_dict = {
+        'fine_window': 3600,
+        'coarse_period': 600,
+        'coarse_len': 10000,
+        'ttl': 2592000,
+        }
+    if 'speedhistory' in CRACK_CONF:
+        for key in conf_dict:
+            if key in CRACK_CONF['speedhistory']:
+                conf_dict[key] = int(CRACK_CONF['speedhistory'][key])
+    return conf_dict
+
+
+def history_keys(job_id):
+    """Redis keys for a job's fine, coarse and partial bucket history"""
+    return ['crackq:speed:{}:{}'.format(job_id, res)
+            for res in ['fine', 'coarse', 'acc']]
+
+
+def record(job_id, speed, now=None):
+    """
+    Add a speed sample to a job's history
+
+    Arguments
+    ---------
+    job_id: str
+    speed: int
+        hashcat 'Speed Raw' in H/s
+    """
+    conf = history_conf()
+    if now is None:
+        now = time.time()
+    # status writes are at most every interval, so this many points
+    # covers the fine window
+    fine_len = max(math.ceil(conf['fine_window'] / max(statuswriter.status_conf(), 1)),
+                   SPEED_ARRAY)
+    try:
+        script = redis_con.register_script(RECORD_LUA)
+        script(keys=history_keys(job_id),
+               args=[int(now), int(speed), fine_len, conf['coarse_period'],
+                     conf['coarse_len'], conf['ttl']])
+    except Exception as err:
+        logger.debug('Failed to record speed history: {}'.format(err))
+
+
+def parse_points(entries):
+    """
+    Parse 'timestamp:speed' list entries
+
+    Returns
+    -------
+    points: list
+        [timestamp, speed] integer pairs
+    """
+    points = []
+    for entry in entries:
+        if isinstance(entry, bytes):
+            entry = entry.decode()
+        try:
+            ts, speed = entry.split(':', 1)
+            points.append([int(ts), int(speed)])
+        except ValueError:
+            logger.debug('Invalid speed history entry: {}'.format(entry))
+    return points
+
+
+def partial(acc):
+    """
+    Get the average of the coarse bucket still being filled
+
+    Arguments
+    ---------
+    acc: dict
+        'bucket', 'sum' and 'count' hash from Redis
+
+    Returns
+    -------
+    point: list | None
+        [timestamp, speed], None if the bucket is empty
+    """
+    acc = {(k.decode() if isinstance(k, bytes) else k): int(v)
+           for k, v in acc.items()}
+    if not acc.get('count'):
+        return None
+    return [acc['bucket'], acc['sum'] // acc['count']]
+
+
+def history(job_id):
+    """
+    Get a job's speed history
+
+    Returns
+    -------
+    history_dict: dict
+        'Fine' points covering the last fine_window and 'Coarse' points
+        for the whole run, including the partial current bucket
+    """
+    fine, coarse, acc = history_keys(job_id)
+    pipe = redis_con.pipeline()
+    pipe.lrange(fine, 0, -1)
+    pipe.lrange(coarse, 0, -1)
+    pipe.hgetall(acc)
+    fine_list, coarse_list, acc_dict = pipe.execute()
+    coarse_list = parse_points(coarse_list)
+    current = partial(acc_dict)
+    if current:
+        coarse_list.append(current)
+    return {
+        'Fine': parse_points(fine_list),
+        'Coarse': coarse_list,
+        }
+
+
+def recent(job_id, count=SPEED_ARRAY):
+    """
+    Get the most recent speeds, in the format of the old job meta
+    'Speed Array'
+
+    Returns
+    -------
+    speed_list: list
+    """
+    try:
+        entries = redis_con.lrange(history_keys(job_id)[0], -count, -1)
+    except Exception as err:
+        logger.debug('Failed to get speed history: {}'.format(err))
+        return []
+    return [speed for _, speed in parse_points(entries)]
+
+
+def delete(job_id):
+    """Remove a job's speed history"""
+    redis_con.delete(*history_keys(job_id))
@@ -0,0 +1,114 @@
+"""Throttled job status writes from hashcat callbacks"""
+import json
+import os
+import time
+
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from redis.exceptions import WatchError
+from rq.job import Job
+from rq.serializers import JSONSerializer
+
+CRACK_CONF = hc_conf()
+
+
+def status_conf():
+    """
+    Get the status write interval in seconds from the config file,
+    using the default if the section is missing
+    """
+    if 'status' in CRACK_CONF:
+        return float(CRACK_CONF['status'].get('interval', 5))
+    return 5.0
+
+
+def write_json(path, data):
+    """
+    Write a JSON file atomically, so readers never see a partial file
+    """
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as tmp_fh:
+        tmp_fh.write(json.dumps(data))
+    os.replace(tmp_path, str(path))
+
+
+def update_meta(redis_con, job_id, update):
+    """
+    Update a job's meta in a single transaction, without overwriting
+    changes made elsewhere, such as the API setting 'CrackQ State'
+
+    Arguments
+    ---------
+    redis_con: object
+        redis connection
+    job_id: str
+    update: function
+        called with the current meta dict to modify it in place
+
+    Returns
+    -------
+    meta: dict | None
+        updated meta, None if the job doesn't exist
+    """
+    key = Job.key_for(job_id)
+    with redis_con.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                if not pipe.exists(key):
+                    return None
+                meta = pipe.hget(key, 'meta')
+                meta = JSONSerializer.loads(meta) if meta else {}
+                update(meta)
+                pipe.multi()
+                pipe.hset(key, 'meta', JSONSerializer.dumps(meta))
+                pipe.execute()
+                return meta
+            except WatchError:
+                logger.debug('Job meta changed during update, retrying')
+
+
+class StatusWriter(object):
+    """
+    Coalesce status writes for hashcat sessions
+
+    Cracked and init callbacks can fire many times a second, a write is
+    only due when the hashcat state changes or the interval has passed
+    since the session's last write. Job details, which don't change
+    while a session runs, are cached per session.
+    """
+    def __init__(self, interval=None):
+        self.interval = status_conf() if interval is None else interval
+        self.last = {}
+        self.details = {}
+
+    def due(self, session, state, force=False, now=None):
+        """
+        Check if a status write is due, recording it if so
+
+        Arguments
+        ---------
+        session: str
+            hashcat session name
+        state: str
+            current hashcat state
+        force: boolean
+            always write, i.e. when the session finishes
+
+        Returns
+        -------
+        boolean
+        """
+        if now is None:
+            now = time.time()
+        last = self.last.get(session)
+        if (force or last is None or last[1] != state
+                or now - last[0] >= self.interval):
+            self.last[session] = (now, state)
+            return True
+        return False
+
+    def forget(self, session):
+        """Drop the state kept for a finished session"""
+        self.last.pop(session, None)
+        self.details.pop(session, None)
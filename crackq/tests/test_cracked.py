@@ -0,0 +1,21 @@
+from crackq import cracked
+from crackq.cracked import CrackedIndex
+
+
+def test_read_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(cracked, 'INDEX_EVERY', 4)
+    cracked_file = tmp_path / 'job.cracked'
+    cracked_file.write_text(''.join('hash{}:pass{}\n'.format(i, i)
+                                    for i in range(10)) + 'partial')
+    index = CrackedIndex(str(cracked_file))
+    lines, total = index.read(offset=5, limit=3)
+    assert total == 10
+    assert lines == ['hash5:pass5', 'hash6:pass6', 'hash7:pass7']
+    with open(str(cracked_file), 'a') as cracked_fh:
+        cracked_fh.write('\nhash11:pass11\n')
+    lines, total = index.read(offset=9, limit=10)
+    assert total == 12
+    assert lines == ['hash9:pass9', 'partial', 'hash11:pass11']
+    assert index.read(offset=12) == ([], 12)
+    assert sorted(path.name for path in tmp_path.iterdir()) == \
+        ['job.cracked', 'job.cracked.idx']
@@ -0,0 +1,8 @@
+from crackq.devices import parse_groups
+
+
+def test_parse_groups():
+    assert parse_groups('') == []
+    assert parse_groups('1,2,3,4;5,6*2; 7', concurrency=1) == [
+        ('1,2,3,4', 1), ('5,6', 2), ('7', 1)]
+    assert parse_groups('1;2', concurrency=3) == [('1', 3), ('2', 3)]
@@ -0,0 +1,33 @@
+from crackq.distrib import Coordinator, slice_ranges
+
+
+def test_slice_ranges():
+    ranges = slice_ranges(1003, 4)
+    assert len(ranges) == 4
+    assert ranges[0] == (0, 251)
+    assert sum(limit for skip, limit in ranges) == 1003
+    for (skip, limit), (next_skip, _) in zip(ranges, ranges[1:]):
+        assert skip + limit == next_skip
+
+
+def test_slice_ranges_small_keyspace():
+    ranges = slice_ranges(3, 8)
+    assert ranges == [(0, 1), (1, 1), (2, 1)]
+
+
+def test_pot_cracked_sliced(monkeypatch):
+    # 1000 hashes, 600 resolved from the potfile at submit
+    slice_dict = {str(index): {'skip': index * 50, 'limit': 50, 'restore': 0,
+                               'state': 'Queued', 'cracked': 0, 'total': 0,
+                               'speed': 0, 'retries': 0} for index in range(2)}
+    coord = Coordinator('job')
+    monkeypatch.setattr(coord, 'slices', lambda: slice_dict)
+    status_dict = coord.progress(600, pot_cracked=600)
+    assert coord.complete(status_dict, pot_cracked=600) is None
+    for state in slice_dict.values():
+        state.update(state='Running', total=400)
+    status_dict = coord.progress(600, pot_cracked=600)
+    assert status_dict['Total Hashes'] == 1000
+    assert coord.complete(status_dict, pot_cracked=600) is None
+    status_dict = coord.progress(1000, pot_cracked=600)
+    assert coord.complete(status_dict, pot_cracked=600) == 'Cracked'
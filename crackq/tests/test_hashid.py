@@ -0,0 +1,26 @@
+from pathlib import Path
+
+from crackq.hashid import check, classify, sample_file
+
+TEST_DIR = Path(__file__).parent
+
+
+def test_classify():
+    modes = [mode_d['Mode'] for mode_d in
+             classify(sample_file(TEST_DIR / 'kerb18200_test.hash'))]
+    assert modes == [18200]
+    modes = [mode_d['Mode'] for mode_d in
+             classify(sample_file(TEST_DIR / '16800wpa_test.hash'))]
+    assert modes == [16800]
+    mode_list = classify(['admin:5835048CE94AD0564E29A924A03510EF'],
+                         username=True)
+    assert 1000 in [mode_d['Mode'] for mode_d in mode_list]
+    assert mode_list[0]['Confidence'] == 1
+
+
+def test_check():
+    sample = sample_file(TEST_DIR / 'deadbeef.hashes')
+    assert check(sample, 1000)[0]
+    assert not check(sample, 13100)[0]
+    # modes without a known format aren't rejected
+    assert check(sample, 10)[0]
@@ -0,0 +1,23 @@
+from crackq.hashprep import normalize, prepare
+
+
+def test_normalize():
+    assert normalize(' 5F4DCC3B5AA765D61D8327DEB882CF99 ', 1000) == \
+        '5f4dcc3b5aa765d61d8327deb882cf99'
+    assert normalize('$krb5tgs$23$*User$DOM$spn*$AB12', 13100) == \
+        '$krb5tgs$23$*User$DOM$spn*$AB12'
+
+
+def test_prepare(tmp_path):
+    hash_file = tmp_path / 'job.hashes'
+    hash_file.write_text('alice:8846F7EAEE8FB117AD06BDD830B7586C\n'
+                         'bob:8846f7eaee8fb117ad06bdd830b7586c\n'
+                         '\n'
+                         'carol:31d6cfe0d16ae931b73c59d7e0c089c0\n')
+    stats_dict = prepare(str(hash_file), 1000, username=True)
+    assert stats_dict == {'Submitted': 3, 'Unique': 2, 'Duplicates': 1}
+    assert hash_file.read_text() == (
+        'alice:8846f7eaee8fb117ad06bdd830b7586c\n'
+        'carol:31d6cfe0d16ae931b73c59d7e0c089c0\n')
+    assert (tmp_path / 'job.users').read_text().count('\n') == 3
+    assert not (tmp_path / 'job.hashes.dedup').exists()
@@ -0,0 +1,28 @@
+from crackq.jobspec import build, normalise
+
+
+def test_build_types():
+    spec = build({'hash_file': '/tmp/job.hashes', 'hash_mode': 1000,
+                  'attack_mode': 3, 'mask': '?a?a?a', 'mask_file': False,
+                  'wordlist': None, 'wordlist2': None, 'rules': None,
+                  'name': 'job', 'username': False, 'increment': False,
+                  'increment_min': None, 'increment_max': None,
+                  'slices': 2, 'restore': 0})
+    assert 'hash_file' not in spec
+    assert spec['hash_mode'] == 1000
+    assert spec['attack_mode'] == 3
+    assert spec['mask'] == '?a?a?a'
+    assert spec['username'] is False
+    assert spec['increment_min'] is None
+    assert spec['rules'] is None
+
+
+def test_normalise():
+    spec = normalise({'hash_mode': '1000', 'attack_mode': '0',
+                      'mask': 'None', 'wordlist': 'rockyou', 'rules': ['best64'],
+                      'name': 'job', 'username': 'True', 'increment': 'False',
+                      'increment_min': 'None', 'slices': 'None', 'restore': '0'})
+    assert spec == {'hash_mode': 1000, 'attack_mode': 0, 'mask': None,
+                    'wordlist': 'rockyou', 'rules': ['best64'], 'name': 'job',
+                    'username': True, 'increment': False, 'increment_min': None,
+                    'slices': None, 'restore': 0}
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from crackq.estimator import project
+from crackq.keyspace import job_keyspace, mask_keyspace, split_hcmask
+
+
+def test_mask_keyspace():
+    assert mask_keyspace('?l?l?d') == 26 * 26 * 10
+    assert mask_keyspace('abc?d') == 10
+    assert mask_keyspace('?d?d?d', increment=True) == 10 + 100 + 1000
+    assert mask_keyspace('?d?d?d', increment=True, increment_min=2) == 1100
+    assert mask_keyspace('?1?1', custom={'1': 3}) == 9
+
+
+def test_mask_file(tmp_path):
+    assert split_hcmask('?l?d,\\,,?1?2') == ['?l?d', ',', '?1?2']
+    mask_file = tmp_path / 'test.hcmask'
+    mask_file.write_text('# comment\n?d?d\n?l?d,?1?1\nab,?1\n')
+    keyspace, exact = job_keyspace(attack_mode=3, mask=str(mask_file),
+                                   mask_file=True)
+    assert keyspace == 100 + 36 * 36 + 2
+    assert exact
+
+
+def test_wordlist_keyspace(tmp_path):
+    wordlist = tmp_path / 'words.txt'
+    wordlist.write_text('one\ntwo\nthree\n')
+    assert job_keyspace(attack_mode=0, wordlist=str(wordlist)) == (3, True)
+    assert job_keyspace(attack_mode=1, wordlist=str(wordlist),
+                        wordlist2=str(wordlist)) == (9, True)
+    assert job_keyspace(attack_mode=6, wordlist=str(wordlist),
+                        mask='?d?d') == (300, True)
+
+
+def test_project():
+    now = datetime(2020, 1, 1, 12, 0, 0)
+    q_dict = {
+        'Current Job': {
+            'a': {'Time started': '2020-01-01 11:00:00',
+                  'State': {'HC State': {'Progress': 50}}},
+            },
+        'Queued Jobs': {
+            'b': {'State': {'Estimate': {'Seconds': 1800}}},
+            'c': {'State': {}},
+            'd': {'State': {'Estimate': {'Seconds': 60}}},
+            },
+        }
+    project(q_dict, slots=1, now=now)
+    assert q_dict['Current Job']['a']['Projected Finish'] == '2020-01-01 13:00:00'
+    assert q_dict['Queued Jobs']['b']['Projected Start'] == '2020-01-01 13:00:00'
+    assert q_dict['Queued Jobs']['b']['Projected Finish'] == '2020-01-01 13:30:00'
+    assert q_dict['Queued Jobs']['c']['Projected Start'] == '2020-01-01 13:30:00'
+    assert q_dict['Queued Jobs']['c']['Projected Finish'] is None
+    assert q_dict['Queued Jobs']['d']['Projected Start'] is None
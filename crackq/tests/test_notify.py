@@ -0,0 +1,62 @@
+import smtplib
+
+from crackq.notify import SMTPPool, build, summarize
+
+
+class StubSMTP(object):
+    """Local mail sink recording connections and messages"""
+    connections = 0
+    sent = []
+
+    def __init__(self, host, port, timeout=None):
+        StubSMTP.connections += 1
+        self.dropped = False
+
+    def sendmail(self, src, dests, msg):
+        if self.dropped:
+            raise smtplib.SMTPServerDisconnected('Connection dropped')
+        StubSMTP.sent.append((src, dests, msg))
+
+    def noop(self):
+        return (250, b'OK')
+
+    def quit(self):
+        pass
+
+
+CONF = {
+    'mail_server': 'localhost',
+    'mail_port': 25,
+    'tls': False,
+    }
+
+
+def test_pool_reuse():
+    StubSMTP.connections = 0
+    StubSMTP.sent = []
+    pool = SMTPPool(conf=CONF, factory=StubSMTP)
+    msg = build('crackq@example.com', 'user@example.com', 'CrackQ: Test')
+    pool.send('crackq@example.com', 'user@example.com', msg)
+    pool.send('crackq@example.com', 'user@example.com', msg)
+    assert StubSMTP.connections == 1
+    pool.server.dropped = True
+    pool.send('crackq@example.com', 'user@example.com', msg)
+    assert StubSMTP.connections == 2
+    assert len(StubSMTP.sent) == 3
+    assert 'Subject: CrackQ: Test' in StubSMTP.sent[0][2]
+
+
+def test_summarize():
+    events = [
+        {'Event': 'Cracked', 'Job ID': 'a1', 'Name': 'dc01', 'Task ID': 't1'},
+        {'Event': 'Complete', 'Job ID': 'a1', 'Name': 'dc01', 'Task ID': 't1'},
+        {'Event': 'Complete', 'Job ID': 'b2', 'Name': 'dc02', 'Task ID': 't1'},
+        {'Event': 'Cracked', 'Job ID': 'c3', 'Name': None, 'Task ID': None},
+        ]
+    sub, body = summarize(events)
+    assert sub == 'CrackQ: 3 jobs updated'
+    assert 'Jobs with cracked hashes: 2' in body
+    assert 'Jobs complete: 2' in body
+    assert 'Task t1:' in body
+    assert '  dc01: Cracked, Complete' in body
+    assert '  c3: Cracked' in body
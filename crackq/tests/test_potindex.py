@@ -0,0 +1,83 @@
+from crackq import potindex
+from crackq.potindex import PotIndex, md4, split_points
+
+
+def test_split_points():
+    assert split_points('abc:pass:word') == [('abc', 'pass:word'),
+                                             ('abc:pass', 'word')]
+    assert split_points('nocolon') == []
+
+
+def test_pot_index(tmp_path):
+    pot_path = tmp_path / 'crackq.pot'
+    pot_path.write_text('5f4dcc3b5aa765d61d8327deb882cf99:password\n'
+                        'admin::dom:1122:aabb:ccdd:pass:1\n')
+    pot_index = PotIndex(pot_path=str(pot_path),
+                         db_path=str(tmp_path / 'pot.db'),
+                         wordlist_path=str(tmp_path / 'pot_wordlist.txt'))
+    assert pot_index.update() == 2
+    assert pot_index.update() == 0
+    found = pot_index.lookup(['5f4dcc3b5aa765d61d8327deb882cf99',
+                              'admin::dom:1122:aabb:ccdd',
+                              'deadbeef'])
+    assert found == {'5f4dcc3b5aa765d61d8327deb882cf99': 'password',
+                     'admin::dom:1122:aabb:ccdd': 'pass:1'}
+    # partial lines are left for the next update
+    with pot_path.open('a') as fh_pot:
+        fh_pot.write('deadbeef:beef\ncafe')
+    assert pot_index.update() == 1
+    found = pot_index.lookup(['bob:deadbeef', 'alice:cafe'], username=True)
+    assert found == {'bob:deadbeef': 'beef'}
+    pot_index.close()
+
+
+def test_pot_index_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(potindex, 'READ_SIZE', 16)
+    pot_path = tmp_path / 'crackq.pot'
+    lines = ['{:032x}:pass{}'.format(num, num) for num in range(20)]
+    pot_path.write_text('\n'.join(lines) + '\npartial')
+    pot_index = PotIndex(pot_path=str(pot_path),
+                         db_path=str(tmp_path / 'pot.db'),
+                         wordlist_path=str(tmp_path / 'pot_wordlist.txt'))
+    assert pot_index.pending() == pot_path.stat().st_size
+    assert pot_index.update() == 20
+    assert pot_index.pending() == len('partial')
+    assert pot_index.lookup(['{:032x}'.format(19)]) == {'{:032x}'.format(19): 'pass19'}
+    pot_index.close()
+
+
+def test_pot_wordlist(tmp_path):
+    pot_path = tmp_path / 'crackq.pot'
+    wordlist_path = tmp_path / 'pot_wordlist.txt'
+    wordlist_path.write_text('stale\n')
+    pot_path.write_text('aaaa:password\nbbbb:password\ncccc:letmein\n')
+    pot_index = PotIndex(pot_path=str(pot_path),
+                         db_path=str(tmp_path / 'pot.db'),
+                         wordlist_path=str(wordlist_path))
+    pot_index.update()
+    assert wordlist_path.read_text() == 'password\nletmein\n'
+    with pot_path.open('a') as fh_pot:
+        fh_pot.write('dddd:letmein\neeee:qwerty\n')
+    pot_index.update()
+    assert wordlist_path.read_text() == 'password\nletmein\nqwerty\n'
+    pot_index.close()
+
+
+def test_md4():
+    assert md4(b'') == '31d6cfe0d16ae931b73c59d7e0c089c0'
+    assert md4(b'abc') == 'a448017aaf21d8525fc10ae87aa6729d'
+
+
+def test_lookup_mode(tmp_path):
+    pot_path = tmp_path / 'crackq.pot'
+    # mode 10 md5($pass.$salt) line, whose hash is a valid mode 0 hash
+    pot_path.write_text('5f4dcc3b5aa765d61d8327deb882cf99:salt:pass\n'
+                        '8846f7eaee8fb117ad06bdd830b7586c:$HEX[70617373776f7264]\n')
+    pot_index = PotIndex(pot_path=str(pot_path),
+                         db_path=str(tmp_path / 'pot.db'),
+                         wordlist_path=str(tmp_path / 'pot_wordlist.txt'))
+    pot_index.update()
+    assert pot_index.lookup(['5f4dcc3b5aa765d61d8327deb882cf99'], hash_mode=0) == {}
+    assert pot_index.lookup(['8846f7eaee8fb117ad06bdd830b7586c'], hash_mode=1000) == \
+        {'8846f7eaee8fb117ad06bdd830b7586c': '$HEX[70617373776f7264]'}
+    pot_index.close()
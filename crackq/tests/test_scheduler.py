@@ -0,0 +1,27 @@
+from crackq.scheduler import decayed, rank
+
+CONF = {'aging': 1.0, 'share': 2.0, 'half_life': 24.0, 'enabled': True}
+
+
+def cand(job_id, owner, priority=5, enqueued_at=0):
+    return {'id': job_id, 'owner': owner, 'priority': priority,
+            'enqueued_at': enqueued_at}
+
+
+def test_rank_fair_share():
+    candidates = [cand('a1', 'a'), cand('a2', 'a'), cand('a3', 'a'),
+                  cand('b1', 'b')]
+    assert rank(candidates, {}, 0, CONF) == ['a1', 'b1', 'a2', 'a3']
+    assert rank(candidates, {'a': 3.0}, 0, CONF) == ['b1', 'a1', 'a2', 'a3']
+
+
+def test_rank_priority_aging():
+    candidates = [cand('low', 'a', priority=2, enqueued_at=0),
+                  cand('high', 'b', priority=8, enqueued_at=36000)]
+    assert rank(candidates, {}, 36000, CONF) == ['low', 'high']
+    assert rank(candidates, {}, 3600, CONF)[0] == 'high'
+
+
+def test_decayed():
+    assert decayed(None, 0, 24) == 0
+    assert decayed({'usage': 4, 'updated': 0}, 24 * 3600, 24) == 2
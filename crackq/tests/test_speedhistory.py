@@ -0,0 +1,13 @@
+from crackq.speedhistory import parse_points, partial
+
+
+def test_parse_points():
+    assert parse_points([b'1700000000:1500000', '1700000005:1600000',
+                         b'invalid']) == [[1700000000, 1500000],
+                                          [1700000005, 1600000]]
+
+
+def test_partial():
+    assert partial({b'bucket': b'1700000400', b'sum': b'3000',
+                    b'count': b'4'}) == [1700000400, 750]
+    assert partial({}) is None
@@ -0,0 +1,23 @@
+import json
+
+from crackq.statuswriter import StatusWriter, write_json
+
+
+def test_due():
+    writer = StatusWriter(interval=5)
+    assert writer.due('job', 'Running', now=100)
+    assert not writer.due('job', 'Running', now=103)
+    assert writer.due('job', 'Cracked', now=104)
+    assert not writer.due('job', 'Cracked', now=108)
+    assert writer.due('job', 'Cracked', now=109)
+    assert writer.due('job', 'Cracked', force=True, now=110)
+    writer.forget('job')
+    assert writer.due('job', 'Cracked', now=111)
+
+
+def test_write_json(tmp_path):
+    result_file = tmp_path / 'job.json'
+    write_json(str(result_file), {'Cracked Hashes': 1})
+    write_json(str(result_file), {'Cracked Hashes': 2})
+    assert json.loads(result_file.read_text()) == {'Cracked Hashes': 2}
+    assert not (tmp_path / 'job.json.tmp').exists()
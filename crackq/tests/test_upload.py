@@ -0,0 +1,22 @@
+import gzip
+import io
+
+from crackq.upload import iter_lines, write_hashes
+
+
+def test_iter_lines():
+    chunks = [b'abc\r\nde', b'f\n', b'', b'ghi']
+    assert list(iter_lines(chunks)) == [b'abc', b'def', b'ghi']
+
+
+def test_write_hashes(tmp_path):
+    data = (b'5f4dcc3b5aa765d61d8327deb882cf99\n'
+            b'\n'
+            b'bad hash with spaces\n'
+            b'admin:500:aad3b435b51404eeaad3b435b51404ee\n')
+    for body in [data, gzip.compress(data)]:
+        path = tmp_path / 'test.upload'
+        count_dict = write_hashes(io.BytesIO(body), str(path))
+        assert count_dict == {'Hashes': 2, 'Rejected': 1,
+                              'Rejected Lines': [3]}
+        assert path.read_bytes().count(b'\n') == 2
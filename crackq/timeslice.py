@@ -0,0 +1,122 @@
+"""Time-slice preemption, checkpointing long jobs so queued jobs can run"""
+import time
+
+from crackq import crackqueue, events, snapshot
+from crackq.conf import hc_conf
+from crackq.logger import logger
+
+CRACK_CONF = hc_conf()
+
+
+def slice_conf():
+    """
+    Get the time-slice settings from the config file, using defaults
+    if the section is missing
+
+    Returns
+    -------
+    conf_dict: dict
+        'enabled' and the slice length in 'hours'
+    """
+    conf_dict = {
+        'enabled': False,
+        'hours': 4.0,
+        }
+    if 'timeslice' in CRACK_CONF:
+        if 'enabled' in CRACK_CONF['timeslice']:
+            conf_dict['enabled'] = str(CRACK_CONF['timeslice']['enabled']).lower() == 'true'
+        if 'hours' in CRACK_CONF['timeslice']:
+            conf_dict['hours'] = float(CRACK_CONF['timeslice']['hours'])
+    return conf_dict
+
+
+def preemptable(mask_file=False, increment=False, benchmark=False):
+    """
+    Check if a job can be checkpointed and resumed with a skip value,
+    hashcat doesn't support skip with mask files or increment mode
+    """
+    return slice_conf()['enabled'] and not (mask_file or increment or benchmark)
+
+
+def due(started, q_obj):
+    """
+    Check if the running job has used its time slice and other jobs
+    are waiting
+
+    Arguments
+    ---------
+    started: float
+        timestamp the job started running
+    q_obj: object
+        RQ queue object the job was taken from
+
+    Returns
+    -------
+    boolean
+    """
+    if time.time() - started < slice_conf()['hours'] * 3600:
+        return False
+    return q_obj.count > 0
+
+
+def preempt(job, restore):
+    """
+    Mark a running job as preempted and queue it to be requeued once the
+    worker has finished with it
+
+    The requeue runs on the background queue as a dependent of the job,
+    so it's only added back once RQ has marked the current run finished.
+
+    Arguments
+    ---------
+    job: object
+        RQ job object
+    restore: int
+        restore point to resume from
+    """
+    logger.info('Preempting job {} at restore point {}'.format(job.id, restore))
+    job.meta['CrackQ State'] = 'Preempted'
+    job.save_meta()
+    events.publish(job.id, {'CrackQ State': 'Preempted'}, delta=False)
+    crack_q = crackqueue.Queuer()
+    back_q = crack_q.q_connect(queue='background')
+    back_q.enqueue_call(func=requeue, args=[job.id, restore],
+                        job_id='{}_requeue'.format(job.id),
+                        depends_on=job.id, timeout=600, result_ttl=0)
+
+
+def requeue(job_id, restore):
+    """
+    Add a preempted job back to the queue, resuming from its restore
+    point, run from the background queue
+
+    Jobs stopped or deleted while waiting to be requeued are left alone.
+
+    Arguments
+    ---------
+    job_id: str
+    restore: int
+        restore point to resume from
+
+    Returns
+    -------
+    boolean
+        True if the job was requeued
+    """
+    crack_q = crackqueue.Queuer()
+    q = crack_q.q_connect()
+    job = q.fetch_job(job_id)
+    if not job or job.meta.get('CrackQ State') != 'Preempted':
+        logger.debug('Preempted job no longer waiting: {}'.format(job_id))
+        return False
+    kwargs = dict(job.kwargs)
+    kwargs['restore'] = restore
+    meta = dict(job.meta)
+    meta['CrackQ State'] = 'Run/Restored'
+    meta['Time Slices'] = meta.get('Time Slices', 0) + 1
+    crack_q.q_add(q, {'job_id': job_id, 'kwargs': kwargs},
+                  timeout=job.timeout, meta=meta)
+    snapshot.invalidate(q.name)
+    events.publish(job_id, {'CrackQ State': 'Run/Restored'}, delta=False)
+    logger.info('Requeued preempted job: {}'.format(job_id))
+    return True
@@ -0,0 +1,268 @@
+"""Streaming hash file uploads, validated and written with bounded memory"""
+import json
+import os
+import re
+import time
+import uuid
+import zlib
+
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from crackq.validator import FileValidation as valid
+from redis import Redis
+
+CRACK_CONF = hc_conf()
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+log_dir = CRACK_CONF['files']['log_dir']
+# same character set as the hash_list field in job_schema
+INVALID = re.compile(rb'[^A-Za-z0-9\*\$\@\/\\\.\:\-\_\+\~\#]')
+CHUNK = 65536
+# longest accepted hash line, longer lines are rejected unbuffered
+MAX_LINE = 65536
+# rejected line numbers returned to the client
+MAX_REJECTS = 100
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def upload_conf():
+    """
+    Get the upload settings from the config file, using defaults if the
+    section is missing
+
+    Returns
+    -------
+    conf_dict: dict
+        'max_size' in bytes of uncompressed data and 'ttl' in seconds
+        before an unused upload is removed
+    """
+    conf_dict = {
+        'max_size': 4294967296,
+        'ttl': 86400,
+        }
+    if 'upload' in CRACK_CONF:
+        for key in conf_dict:
+            if key in CRACK_CONF['upload']:
+                conf_dict[key] = int(CRACK_CONF['upload'][key])
+    return conf_dict
+
+
+def upload_key(upload_id):
+    """Redis key for an upload's details"""
+    return 'crackq:upload:{}'.format(upload_id)
+
+
+def upload_path(upload_id):
+    """Location of an uploaded hash file"""
+    return str(valid.val_filepath(path_string=log_dir,
+                                  file_string='{}.upload'.format(upload_id)))
+
+
+def iter_chunks(stream, max_size):
+    """
+    Read a stream in chunks, decompressing gzip input detected by its
+    magic bytes
+
+    Arguments
+    ---------
+    stream: object
+        file-like object to read from
+    max_size: int
+        maximum uncompressed bytes to accept
+
+    Returns
+    -------
+    generator
+        uncompressed data chunks
+    """
+    decomp = None
+    size = 0
+    first = True
+    while True:
+        data = stream.read(CHUNK)
+        if first:
+            first = False
+            if data[:2] == GZIP_MAGIC:
+                logger.debug('Decompressing gzip upload')
+                decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if not data:
+            break
+        if decomp:
+            # bound the output per call so a small input can't expand
+            # into one huge chunk
+            chunk = decomp.decompress(data, CHUNK)
+            while chunk:
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError('Upload too large')
+                yield chunk
+                chunk = decomp.decompress(decomp.unconsumed_tail, CHUNK)
+        else:
+            size += len(data)
+            if size > max_size:
+                raise ValueError('Upload too large')
+            yield data
+    if decomp:
+        chunk = decomp.flush()
+        if chunk:
+            yield chunk
+
+
+def iter_lines(chunks):
+    """
+    Split data chunks into lines, keeping at most MAX_LINE bytes of a
+    partial line
+
+    Returns
+    -------
+    generator
+        lines without line endings, or None for lines over MAX_LINE
+    """
+    buf = b''
+    skipping = False
+    for chunk in chunks:
+        lines = chunk.split(b'\n')
+        lines[0] = buf + lines[0]
+        buf = lines.pop()
+        for line in lines:
+            if skipping:
+                skipping = False
+                yield None
+            elif len(line) > MAX_LINE:
+                yield None
+            else:
+                yield line.rstrip(b'\r')
+        if len(buf) > MAX_LINE:
+            skipping = True
+            buf = b''
+    if skipping:
+        yield None
+    elif buf:
+        yield buf.rstrip(b'\r')
+
+
+def write_hashes(stream, path, max_size=None):
+    """
+    Validate hashes from a stream and write the valid ones to a file
+
+    Arguments
+    ---------
+    stream: object
+        file-like object containing one hash per line, optionally gzip
+        compressed
+    path: str
+        file to write the valid hashes to
+
+    Returns
+    -------
+    count_dict: dict
+        'Hashes' written, 'Rejected' count and the first 'Rejected Lines'
+        line numbers
+    """
+    if max_size is None:
+        max_size = upload_conf()['max_size']
+    count_dict = {
+        'Hashes': 0,
+        'Rejected': 0,
+        'Rejected Lines': [],
+        }
+    with open(path, 'wb') as fh_hashes:
+        for line_num, line in enumerate(iter_lines(iter_chunks(stream,
+                                                               max_size)),
+                                        start=1):
+            if line is not None:
+                line = line.strip()
+                if not line:
+                    continue
+                if not INVALID.search(line):
+                    fh_hashes.write(line + b'\n')
+                    count_dict['Hashes'] += 1
+                    continue
+            count_dict['Rejected'] += 1
+            if len(count_dict['Rejected Lines']) < MAX_REJECTS:
+                count_dict['Rejected Lines'].append(line_num)
+    return count_dict
+
+
+def cleanup():
+    """Remove uploads older than the upload TTL that were never used"""
+    cutoff = time.time() - upload_conf()['ttl']
+    try:
+        for filename in os.listdir(log_dir):
+            if not filename.endswith('.upload'):
+                continue
+            path = os.path.join(log_dir, filename)
+            if os.path.getmtime(path) < cutoff:
+                logger.debug('Removing stale upload: {}'.format(filename))
+                os.remove(path)
+    except OSError as err:
+        logger.debug('Upload cleanup failed: {}'.format(err))
+
+
+def receive(stream, user_id):
+    """
+    Store an uploaded hash file for use by a later job submission
+
+    Arguments
+    ---------
+    stream: object
+        file-like upload body
+    user_id: str
+        uploading user, only they can use the upload
+
+    Returns
+    -------
+    count_dict: dict
+        as per write_hashes(), plus the 'upload_id' if any hashes were
+        accepted
+    """
+    cleanup()
+    upload_id = uuid.uuid4().hex
+    path = upload_path(upload_id)
+    try:
+        count_dict = write_hashes(stream, path)
+    except (ValueError, zlib.error, EOFError) as err:
+        logger.debug('Upload failed: {}'.format(err))
+        os.remove(path)
+        raise ValueError('Invalid upload: {}'.format(err))
+    if count_dict['Hashes'] < 1:
+        os.remove(path)
+        return count_dict
+    redis_con.set(upload_key(upload_id),
+                  json.dumps({'user_id': user_id,
+                              'Hashes': count_dict['Hashes']}),
+                  ex=upload_conf()['ttl'])
+    count_dict['upload_id'] = upload_id
+    logger.info('Hash upload {}: {} hashes, {} rejected'.format(
+        upload_id, count_dict['Hashes'], count_dict['Rejected']))
+    return count_dict
+
+
+def claim(upload_id, user_id, hash_file):
+    """
+    Move an upload to a job's hash file
+
+    Arguments
+    ---------
+    upload_id: str
+    user_id: str
+        submitting user, must match the uploader
+    hash_file: str
+        job hash file location
+
+    Returns
+    -------
+    boolean
+        True if the upload was moved to the hash file
+    """
+    details = redis_con.get(upload_key(upload_id))
+    if not details or json.loads(details)['user_id'] != user_id:
+        logger.debug('Invalid upload ID: {}'.format(upload_id))
+        return False
+    try:
+        os.replace(upload_path(upload_id), hash_file)
+    except OSError as err:
+        logger.error('Failed to claim upload: {}'.format(err))
+        return False
+    redis_con.delete(upload_key(upload_id))
+    return True
@@ -0,0 +1,195 @@
+"""Background indexer for wordlist metadata, line counts and offsets"""
+import gzip
+import hashlib
+import json
+import os
+
+from crackq.conf import hc_conf
+from crackq.logger import logger
+from redis import Redis
+from redis.exceptions import RedisError
+from rq import Queue
+from rq.serializers import JSONSerializer
+
+CRACK_CONF = hc_conf()
+rconf = CRACK_CONF['redis']
+redis_con = Redis(rconf['host'], rconf['port'])
+INDEX_JOB = 'wordindex'
+# lines between entries in the sparse line to offset index
+SPARSE = 1000000
+CHUNK = 1048576
+
+
+class HashingReader(object):
+    """
+    File wrapper updating a checksum as the raw file is read, so
+    compressed wordlists are hashed and decompressed in one pass
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.checksum = hashlib.sha1()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.checksum.update(data)
+        return data
+
+
+def index_key(path):
+    """Redis key for a wordlist's metadata"""
+    return 'crackq:wordindex:{}'.format(path)
+
+
+def scan(path):
+    """
+    Read a wordlist once to build its metadata
+
+    Arguments
+    ---------
+    path: str
+        wordlist location, gzip compressed if it ends with .gz
+
+    Returns
+    -------
+    meta: dict
+        'Lines', uncompressed 'Size', 'Compressed Size', 'SHA1' of the
+        file, 'Average Length' of the words, 'Offsets' list of
+        [line, uncompressed byte offset] every SPARSE lines and the
+        'mtime' it was built from
+    """
+    stat = os.stat(path)
+    lines = 0
+    size = 0
+    offsets = [[0, 0]]
+    next_mark = SPARSE
+    last = b''
+    with open(path, 'rb') as fh_raw:
+        reader = HashingReader(fh_raw)
+        if str(path).endswith('.gz'):
+            fh_words = gzip.GzipFile(fileobj=reader, mode='rb')
+        else:
+            fh_words = reader
+        while True:
+            chunk = fh_words.read(CHUNK)
+            if not chunk:
+                break
+            count = chunk.count(b'\n')
+            pos = -1
+            while lines + count >= next_mark:
+                for _ in range(next_mark - lines):
+                    pos = chunk.find(b'\n', pos + 1)
+                count -= next_mark - lines
+                lines = next_mark
+                offsets.append([next_mark, size + pos + 1])
+                next_mark += SPARSE
+            lines += count
+            size += len(chunk)
+            last = chunk[-1:]
+        # drain any trailing gzip data so the checksum covers the file
+        while reader.read(CHUNK):
+            pass
+    if last and last != b'\n':
+        lines += 1
+    meta = {
+        'Lines': lines,
+        'Size': size,
+        'Compressed Size': stat.st_size,
+        'SHA1': reader.checksum.hexdigest(),
+        'Average Length': round((size - lines) / lines, 2) if lines else 0,
+        'Offsets': offsets,
+        'mtime': stat.st_mtime,
+        }
+    return meta
+
+
+def lookup(path):
+    """
+    Get the cached metadata for a wordlist, if it's still current
+
+    Returns
+    -------
+    meta: dict | None
+        as per scan(), None if not indexed or the file has changed
+    """
+    try:
+        stat = os.stat(path)
+        meta = redis_con.get(index_key(path))
+    except (OSError, TypeError, RedisError) as err:
+        logger.debug('Wordlist index lookup failed: {}'.format(err))
+        return None
+    if not meta:
+        return None
+    meta = json.loads(meta)
+    if (meta['mtime'] != stat.st_mtime
+            or meta['Compressed Size'] != stat.st_size):
+        return None
+    return meta
+
+
+def stale():
+    """Get the configured wordlist paths without current metadata"""
+    return [path for path in CRACK_CONF['wordlists'].values()
+            if os.path.exists(path) and not lookup(path)]
+
+
+def index_all():
+    """
+    Index each configured wordlist that has changed since it was last
+    indexed, run from the background queue
+    """
+    for path in stale():
+        logger.info('Indexing wordlist: {}'.format(path))
+        try:
+            meta = scan(path)
+        except (IOError, OSError, EOFError) as err:
+            logger.error('Failed to index wordlist {}: {}'.format(path, err))
+            continue
+        redis_con.set(index_key(path), json.dumps(meta))
+        logger.info('Indexed wordlist {}: {} lines'.format(path, meta['Lines']))
+
+
+def schedule():
+    """
+    Queue the indexer on the background queue if any wordlist needs
+    indexing and it isn't already queued or running
+
+    Returns
+    -------
+    boolean
+        True if the indexer was queued
+    """
+    try:
+        if not stale():
+            return False
+        q = Queue('background', connection=redis_con,
+                  serializer=JSONSerializer)
+        job = q.fetch_job(INDEX_JOB)
+        if job and job.get_status() in ['queued', 'started']:
+            return False
+        q.enqueue_call(func=index_all, job_id=INDEX_JOB, timeout=86400,
+                       result_ttl=0)
+        logger.debug('Wordlist indexer queued')
+        return True
+    except RedisError as err:
+        logger.error('Failed to queue wordlist indexer: {}'.format(err))
+        return False
+
+
+def summary():
+    """
+    Get the metadata for each configured wordlist, for the options API
+
+    Returns
+    -------
+    info_dict: dict
+        metadata without the offset index, keyed by wordlist name,
+        None for wordlists not yet indexed
+    """
+    info_dict = {}
+    for name, path in CRACK_CONF['wordlists'].items():
+        meta = lookup(path)
+        if meta:
+            meta.pop('Offsets')
+            meta.pop('mtime')
+        info_dict[name] = meta
+    return info_dict